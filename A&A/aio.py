@@ -0,0 +1,140 @@
+"""
+Event loop and bounded executor for the async API views (/api/async/...,
+see app.py).
+
+By default Flask (through asgiref) starts a new event loop, on a new
+thread, for every async view it calls. EventLoopThread replaces that with
+one long-lived loop per process: the request thread submits the view's
+coroutine, with its context, and waits for the result.
+
+sqlite3 and psycopg calls still block. DbExecutor.run() moves one of them
+onto a shared pool of `workers` threads. gather() runs several independent
+ones at once, e.g. the admin dashboard's per-database queries or a cart's
+item lookups, so the request waits for the slowest instead of the sum.
+
+The request and app contexts are copied into the worker, so helpers can
+use current_app, session and g as usual. Admission is bounded the same
+way as the password hash pool: with every worker busy and `max_queue`
+calls already waiting, run() raises ExecutorBusy at once and the view
+answers 503 instead of letting the backlog grow.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class ExecutorBusy(Exception):
+    """Every worker and queue slot is taken."""
+
+
+class EventLoopThread:
+    def __init__(self):
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _running_loop(self):
+        if self._loop is None or self._pid != os.getpid():
+            with self._lock:
+                if self._loop is None or self._pid != os.getpid():
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name='async-views', daemon=True).start()
+                    self._loop, self._pid = loop, os.getpid()
+        return self._loop
+
+    def run(self, coro):
+        """Run coro on the shared loop in the caller's context and block for its result."""
+        loop = self._running_loop()
+        ctx = contextvars.copy_context()
+        done = Future()
+
+        def finish(task):
+            if task.cancelled():
+                done.cancel()
+            elif task.exception() is not None:
+                done.set_exception(task.exception())
+            else:
+                done.set_result(task.result())
+
+        def start():
+            loop.create_task(coro, context=ctx).add_done_callback(finish)
+
+        loop.call_soon_threadsafe(start)
+        return done.result()
+
+    def async_to_sync(self, func):
+        """Drop-in for Flask.async_to_sync."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.run(func(*args, **kwargs))
+        return wrapper
+
+    def stop(self):
+        if self._loop is not None and self._pid == os.getpid():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+class DbExecutor:
+    def __init__(self, workers=8, max_queue=128):
+        self.workers = max(1, workers)
+        self._slots = threading.BoundedSemaphore(self.workers + max(0, max_queue))
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rejected = 0
+        self.inflight = 0
+        self.peak = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.getenv('ASYNC_DB_WORKERS', '8')),
+            max_queue=int(os.getenv('ASYNC_DB_QUEUE', '128')),
+        )
+
+    def _pool(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    # Threads don't survive a fork; the child builds its own pool
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='async-db')
+                    self._pid = os.getpid()
+        return self._executor
+
+    async def run(self, fn, *args):
+        """Await fn(*args) on a worker thread, inside a copy of the caller's context."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorBusy()
+        with self._lock:
+            self.calls += 1
+            self.inflight += 1
+            self.peak = max(self.peak, self.inflight)
+        try:
+            # One copy per call: a Context can't be entered by two threads at once
+            call = functools.partial(contextvars.copy_context().run, fn, *args)
+            return await asyncio.get_running_loop().run_in_executor(self._pool(), call)
+        finally:
+            self._slots.release()
+            with self._lock:
+                self.inflight -= 1
+
+    async def gather(self, *fns):
+        """Run the zero-argument callables concurrently; results in the same order."""
+        return await asyncio.gather(*(self.run(fn) for fn in fns))
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def metrics(self):
+        with self._lock:
+            return {'workers': self.workers, 'calls': self.calls, 'inflight': self.inflight,
+                    'peak_inflight': self.peak, 'rejected_busy': self.rejected}
@@ -0,0 +1,258 @@
+"""
+Cohort and retention analytics for the admin dashboard.
+
+Tables are loaded column-wise into NumPy structured arrays and every metric is
+computed with vectorized group-by operations (sort + reduceat / bincount), so
+the cost stays flat in Python even with millions of purchase rows.
+"""
+import os
+import sqlite3
+
+import numpy as np
+
+try:
+    from . import dbconn
+except ImportError:
+    import dbconn
+
+# The Unix epoch (1970-01-01) was a Thursday; shifting by 3 days makes
+# week numbers start on Monday.
+_WEEK_SHIFT = 3
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+# Payment methods are stored as small integer codes into a separate label list
+# so records stay compact and group-bys run on integers instead of strings.
+PURCHASE_DTYPE = np.dtype([('user_id', 'i8'), ('day', 'i8'), ('amount', 'f8'), ('method', 'i4')])
+BOOKING_DTYPE = np.dtype([('user_id', 'i8'), ('day', 'i8'), ('party_size', 'i8')])
+SUBSCRIBER_DTYPE = np.dtype([('user_id', 'i8'), ('day', 'i8')])
+
+# ISO timestamps -> whole days since the Unix epoch, computed inside SQLite
+_DAY_SQL = "CAST(julianday(substr({col}, 1, 10)) - 2440587.5 AS INTEGER)"
+
+
+def _missing_table(exc):
+    # SQLite says "no such table", PostgreSQL (via pgbackend) 'relation ... does not exist'
+    message = str(exc)
+    return message.startswith('no such table') or ('relation' in message and 'does not exist' in message)
+
+
+def _load(db_path, sql, dtype, params=()):
+    """Stream a query straight into a structured array (empty if the table is missing)."""
+    if not db_path or not dbconn.exists(db_path):
+        return np.empty(0, dtype=dtype)
+    conn = dbconn.connect(db_path, readonly=True)
+    try:
+        cur = conn.execute(sql, params)
+        return np.fromiter(cur, dtype=dtype)
+    except sqlite3.OperationalError as exc:
+        # Table not created yet on a fresh instance; anything else is a real error
+        if not _missing_table(exc):
+            raise
+        return np.empty(0, dtype=dtype)
+    finally:
+        conn.close()
+
+
+_METHOD_SQL = "LOWER(COALESCE(NULLIF(TRIM(payment_method), ''), 'Demo'))"
+
+
+def load_purchases(db_path):
+    """Return (purchases, method_labels); purchases['method'] indexes into method_labels."""
+    labels = [r[0] for r in _load(db_path, f"SELECT DISTINCT {_METHOD_SQL} FROM purchase_history ORDER BY 1",
+                                  np.dtype([('m', 'O')]))]
+    if not labels:
+        return np.empty(0, dtype=PURCHASE_DTYPE), []
+    # Let SQLite map each method to its code so rows arrive as plain numbers
+    code_sql = 'CASE ' + ' '.join('WHEN m = ? THEN %d' % i for i in range(len(labels))) + ' ELSE -1 END'
+    day = _DAY_SQL.format(col='purchase_date')
+    purchases = _load(db_path, f"""
+        SELECT user_id, day, amount, {code_sql} FROM (
+            SELECT IFNULL(user_id, 0) AS user_id, {day} AS day,
+                   IFNULL(total_amount, 0) AS amount, {_METHOD_SQL} AS m
+            FROM purchase_history
+        ) AS purchases
+        WHERE day IS NOT NULL
+    """, PURCHASE_DTYPE, params=labels)
+    return purchases, labels
+
+
+def load_bookings(db_path):
+    day = _DAY_SQL.format(col='date')
+    return _load(db_path, f"""
+        SELECT IFNULL(user_id, 0), {day}, IFNULL(party_size, 1)
+        FROM cafe_bookings
+        WHERE status != 'canceled' AND {day} IS NOT NULL
+    """, BOOKING_DTYPE)
+
+
+def load_subscribers(db_path):
+    day = _DAY_SQL.format(col='joined_at')
+    return _load(db_path, f"""
+        SELECT IFNULL(user_id, 0), {day}
+        FROM community_subscribers
+        WHERE {day} IS NOT NULL
+    """, SUBSCRIBER_DTYPE)
+
+
+def week_of(days):
+    """Monday-based week number for an array of epoch days."""
+    return (np.asarray(days, dtype=np.int64) + _WEEK_SHIFT) // 7
+
+
+def week_label(week):
+    """ISO date (YYYY-MM-DD) of the Monday that starts `week`."""
+    return str(_EPOCH + np.timedelta64(int(week) * 7 - _WEEK_SHIFT, 'D'))
+
+
+def _group_starts(sorted_keys):
+    if sorted_keys.size == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+
+
+def group_reduce(keys, values, ufunc):
+    """Return (unique keys, ufunc-reduced values per key) without a Python loop."""
+    keys = np.asarray(keys)
+    values = np.asarray(values)
+    if keys.size == 0:
+        return keys[:0], values[:0]
+    order = np.argsort(keys, kind='stable')
+    k = keys[order]
+    starts = _group_starts(k)
+    return k[starts], ufunc.reduceat(values[order], starts)
+
+
+def cohort_retention(purchases, max_weeks=12):
+    """
+    First-purchase cohorts by week.
+
+    matrix[i][j] is the number of distinct users from cohort i who bought again
+    j weeks after their first purchase week (j=0 is the cohort size). Guest
+    orders (user_id 0) are ignored: they are not one returning customer.
+    """
+    purchases = purchases[purchases['user_id'] > 0]
+    uid = purchases['user_id']
+    week = week_of(purchases['day'])
+    if uid.size == 0:
+        return {'cohorts': [], 'sizes': [], 'matrix': [], 'retention': [], 'repeat_rate': []}
+
+    order = np.lexsort((week, uid))
+    u = uid[order]
+    w = week[order]
+    starts = _group_starts(u)
+    counts = np.diff(np.r_[starts, u.size])
+    first_week = w[starts]
+
+    cohort_weeks, user_cohort = np.unique(first_week, return_inverse=True)
+    row_cohort = np.repeat(user_cohort, counts)
+    offset = w - np.repeat(first_week, counts)
+
+    # Count each (user, week) once: rows are sorted by user then week
+    distinct = np.r_[True, (u[1:] != u[:-1]) | (w[1:] != w[:-1])]
+    keep = distinct & (offset < max_weeks)
+    n_cohorts = cohort_weeks.size
+    flat = row_cohort[keep] * max_weeks + offset[keep]
+    matrix = np.bincount(flat, minlength=n_cohorts * max_weeks).reshape(n_cohorts, max_weeks)
+
+    sizes = matrix[:, 0]
+    retention = matrix / np.maximum(sizes, 1)[:, None]
+    repeaters = np.bincount(user_cohort, weights=(counts >= 2), minlength=n_cohorts)
+    return {
+        'cohorts': [week_label(cw) for cw in cohort_weeks],
+        'sizes': sizes.tolist(),
+        'matrix': matrix.tolist(),
+        'retention': np.round(retention, 4).tolist(),
+        'repeat_rate': np.round(repeaters / np.maximum(sizes, 1), 4).tolist(),
+    }
+
+
+def repeat_purchase_rate(purchases):
+    """Share of signed-in buyers with two or more orders (guest orders ignored)."""
+    purchases = purchases[purchases['user_id'] > 0]
+    if purchases.size == 0:
+        return {'buyers': 0, 'repeat_buyers': 0, 'rate': 0.0}
+    _, counts = np.unique(purchases['user_id'], return_counts=True)
+    repeat = int(np.count_nonzero(counts >= 2))
+    return {'buyers': int(counts.size), 'repeat_buyers': repeat, 'rate': round(repeat / counts.size, 4)}
+
+
+def aov_by_method(purchases, method_labels):
+    """Orders, revenue and average order value per payment method."""
+    if purchases.size == 0:
+        return {}
+    # Code -1 marks a method inserted after the label list was read
+    known = purchases[purchases['method'] >= 0]
+    codes = known['method']
+    orders = np.bincount(codes, minlength=len(method_labels))
+    revenue = np.bincount(codes, weights=known['amount'], minlength=len(method_labels))
+    return {
+        str(label): {'orders': int(o), 'revenue': round(float(r), 2), 'aov': round(float(r / o), 2)}
+        for label, o, r in zip(method_labels, orders, revenue) if o
+    }
+
+
+def _lookup(sorted_keys, probe):
+    """Index of each probe in sorted_keys plus a found-mask."""
+    if sorted_keys.size == 0:
+        return np.zeros(probe.size, dtype=np.intp), np.zeros(probe.size, dtype=bool)
+    idx = np.searchsorted(sorted_keys, probe)
+    idx = np.minimum(idx, sorted_keys.size - 1)
+    return idx, sorted_keys[idx] == probe
+
+
+def booking_conversion(bookings, purchases):
+    """
+    Share of cafe bookers who bought something on or after their first booking day.
+    Anonymous rows (user_id 0) are ignored.
+    """
+    b = bookings[bookings['user_id'] > 0]
+    p = purchases[purchases['user_id'] > 0]
+    bookers, first_booking = group_reduce(b['user_id'], b['day'], np.minimum)
+    buyers, last_purchase = group_reduce(p['user_id'], p['day'], np.maximum)
+    idx, found = _lookup(buyers, bookers)
+    if buyers.size:
+        converted = found & (last_purchase[idx] >= first_booking)
+    else:
+        converted = found
+    n = int(bookers.size)
+    return {
+        'bookers': n,
+        'bookers_who_purchased': int(np.count_nonzero(found)),
+        'converted_after_booking': int(np.count_nonzero(converted)),
+        'rate': round(int(np.count_nonzero(converted)) / n, 4) if n else 0.0,
+    }
+
+
+def subscriber_conversion(subscribers, purchases):
+    """Community subscribers linked to an account, and how many of them have purchased."""
+    linked = np.unique(subscribers['user_id'][subscribers['user_id'] > 0])
+    buyers = np.unique(purchases['user_id'])
+    purchased = int(np.count_nonzero(np.isin(linked, buyers, assume_unique=True)))
+    return {
+        'subscribers': int(subscribers.size),
+        'linked_accounts': int(linked.size),
+        'purchasers': purchased,
+        'rate': round(purchased / linked.size, 4) if linked.size else 0.0,
+    }
+
+
+def compute_analytics(purchases, method_labels, bookings, subscribers, max_weeks=12):
+    return {
+        'cohorts': cohort_retention(purchases, max_weeks=max_weeks),
+        'repeat_purchase': repeat_purchase_rate(purchases),
+        'aov_by_method': aov_by_method(purchases, method_labels),
+        'booking_conversion': booking_conversion(bookings, purchases),
+        'subscriber_conversion': subscriber_conversion(subscribers, purchases),
+    }
+
+
+def build_dashboard_analytics(instance_path, max_weeks=12):
+    """Load games.db / cafe.db / community.db from `instance_path` and compute every metric."""
+    purchases, method_labels = load_purchases(os.path.join(instance_path, 'games.db'))
+    return compute_analytics(
+        purchases,
+        method_labels,
+        load_bookings(os.path.join(instance_path, 'cafe.db')),
+        load_subscribers(os.path.join(instance_path, 'community.db')),
+        max_weeks=max_weeks,
+    )
@@ -1,37 +1,155 @@
+from time import perf_counter
+_IMPORT_STARTED = perf_counter()
+
 import os
 import sqlite3
 import io
 import csv
-from flask import Flask, render_template, request, session, redirect, url_for, flash, jsonify, make_response
-from werkzeug.security import generate_password_hash, check_password_hash
+import time as _time
+from functools import lru_cache, partial
+from flask import Blueprint, Flask, Response, render_template, request, session, redirect, url_for, flash, jsonify, make_response, g
+from werkzeug.exceptions import HTTPException
+from werkzeug.local import LocalProxy
+from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
 from models import db, User
 
 from sqlalchemy import text
 # import blueprints safely (package vs script execution)
 try:
-    from .games_api import games_bp
+    from .games_api import games_bp, fetch_games, fetch_purchase_history
+except ImportError:
+    from games_api import games_bp, fetch_games, fetch_purchase_history
+
+try:
+    from .books_api import books_bp, book_filters, search_books, fetch_book
+except ImportError:
+    from books_api import books_bp, book_filters, search_books, fetch_book
+
+try:
+    from .auth import auth_bp, init_app as init_auth_db, login_throttled, hashing_busy, hash_password, verify_password
+except ImportError:
+    from auth import auth_bp, init_app as init_auth_db, login_throttled, hashing_busy, hash_password, verify_password
+
+try:
+    from .cart_api import cart_bp, fetch_item_details
+except ImportError:
+    from cart_api import cart_bp, fetch_item_details
+
+try:
+    from . import analytics
+except ImportError:
+    import analytics
+
+try:
+    from .singleflight import SingleFlight, normalize_term
+except ImportError:
+    from singleflight import SingleFlight, normalize_term
+
+try:
+    from . import cafe_occupancy
+except ImportError:
+    import cafe_occupancy
+
+try:
+    from . import cafe_tables
+except ImportError:
+    import cafe_tables
+
+try:
+    from . import cafe_holds
+except ImportError:
+    import cafe_holds
+
+try:
+    from .eventbus import EventBus, EventLog
 except ImportError:
-    from games_api import games_bp
+    from eventbus import EventBus, EventLog
 
 try:
-    from .books_api import books_bp, init_books_db
+    from . import migrations
 except ImportError:
-    from books_api import books_bp, init_books_db
+    import migrations
 
 try:
-    from .auth import auth_bp, init_app as init_auth_db
+    from . import community_directory
 except ImportError:
-    from auth import auth_bp, init_app as init_auth_db
+    import community_directory
 
 try:
-    from .cart_api import cart_bp
+    from . import avatars
 except ImportError:
-    from cart_api import cart_bp
+    import avatars
+
+try:
+    from . import outbox
+except ImportError:
+    import outbox
+
+try:
+    from . import passwords
+except ImportError:
+    import passwords
+
+try:
+    from . import dbconn
+except ImportError:
+    import dbconn
+
+try:
+    from . import pgbackend
+except ImportError:
+    import pgbackend
+
+try:
+    from . import aio
+except ImportError:
+    import aio
+
+try:
+    from .lifecycle import Lifecycle
+except ImportError:
+    from lifecycle import Lifecycle
+
+try:
+    from . import startup
+except ImportError:
+    import startup
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+try:
+    from . import profiling
+except ImportError:
+    import profiling
+
+try:
+    from . import memtrace
+except ImportError:
+    import memtrace
+
+try:
+    from . import tracing
+except ImportError:
+    import tracing
+
+# Startup report: how long importing this module (and its dependencies) took
+_IMPORT_SECONDS = perf_counter() - _IMPORT_STARTED
+
+
+@lru_cache(maxsize=4)
+def _admin_users(raw):
+    # ADMIN_USERS parsed once per distinct value instead of on every check
+    return frozenset(u.strip().lower() for u in raw.split(',') if u.strip())
 
 
 def create_app(config=None):
+    timer = startup.StartupTimer(_IMPORT_SECONDS)
     app = Flask(__name__, instance_relative_config=True)
+    app.extensions['startup'] = timer
     # Allow overriding the instance path (useful when mounting a persistent
     # volume on PaaS providers like Render). Set the env var INSTANCE_PATH to
     # a writable persistent mount (e.g. /mnt/instance) so SQLite files survive
@@ -44,88 +162,275 @@ def create_app(config=None):
         app.instance_path = inst_override
     app.secret_key = os.getenv("SECRET_KEY", "dev-secret-key-change-me")
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+    # DATABASE_URL=postgresql://... moves every database onto that server, one
+    # schema per instance file (see pgbackend); otherwise instance/*.db is used
+    if dbconn.configure(os.getenv('DATABASE_URL')) is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = pgbackend.sqlalchemy_url(os.environ['DATABASE_URL'], 'users')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
     db.init_app(app)
+    with timer.phase('database setup'), app.app_context():
+        if dbconn.backend_name() == 'sqlite':
+            # users.db gets the same WAL/timeout/cache settings as the raw sqlite files
+            dbconn.install_sqlalchemy(db.engine)
+        else:
+            dbconn.ensure_databases(['users.db'])
+        dbconn.instrument_sqlalchemy(db.engine, 'users.db')
+    # Per-endpoint latency/size/SQL histograms, served at /admin/metrics
+    request_metrics = app.extensions['metrics'] = metrics.RequestMetrics(
+        os.getenv('METRICS_DIR') or None, float(os.getenv('METRICS_FLUSH_SECONDS', '2')))
+    dbconn.add_listener(metrics.record_sql)
+    # cProfile of single requests, on an admin's request or sampled (PROFILE_SAMPLE_RATE)
+    profiler = app.extensions['profiler'] = profiling.RequestProfiler.from_env(
+        os.path.join(app.instance_path, 'profiles'))
+    # tracemalloc snapshots/diffs and per-request peak allocation (MEMORY_SAMPLE_RATE)
+    memory = app.extensions['memory'] = memtrace.MemoryTracer.from_env()
+    # Span traces of sampled requests (TRACE_SAMPLE_RATE or an admin's ?trace=1) -> instance/traces.jsonl
+    tracer = app.extensions['tracer'] = tracing.Tracer.from_env(os.path.join(app.instance_path, 'traces.jsonl'))
+    dbconn.add_listener(tracing.record_sql)
+
+    # Schema changes for the raw sqlite databases run once here, not per request
+    with timer.phase('migrations'):
+        migrations.run_all(app.instance_path)
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply pending schema migrations to every instance database."""
+        for name, versions in migrations.run_all(app.instance_path).items():
+            print(f"{name}: {'applied ' + ', '.join(map(str, versions)) if versions else 'up to date'}")
+
+    # Coalesces concurrent identical reads (slots, dashboard, catalog search)
+    flights = app.extensions['singleflight'] = SingleFlight()
+    # Deadlines of short-lived cafe seat holds (mirrored in cafe_holds)
+    hold_expiry = app.extensions['cafe_hold_expiry'] = cafe_holds.ExpiryQueue()
+    # Per-day table schedules kept between requests (see cafe_tables)
+    table_cache = app.extensions['cafe_tables'] = cafe_tables.ScheduleCache()
+    # Live updates for the cafe and community pages (served as Server-Sent Events),
+    # published to events.db, which every worker process follows (ids are shared)
+    bus = app.extensions['events'] = EventBus(max_streams=int(os.getenv('SSE_MAX_STREAMS', '32')),
+                                              max_async_streams=int(os.getenv('SSE_ASYNC_MAX_STREAMS', '1000')),
+                                              log=EventLog(os.path.join(app.instance_path, 'events.db')),
+                                              poll_seconds=float(os.getenv('SSE_POLL_SECONDS', '0.25')))
+    # Notification emails, written to each database's outbox and sent in the background
+    mailer = app.extensions['outbox'] = outbox.Dispatcher.from_env(
+        [os.path.join(app.instance_path, name) for name in ('cafe.db', 'games.db', 'community.db')],
+        logger=app.logger,
+    )
+
+    # scrypt runs in a bounded process pool; logins are throttled before reaching it
+    password_hasher = app.extensions['password_hasher'] = passwords.HashPool.from_env()
+    login_throttle = app.extensions['login_throttle'] = passwords.LoginThrottle.from_env()
+    # The /api/async views share one event loop; their blocking DB calls run on db_executor
+    async_loop = app.extensions['async_loop'] = aio.EventLoopThread()
+    app.async_to_sync = async_loop.async_to_sync
+    db_executor = app.extensions['async_db'] = aio.DbExecutor.from_env()
+
+    # Graceful stop under gunicorn (gunicorn.conf.py): drain ends SSE streams and
+    # fails /readyz, shutdown stops the background work started above
+    lifecycle = app.extensions['lifecycle'] = Lifecycle(app.logger)
+    lifecycle.on_drain(bus.close)
+    lifecycle.on_shutdown(mailer.stop)
+    lifecycle.on_shutdown(password_hasher.shutdown)
+    lifecycle.on_shutdown(db_executor.shutdown)
+    lifecycle.on_shutdown(async_loop.stop)
+    lifecycle.on_shutdown(dbconn.close_all)
+    lifecycle.on_shutdown(request_metrics.close)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_token = request_metrics.start()
+
+    @app.before_request
+    def start_trace():
+        requested = request.headers.get('X-Trace') == '1' or request.args.get('trace') == '1'
+        trigger = tracer.trigger(requested and _is_admin())
+        if trigger:
+            g.trace = tracer.begin(f"{request.method} {request.path}", trigger)
+
+    @app.after_request
+    def add_trace_header(response):
+        if g.get('trace') is not None:
+            response.headers['X-Trace-Id'] = g.trace[0].id
+        return response
+
+    @app.teardown_request
+    def finish_trace(exc):
+        handle = g.pop('trace', None)
+        if handle is not None:
+            status = (g.get('metrics_response') or (500, None))[0]
+            tracer.finish(handle, method=request.method, path=request.full_path.rstrip('?'),
+                          endpoint=request.endpoint, status=status)
+
+    @app.after_request
+    def note_response_metrics(response):
+        g.metrics_response = (response.status_code, response.content_length)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            status, size = g.get('metrics_response') or (500, None)
+            request_metrics.finish(token, request.endpoint, request.method, status, size)
 
     @app.before_request
-    def create_tables():
-        if not hasattr(app, 'db_initialized'):
+    def start_profile():
+        requested = request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+        trigger = profiler.trigger(requested and _is_admin())
+        if trigger:
+            profile = profiler.start()
+            if profile is not None:
+                g.profile = (profile, trigger, perf_counter())
+
+    def _finish_profile(status):
+        profile, trigger, started = g.pop('profile')
+        return profiler.stop(profile, {
+            'method': request.method, 'path': request.full_path.rstrip('?'), 'endpoint': request.endpoint,
+            'status': status, 'seconds': round(perf_counter() - started, 4), 'trigger': trigger,
+        })
+
+    @app.after_request
+    def save_profile(response):
+        if g.get('profile') is not None:
+            response.headers['X-Profile-Id'] = _finish_profile(response.status_code)
+        return response
+
+    @app.teardown_request
+    def save_failed_profile(exc):
+        # after_request doesn't run when the view raised
+        if g.get('profile') is not None:
+            _finish_profile(500)
+
+    @app.before_request
+    def start_memory_measurement():
+        requested = request.headers.get('X-Memory') == '1' or request.args.get('memory') == '1'
+        if memory.wanted(requested and _is_admin()):
+            g.memory_token = memory.begin_request()
+
+    @app.after_request
+    def finish_memory_measurement(response):
+        token = g.pop('memory_token', None)
+        if token is not None:
+            peak, _retained = memory.end_request(token, request.endpoint)
+            response.headers['X-Memory-Peak-KiB'] = f"{peak / 1024:.1f}"
+        return response
+
+    @app.teardown_request
+    def finish_failed_memory_measurement(exc):
+        token = g.pop('memory_token', None)
+        if token is not None:
+            memory.end_request(token, request.endpoint)
+
+    @app.before_request
+    def start_outbox():
+        # Threads start in the serving process (after any fork), then this is a no-op
+        mailer.ensure_started()
+
+    @app.before_request
+    def start_first_response_timer():
+        if timer.waiting_for_first_response():
+            g.request_started = perf_counter()
+
+    @app.after_request
+    def record_first_response(response):
+        started = g.get('request_started')
+        if started is not None and timer.record_first_response(request.path, response.status_code, started):
+            report = timer.report()
+            app.logger.info(f"startup: {report}")
+            try:
+                timer.save(os.path.join(app.instance_path, 'startup.jsonl'))
+            except OSError as e:
+                app.logger.warning(f"could not save the startup report: {e}")
+        return response
+
+    def _init_users_db():
+        # Runs once at boot (the master, under gunicorn), so no visitor waits for
+        # it; seeding the admin includes an scrypt hash
+        with app.app_context():
             db.create_all()
-            init_books_db()  # Initialize books database
             # Self-heal User table to ensure profile columns exist
             try:
+                from sqlalchemy import inspect as sa_inspect
+                cols = {c['name'] for c in sa_inspect(db.engine).get_columns('users')}
                 with db.engine.begin() as conn:
-                    cols = [row[1] for row in conn.exec_driver_sql('PRAGMA table_info(users)').fetchall()]
                     if 'display_name' not in cols:
                         conn.exec_driver_sql('ALTER TABLE users ADD COLUMN display_name VARCHAR(120)')
                     if 'photo_path' not in cols:
                         conn.exec_driver_sql('ALTER TABLE users ADD COLUMN photo_path VARCHAR(255)')
-            except Exception:
-                pass
+            except Exception as e:
+                app.logger.warning(f"users table self-heal failed: {e}")
             # Ensure a default admin user exists for demo access
             try:
-                from sqlalchemy.exc import SQLAlchemyError
                 if not User.query.filter_by(username='admin').first():
                     admin_pw = os.getenv('ADMIN_DEFAULT_PASSWORD', 'admin123')
                     admin_user = User(username='admin', password_hash=generate_password_hash(admin_pw))
                     db.session.add(admin_user)
                     db.session.commit()
-            except Exception:
+            except Exception as e:
                 # Do not block app startup if seeding fails
-                pass
-            app.db_initialized = True
-
-    @app.context_processor
-    def inject_cart_count():
-        items = session.get('cart', {}).get('items', [])
-        return {'cart_count': sum(i.get('quantity', 1) for i in items)}
+                db.session.rollback()
+                app.logger.warning(f"default admin seeding failed: {e}")
+            finally:
+                db.session.remove()
+
+    def _warm_up():
+        # Compile every template and run the catalog reads once: the first page
+        # views skip Jinja compilation, and the catalog rows are in the page
+        # cache (and, on PostgreSQL, the pools are open and the SQL translated)
+        for name in app.jinja_env.list_templates(filter_func=lambda n: n.endswith('.html')):
+            app.jinja_env.get_template(name)
+        with app.app_context():
+            _search_books(None, None)
+            search_books(None, None, None)
+            fetch_games()
+
+    @app.cli.command('warmup')
+    def warmup_command():
+        """Initialize every database, prime the caches and print the startup timing."""
+        if 'warm-up' not in timer.phases:
+            with timer.phase('warm-up'):
+                _warm_up()
+        import json
+        print(json.dumps(timer.report(), indent=2))
 
     # ---------- Community (simple subscriber + updates) ----------
     def _community_db_path():
         os.makedirs(app.instance_path, exist_ok=True)
         return os.path.join(app.instance_path, 'community.db')
 
-    def _ensure_community_tables(conn):
-        cur = conn.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS community_subscribers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                email TEXT UNIQUE NOT NULL,
-                joined_at TEXT NOT NULL,
-                display_name TEXT,
-                photo_path TEXT
-            )
-            """
-        )
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS community_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                author TEXT,
-                content TEXT NOT NULL,
-                is_admin INTEGER NOT NULL DEFAULT 0,
-                created_at TEXT NOT NULL
-            )
-            """
-        )
-        conn.commit()
-        # add missing columns safely
+    # ---------------- Health ----------------
+    @app.route('/healthz')
+    def healthz():
+        # Liveness: the worker answers. No I/O, so a slow database doesn't get it restarted
+        return jsonify({'status': 'ok'})
+
+    @app.route('/readyz')
+    def readyz():
+        # Readiness: not draining, every database reachable and fully migrated
+        if lifecycle.draining.is_set():
+            return jsonify({'status': 'draining'}), 503
+        checks, ready = {}, True
+        for name, steps in migrations.DATABASES.items():
+            try:
+                conn = dbconn.connect(os.path.join(app.instance_path, name), readonly=True)
+                try:
+                    version = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+                finally:
+                    conn.close()
+                expected = steps[-1][0]
+                checks[name] = 'ok' if version == expected else f'schema at {version}, expected {expected}'
+            except Exception as e:
+                checks[name] = f'error: {e}'
+            ready = ready and checks[name] == 'ok'
         try:
-            cur.execute("PRAGMA table_info(community_subscribers)")
-            cols = {r[1] for r in cur.fetchall()}
-            if 'user_id' not in cols:
-                cur.execute("ALTER TABLE community_subscribers ADD COLUMN user_id INTEGER")
-            if 'display_name' not in cols:
-                cur.execute("ALTER TABLE community_subscribers ADD COLUMN display_name TEXT")
-            if 'photo_path' not in cols:
-                cur.execute("ALTER TABLE community_subscribers ADD COLUMN photo_path TEXT")
-            conn.commit()
-        except Exception:
-            pass
+            db.session.execute(text('SELECT 1'))
+            checks['users.db'] = 'ok'
+        except Exception as e:
+            checks['users.db'] = f'error: {e}'
+            ready = False
+        finally:
+            db.session.remove()
+        return jsonify({'status': 'ok' if ready else 'unavailable', 'databases': checks}), 200 if ready else 503
 
     # ---------------- Routes ----------------
     @app.route('/')
@@ -148,18 +453,25 @@ def create_app(config=None):
             if not username or not password:
                 flash("Please enter both username and password")
                 return redirect(url_for('login'))
+            throttled = login_throttled('login.html', username)
+            if throttled:
+                return throttled
 
             user = User.query.filter_by(username=username).first()
-            if user and check_password_hash(user.password_hash, password):
+            try:
+                ok = bool(user) and verify_password(user.password_hash, password)
+            except passwords.PoolBusy:
+                return hashing_busy('login.html')
+            if ok:
                 session['user'] = username
                 session['user_id'] = user.id  # Add user_id to match auth.py
+                _cache_display_name(user.id, user.display_name)
                 # If a community email is present from a prior join, link it to this account
                 try:
                     cem = (session.get('community_email') or '').strip().lower()
                     if cem:
                         dbp = _community_db_path()
-                        conn = sqlite3.connect(dbp)
-                        _ensure_community_tables(conn)
+                        conn = dbconn.connect(dbp)
                         cur = conn.cursor()
                         cur.execute("UPDATE community_subscribers SET user_id=? WHERE email=?", (int(user.id), cem))
                         conn.commit(); conn.close()
@@ -179,10 +491,16 @@ def create_app(config=None):
                 flash("Both fields are required")
                 return redirect(url_for('signup'))
 
+            throttled = login_throttled('signup.html')
+            if throttled:
+                return throttled
             if User.query.filter_by(username=username).first():
                 flash('Username already exists')
             else:
-                hashed_pw = generate_password_hash(password)
+                try:
+                    hashed_pw = hash_password(password)
+                except passwords.PoolBusy:
+                    return hashing_busy('signup.html')
                 new_user = User(username=username, password_hash=hashed_pw)
                 db.session.add(new_user)
                 db.session.commit()
@@ -196,8 +514,7 @@ def create_app(config=None):
                     cem = (session.get('community_email') or '').strip().lower()
                     if cem:
                         dbp = _community_db_path()
-                        conn = sqlite3.connect(dbp)
-                        _ensure_community_tables(conn)
+                        conn = dbconn.connect(dbp)
                         cur = conn.cursor()
                         cur.execute("UPDATE community_subscribers SET user_id=? WHERE email=?", (int(new_user.id), cem))
                         conn.commit(); conn.close()
@@ -214,23 +531,15 @@ def create_app(config=None):
         session.pop('user_id', None)
         session.pop('cart', None)
         session.pop('community_email', None)
+        session.pop('display_name_cache', None)
         return redirect(url_for('index'))
 
-    @app.route('/books')
-    def books():
-        if 'user' not in session and 'user_id' not in session:
-            return redirect(url_for('login'))
-        
+    def _search_books(category, search):
+        # Runs once per coalesced group; the returned lists are shared read-only
+        dbp = os.path.join(app.instance_path, 'books.db')
+        conn = dbconn.connect(dbp, readonly=True)
+        conn.row_factory = sqlite3.Row
         try:
-            # Get books from database
-            dbp = os.path.join(app.instance_path, 'books.db')
-            conn = sqlite3.connect(dbp)
-            conn.row_factory = sqlite3.Row
-
-            # Get filter parameters
-            category = request.args.get('category')
-            search = request.args.get('search')
-            
             query = "SELECT * FROM books WHERE 1=1"
             params = []
             
@@ -239,8 +548,8 @@ def create_app(config=None):
                 params.append(category)
                 
             if search:
-                query += " AND (title LIKE ? OR author LIKE ? OR description LIKE ?)"
-                params.extend([f'%{search}%', f'%{search}%', f'%{search}%'])
+                query += " AND (lower(title) LIKE ? OR lower(author) LIKE ? OR lower(description) LIKE ?)"
+                params.extend([f'%{search.lower()}%'] * 3)
                 
             query += " ORDER BY title"
 
@@ -251,28 +560,42 @@ def create_app(config=None):
             # Get unique categories for filter dropdown
             cur.execute("SELECT DISTINCT category FROM books ORDER BY category")
             categories = [row[0] for row in cur.fetchall()]
-            
+        finally:
             conn.close()
 
-            # Resolve image path under /static for each book
-            static_root = app.static_folder
-            for b in books:
-                img = (b.get('image') or '').strip()
-                b['image_static'] = None
-                if img:
-                    # Try a few common locations inside static
-                    candidates = [img] if '/' in img else [
-                        img,
-                        f'images/books/{img}',
-                        f'images/{img}'
-                    ]
-                    for cand in candidates:
-                        if os.path.exists(os.path.join(static_root, cand)):
-                            b['image_static'] = cand
-                            break
-            
+        # Resolve image path under /static for each book
+        static_root = app.static_folder
+        for b in books:
+            img = (b.get('image') or '').strip()
+            b['image_static'] = None
+            if img:
+                # Try a few common locations inside static
+                candidates = [img] if '/' in img else [
+                    img,
+                    f'images/books/{img}',
+                    f'images/{img}'
+                ]
+                for cand in candidates:
+                    if os.path.exists(os.path.join(static_root, cand)):
+                        b['image_static'] = cand
+                        break
+        return books, categories
+
+    @app.route('/books')
+    def books():
+        if 'user' not in session and 'user_id' not in session:
+            return redirect(url_for('login'))
+        
+        try:
+            # Get filter parameters (normalized so identical searches coalesce)
+            category = normalize_term(request.args.get('category'))
+            search = normalize_term(request.args.get('search'))
+            books, categories = flights.do(
+                ('books', category, search),
+                lambda: _search_books(category, search)
+            )
             return render_template('books.html', books=books, categories=categories, 
-                                 selected_category=category, search_term=search)
+                                 selected_category=category or None, search_term=search or None)
             
         except Exception as e:
             return f"Database error: {str(e)}", 500
@@ -285,51 +608,11 @@ def create_app(config=None):
         try:
             # Get games from database
             dbp = os.path.join(app.instance_path, 'games.db')
-            conn = sqlite3.connect(dbp)
+            conn = dbconn.connect(dbp, readonly=True)
             conn.row_factory = sqlite3.Row
 
-            # Check if games table exists, if not create it
             cur = conn.cursor()
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='games'")
-            # Shared seed data
-            sample_games = [
-                ("Baldur's Gate 3", "Epic CRPG adventure with deep choices and co-op.", "RPG,Co-op", 59.99, 9.99, "images/games/Baldurs_Gate_3.jpeg"),
-                ("Alan Wake 2", "Psychological horror thriller with cinematic storytelling.", "Horror,Narrative", 49.99, 7.99, "images/games/Alan_Wake_2.jpeg"),
-                ("Cyberpunk 2077", "Open-world RPG in a neon-soaked metropolis.", "RPG,Open-World", 29.99, 6.99, "images/games/cyberpunk.jpeg"),
-                ("Red Dead Redemption 2", "Open-world western with cinematic storytelling.", "Open-World,Action", 39.99, 8.99, "images/games/red.jpeg"),
-                ("The Witcher 3", "Open-world RPG full of monsters and choices.", "RPG,Open-World", 29.99, 6.49, "images/games/witcher.jpeg"),
-                ("Disco Elysium", "A groundbreaking RPG focused on choice and investigation.", "Indie,RPG", 19.99, 4.49, "images/games/Disco.jpeg"),
-                ("Silent Hill 2 (Remake)", "Reimagined survival-horror classic.", "Horror,Survival", 39.99, 8.49, "images/games/hill.jpeg"),
-                ("God of War", "A mythic reimagining: father, son, and monsters.", "Action,Adventure", 29.99, 6.99, "images/games/god.jpeg")
-            ]
-            if not cur.fetchone():
-                # Table doesn't exist, create and seed it
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS games (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        title TEXT NOT NULL,
-                        description TEXT,
-                        category TEXT,
-                        buy_price REAL DEFAULT 0,
-                        rent_price REAL DEFAULT 0,
-                        image TEXT
-                    )
-                """)
-                cur.executemany("""
-                    INSERT INTO games (title, description, category, buy_price, rent_price, image) 
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, sample_games)
-                conn.commit()
-            else:
-                # Table exists but may be empty (e.g., after a reset) -> seed if empty
-                cur.execute("SELECT COUNT(*) FROM games")
-                if int(cur.fetchone()[0] or 0) == 0:
-                    cur.executemany("""
-                        INSERT INTO games (title, description, category, buy_price, rent_price, image)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, sample_games)
-                    conn.commit()
-                
+
             # Optional filters
             category = request.args.get('category', '').strip()
             search = request.args.get('search', '').strip()
@@ -338,11 +621,11 @@ def create_app(config=None):
             query = "SELECT * FROM games WHERE 1=1"
             params = []
             if category:
-                query += " AND category LIKE ?"
-                params.append(f"%{category}%")
+                query += " AND lower(category) LIKE ?"
+                params.append(f"%{category.lower()}%")
             if search:
-                query += " AND (title LIKE ? OR description LIKE ?)"
-                params.extend([f"%{search}%", f"%{search}%"]) 
+                query += " AND (lower(title) LIKE ? OR lower(description) LIKE ?)"
+                params.extend([f"%{search.lower()}%"] * 2)
             query += " ORDER BY id"
 
             cur.execute(query, params)
@@ -396,7 +679,7 @@ def create_app(config=None):
         force = (request.args.get('force') or '').strip().lower() in ('1', 'true', 'yes')
         try:
             dbp = os.path.join(app.instance_path, 'games.db')
-            conn = sqlite3.connect(dbp)
+            conn = dbconn.connect(dbp)
             conn.row_factory = sqlite3.Row
             cur = conn.cursor()
             # Ensure table exists
@@ -470,8 +753,8 @@ def create_app(config=None):
         except Exception:
             return jsonify({'error': 'Invalid or missing date (use YYYY-MM-DD)'}), 400
 
-        wd = day.weekday()  # Monday=0 ... Sunday=6
-        if wd == 6:
+        status = _day_status(day)
+        if status == 'closed':
             return jsonify({
                 'date': dstr,
                 'status': 'sold_out',
@@ -479,7 +762,7 @@ def create_app(config=None):
                 'members_allowed': False,
                 'note': 'Fully booked (closed to all reservations)'
             })
-        if wd == 5:
+        if status == 'members_only':
             return jsonify({
                 'date': dstr,
                 'status': 'members_only',
@@ -500,38 +783,19 @@ def create_app(config=None):
         os.makedirs(app.instance_path, exist_ok=True)
         return os.path.join(app.instance_path, 'cafe.db')
 
-    def _ensure_cafe_tables(conn):
-        cur = conn.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS cafe_bookings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                date TEXT NOT NULL,
-                time TEXT NOT NULL,
-                party_size INTEGER NOT NULL DEFAULT 1,
-                note TEXT,
-                status TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                duration_minutes INTEGER NOT NULL DEFAULT 60,
-                canceled_at TEXT
-            )
-            """
-        )
-        # Add missing columns safely
-        cur.execute("PRAGMA table_info(cafe_bookings)")
-        cols = {r[1] for r in cur.fetchall()}
-        if 'duration_minutes' not in cols:
-            cur.execute("ALTER TABLE cafe_bookings ADD COLUMN duration_minutes INTEGER NOT NULL DEFAULT 60")
-        if 'canceled_at' not in cols:
-            cur.execute("ALTER TABLE cafe_bookings ADD COLUMN canceled_at TEXT")
-        conn.commit()
-        # Index to speed up overlap checks
+    def _notify_email(uid):
+        # Where booking mail goes: the joined community email, else the one linked to the account
+        email = (session.get('community_email') or '').strip().lower()
+        if email or not uid:
+            return email or None
         try:
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_cafe_date_time_status ON cafe_bookings(date, time, status)")
-        except Exception:
-            pass
-        conn.commit()
+            conn = dbconn.connect(_community_db_path(), readonly=True)
+            row = conn.execute("SELECT email FROM community_subscribers WHERE user_id=? ORDER BY id LIMIT 1",
+                               (uid,)).fetchone()
+            conn.close()
+            return row[0] if row else None
+        except sqlite3.Error:
+            return None
 
     def _slot_capacity():
         try:
@@ -540,6 +804,60 @@ def create_app(config=None):
         except Exception:
             return 10
 
+    def _table_layout():
+        # [(table_id, seats), ...] from CAFE_TABLES; empty means pooled capacity only
+        try:
+            return cafe_tables.parse_layout(os.getenv('CAFE_TABLES', ''))
+        except ValueError as e:
+            app.logger.warning(f"Ignoring CAFE_TABLES: {e}")
+            return []
+
+    def _hold_minutes():
+        try:
+            return min(max(int(os.getenv('CAFE_HOLD_MINUTES', '5')), 1), 30)
+        except Exception:
+            return 5
+
+    def _expire_holds(conn, tables=None):
+        # Cheap heap peek on every call; the sweep only runs when a hold is due.
+        # Joins the caller's transaction if one is open (pass its table edit),
+        # else uses its own. Inside the caller's transaction it returns
+        # (released windows, sweep time) and touches nothing outside the
+        # database: after its COMMIT the caller publishes the windows and marks
+        # the sweep, so a rollback leaves the expiry heap as it was.
+        hold_expiry.load(conn)
+        now = _time.time()
+        if not hold_expiry.due(now):
+            return [], None
+        own_tx = not conn.in_transaction
+        if own_tx:
+            conn.execute("BEGIN IMMEDIATE")
+            tables = table_cache.edit(conn, _table_layout())
+        try:
+            released = cafe_holds.expire(conn, now)
+            for date, start, end, _, table_id in released:
+                tables.release(date, table_id, start, end)
+            if own_tx:
+                conn.commit()
+        except Exception:
+            if own_tx:
+                conn.rollback()
+            raise
+        if not own_tx:
+            return released, now
+        hold_expiry.mark_swept(now)
+        tables.publish()
+        for date, start, end, _, _ in released:
+            _publish_cafe('released', date, start, end)
+        return [], None
+
+    def _publish_cafe(kind, date, start_min, end_min):
+        # Tell live cafe pages which window changed; call only after COMMIT
+        bus.publish('cafe', 'slots', {
+            'kind': kind, 'date': date,
+            'time': _minutes_to_time(start_min), 'duration': int(end_min) - int(start_min),
+        })
+
     def _parse_time_to_min(tstr: str) -> int:
         try:
             h, m = (tstr or '00:00').split(':')
@@ -551,199 +869,562 @@ def create_app(config=None):
         m = int(m) % (24*60)
         return f"{m//60:02d}:{m%60:02d}"
 
-    def _overlaps(start_a: int, dur_a: int, start_b: int, dur_b: int) -> bool:
-        end_a = start_a + dur_a
-        end_b = start_b + dur_b
-        return start_a < end_b and start_b < end_a
-
-    def _sum_booked_seats(conn, date: str, start_min: int, duration_min: int) -> int:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT time, duration_minutes, party_size FROM cafe_bookings WHERE date=? AND status='confirmed'",
-            (date,)
+    def _booking_interval(start, end, p):
+        # (start_min, end_min, seats), widened like the cafe_occupancy counters
+        lo, hi = cafe_occupancy.quantize(int(start), int(end))
+        return lo, hi, int(p or 0)
+
+    def _day_intervals(conn, date: str, window=None):
+        # Confirmed bookings and live holds of the day as (start_min, end_min, seats).
+        # With window=(start, end) only those overlapping it are returned (in SQL).
+        overlap = ""
+        bounds = []
+        if window:
+            lo, hi = cafe_occupancy.quantize(*window)
+            overlap = " AND start_min < ? AND end_min > ?"
+            bounds = [hi, lo]
+        query = (
+            "SELECT start_min, end_min, party_size FROM cafe_bookings WHERE date=? AND status='confirmed'" + overlap +
+            " UNION ALL SELECT start_min, end_min, seats FROM cafe_holds WHERE date=? AND expires_at > ?" + overlap
         )
-        total = 0
-        for t, d, p in cur.fetchall():
-            if _overlaps(start_min, duration_min, _parse_time_to_min(t), int(d or 60)):
-                total += int(p or 0)
-        return total
+        params = [date] + bounds + [date, _time.time()] + bounds
+        cur = conn.cursor()
+        cur.execute(query, params)
+        return [_booking_interval(s, e, p) for s, e, p in cur.fetchall()]
 
-    def _is_members_only(date_str: str) -> bool:
-        from datetime import datetime as _dt
-        try:
-            day = _dt.strptime(date_str, '%Y-%m-%d').date()
-        except Exception:
-            return False
+    def _default_duration():
+        return int(os.getenv('CAFE_DEFAULT_DURATION', '60'))
+
+    def _day_status(day) -> str:
+        # Day rules on an already-parsed date: 'closed', 'members_only' or 'available'
         wd = day.weekday()
-        return wd == 5  # Saturday
+        if wd == 6:  # Sunday
+            return 'closed'
+        if wd == 5:  # Saturday
+            return 'members_only'
+        return 'available'
 
-    def _is_closed(date_str: str) -> bool:
+    def _date_status(date_str: str) -> str:
         from datetime import datetime as _dt
         try:
             day = _dt.strptime(date_str, '%Y-%m-%d').date()
         except Exception:
-            return False
-        wd = day.weekday()
-        return wd == 6  # Sunday
+            return 'available'
+        return _day_status(day)
 
-    @app.route('/api/cafe/slots')
-    def cafe_slots():
-        if 'user' not in session and 'user_id' not in session:
-            return jsonify({'error': 'Authentication required'}), 401
+    def _is_members_only(date_str: str) -> bool:
+        return _date_status(date_str) == 'members_only'
+
+    def _is_closed(date_str: str) -> bool:
+        return _date_status(date_str) == 'closed'
+
+    def _slots_request():
+        # (date, duration, None) to compute, or (None, None, response) for
+        # closed days and bad input; shared with the async variant
         date = (request.args.get('date') or '').strip()
         try:
             _ = date and len(date) == 10
         except Exception:
-            return jsonify({'error': 'Invalid or missing date'}), 400
+            return None, None, (jsonify({'error': 'Invalid or missing date'}), 400)
         # Closed or members-only days
         if _is_closed(date):
-            return jsonify({'date': date, 'closed': True, 'members_only': False, 'slots': []})
+            return None, None, jsonify({'date': date, 'closed': True, 'members_only': False, 'slots': []})
         if _is_members_only(date):
-            return jsonify({'date': date, 'closed': False, 'members_only': True, 'slots': []})
+            return None, None, jsonify({'date': date, 'closed': False, 'members_only': True, 'slots': []})
+        # Optional per-request slot length (same bounds as bookings)
+        try:
+            duration = int(request.args.get('duration') or _default_duration())
+        except ValueError:
+            return None, None, (jsonify({'error': 'duration must be an integer'}), 400)
+        if duration < 30 or duration > 240:
+            return None, None, (jsonify({'error': 'duration must be between 30 and 240 minutes'}), 400)
+        return date, duration, None
 
-        # Build slots from open/close times
-        open_time = os.getenv('CAFE_OPEN', '10:00')
-        close_time = os.getenv('CAFE_CLOSE', '22:00')
-        step_min = int(os.getenv('CAFE_SLOT_STEP_MIN', '60'))
-        default_dur = int(os.getenv('CAFE_DEFAULT_DURATION', '60'))
-        cap = _slot_capacity()
-        start_min = _parse_time_to_min(open_time)
-        end_min = _parse_time_to_min(close_time)
-        slots = []
+    def _shared_slots(date, duration):
+        return flights.do(('cafe_slots', date, duration), lambda: _compute_slots(date, duration))
+
+    @app.route('/api/cafe/slots')
+    def cafe_slots():
+        if 'user' not in session and 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+        date, duration, early = _slots_request()
+        if early is not None:
+            return early
         try:
-            dbp = _cafe_db_path()
-            conn = sqlite3.connect(dbp)
-            conn.row_factory = sqlite3.Row
-            _ensure_cafe_tables(conn)
-            cur = conn.cursor()
-            m = start_min
-            while m + default_dur <= end_min:
-                used = _sum_booked_seats(conn, date, m, default_dur)
-                remain = max(0, cap - used)
-                slots.append({'time': _minutes_to_time(m), 'remaining': remain})
-                m += step_min
-            conn.close()
+            payload = _shared_slots(date, duration)
         except Exception as e:
             return jsonify({'error': f'Failed to load slots: {e}'}), 500
-        return jsonify({'date': date, 'closed': False, 'members_only': False, 'capacity': cap, 'duration': default_dur, 'slots': slots})
-
-    @app.route('/api/cafe/book', methods=['POST'])
-    def cafe_book():
+        return jsonify(payload)
+
+    def _slot_windows(duration: int):
+        # (start_min, duration_min) for every slot that fits between open and close
+        start_min = _parse_time_to_min(os.getenv('CAFE_OPEN', '10:00'))
+        end_min = _parse_time_to_min(os.getenv('CAFE_CLOSE', '22:00'))
+        step_min = max(1, int(os.getenv('CAFE_SLOT_STEP_MIN', '60')))
+        windows = []
+        m = start_min
+        while m + duration <= end_min:
+            windows.append((m, duration))
+            m += step_min
+        return windows
+
+    def _compute_slots(date, duration):
+        cap = _slot_capacity()
+        windows = _slot_windows(duration)
+        dbp = _cafe_db_path()
+        conn = dbconn.connect(dbp)
+        conn.row_factory = sqlite3.Row
+        layout = _table_layout()
+        day_tables = None
+        try:
+            _expire_holds(conn)
+            window = (windows[0][0], windows[-1][0] + windows[-1][1]) if windows else None
+            intervals = _day_intervals(conn, date, window) if windows else []
+            if layout:
+                day_tables = table_cache.day(conn, date, layout)
+        finally:
+            conn.close()
+        remaining = cafe_occupancy.remaining_for_windows(intervals, windows, cap)
+        slots = []
+        for (m, d), r in zip(windows, remaining):
+            slot = {'time': _minutes_to_time(m), 'duration': d, 'remaining': r}
+            if day_tables is not None:
+                # Free tables by seat count, e.g. {"2": 3, "4": 1}
+                slot['tables'] = {str(k): v for k, v in day_tables.free_by_size(m, m + d).items()}
+            slots.append(slot)
+        return {'date': date, 'closed': False, 'members_only': False, 'capacity': cap, 'duration': duration, 'slots': slots}
+
+    CALENDAR_MAX_DAYS = 62
+
+    @app.route('/api/cafe/calendar')
+    def cafe_calendar():
+        """
+        Day status and per-slot remaining seats for a whole date range.
+        Request: /api/cafe/calendar?from=YYYY-MM-DD&to=YYYY-MM-DD[&duration=60]
+        """
         if 'user' not in session and 'user_id' not in session:
             return jsonify({'error': 'Authentication required'}), 401
+        from datetime import datetime as _dt
+        try:
+            first = _dt.strptime((request.args.get('from') or '').strip(), '%Y-%m-%d').date()
+            last = _dt.strptime((request.args.get('to') or '').strip(), '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'error': 'Invalid or missing from/to (use YYYY-MM-DD)'}), 400
+        if last < first:
+            return jsonify({'error': 'to must not be before from'}), 400
+        if (last - first).days + 1 > CALENDAR_MAX_DAYS:
+            return jsonify({'error': f'Range too large (max {CALENDAR_MAX_DAYS} days)'}), 400
+        try:
+            duration = int(request.args.get('duration') or _default_duration())
+        except ValueError:
+            return jsonify({'error': 'duration must be an integer'}), 400
+        if duration < 30 or duration > 240:
+            return jsonify({'error': 'duration must be between 30 and 240 minutes'}), 400
 
-        data = request.get_json(silent=True) or {}
+        try:
+            payload = flights.do(('cafe_calendar', first.isoformat(), last.isoformat(), duration),
+                                 lambda: _compute_calendar(first, last, duration))
+        except Exception as e:
+            return jsonify({'error': f'Failed to load calendar: {e}'}), 500
+        return jsonify(payload)
+
+    def _compute_calendar(first, last, duration):
+        from datetime import timedelta as _td
+        cap = _slot_capacity()
+        windows = _slot_windows(duration)
+        times = [_minutes_to_time(m) for m, _ in windows]
+        # One range query for every day; dates are ISO strings so BETWEEN is correct
+        by_date = {}
+        dbp = _cafe_db_path()
+        conn = dbconn.connect(dbp)
+        try:
+            _expire_holds(conn)
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT date, start_min, end_min, party_size FROM cafe_bookings "
+                "WHERE status='confirmed' AND date BETWEEN ? AND ? "
+                "UNION ALL SELECT date, start_min, end_min, seats FROM cafe_holds "
+                "WHERE date BETWEEN ? AND ? AND expires_at > ?",
+                (first.isoformat(), last.isoformat(), first.isoformat(), last.isoformat(), _time.time())
+            )
+            for date, start, end, p in cur.fetchall():
+                by_date.setdefault(date, []).append(_booking_interval(start, end, p))
+        finally:
+            conn.close()
+
+        days = []
+        day = first
+        while day <= last:
+            dstr = day.isoformat()
+            status = _day_status(day)
+            entry = {'date': dstr, 'status': status,
+                     'closed': status == 'closed', 'members_only': status == 'members_only', 'slots': []}
+            if status == 'available':
+                remaining = cafe_occupancy.remaining_for_windows(by_date.get(dstr, []), windows, cap)
+                entry['slots'] = [{'time': t, 'remaining': r} for t, r in zip(times, remaining)]
+            days.append(entry)
+            day += _td(days=1)
+        return {'from': first.isoformat(), 'to': last.isoformat(), 'capacity': cap,
+                'duration': duration, 'days': days}
+
+    def _parse_slot_request(data):
+        # (date, time, party_size, duration_min), or an error response tuple
         date = (data.get('date') or '').strip()
         time = (data.get('time') or '').strip()
         party_size = int(data.get('partySize') or 1)
-        duration_min = int(data.get('duration') or os.getenv('CAFE_DEFAULT_DURATION', '60'))
-        note = (data.get('note') or '').strip()
-
+        duration_min = int(data.get('duration') or _default_duration())
         if not date or not time:
-            return jsonify({'error': 'date and time are required'}), 400
+            return None, (jsonify({'error': 'date and time are required'}), 400)
         if party_size < 1:
-            return jsonify({'error': 'partySize must be >= 1'}), 400
+            return None, (jsonify({'error': 'partySize must be >= 1'}), 400)
         if duration_min < 30 or duration_min > 240:
-            return jsonify({'error': 'duration must be between 30 and 240 minutes'}), 400
-
+            return None, (jsonify({'error': 'duration must be between 30 and 240 minutes'}), 400)
         # Enforce day rules
         if _is_closed(date):
-            return jsonify({'error': 'Selected day is fully booked'}), 400
+            return None, (jsonify({'error': 'Selected day is fully booked'}), 400)
         if _is_members_only(date):
-            return jsonify({'error': 'Members-only esports event day'}), 403
+            return None, (jsonify({'error': 'Members-only esports event day'}), 403)
+        return (date, time, party_size, duration_min), None
+
+    def _take_seats(conn, tables, date, start_min, end_min, party_size):
+        # Inside BEGIN IMMEDIATE: take counter seats and, with a layout, a table
+        # (in the transaction's table edit). Returns (table_id, None) or
+        # (None, error response tuple); caller rolls back on error.
+        cap = _slot_capacity()
+        if not cafe_occupancy.reserve(conn, date, start_min, end_min, party_size, cap):
+            used = cafe_occupancy.peak_reserved(conn, date, start_min, end_min)
+            remaining = max(0, cap - used)
+            return None, (jsonify({'error': f'Not enough capacity in this slot', 'remaining': remaining, 'capacity': cap}), 409)
+        # Seat the party at the smallest free table that fits (when a layout is configured)
+        table_id = None
+        if tables.layout:
+            day_tables = tables.day(date)
+            table_id = day_tables.assign(party_size, start_min, end_min)
+            if table_id is None:
+                if party_size > day_tables.largest:
+                    return None, (jsonify({'error': f'Largest table seats {day_tables.largest}'}), 400)
+                return None, (jsonify({'error': 'No table free for this party size in this slot'}), 409)
+        return table_id, None
+
+    @app.route('/api/cafe/holds', methods=['POST'])
+    def cafe_create_hold():
+        """
+        Hold seats for CAFE_HOLD_MINUTES while the user confirms.
+        Request: { date, time, partySize, duration }. A user has at most one
+        hold; creating a new one gives back the previous one.
+        """
+        if 'user' not in session and 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+        parsed, err = _parse_slot_request(request.get_json(silent=True) or {})
+        if err:
+            return err
+        date, time, party_size, duration_min = parsed
+        import secrets
+        uid = int(session.get('user_id') or 0)
+        conn = None
+        try:
+            conn = dbconn.connect(_cafe_db_path())
+            conn.isolation_level = None
+            cur = conn.cursor()
+            start_min = _parse_time_to_min(time)
+            cur.execute("BEGIN IMMEDIATE")
+            tables = table_cache.edit(conn, _table_layout())
+            expired, swept_at = _expire_holds(conn, tables)
+            replaced = list(expired)
+            for (old_id,) in cur.execute("SELECT id FROM cafe_holds WHERE user_id=?", (uid,)).fetchall():
+                old = cafe_holds.drop(conn, old_id)
+                tables.release(old[0], old[4], old[1], old[2])
+                replaced.append(old)
+            table_id, err = _take_seats(conn, tables, date, start_min, start_min + duration_min, party_size)
+            if err:
+                cur.execute("ROLLBACK")
+                return err
+            hold_id = secrets.token_urlsafe(12)
+            expires_at = _time.time() + _hold_minutes() * 60
+            cur.execute(
+                "INSERT INTO cafe_holds (id, user_id, date, start_min, end_min, seats, table_id, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (hold_id, uid, date, start_min, start_min + duration_min, party_size, table_id, expires_at)
+            )
+            cur.execute("COMMIT")
+        except Exception as e:
+            return jsonify({'error': f'Failed to hold seats: {e}'}), 500
+        finally:
+            if conn is not None:
+                conn.close()  # rolls back whatever is still open
+        tables.publish()
+        if swept_at is not None:
+            hold_expiry.mark_swept(swept_at)
+        hold_expiry.push(expires_at, hold_id)
+        for old_date, old_start, old_end, _, _ in replaced:
+            _publish_cafe('released', old_date, old_start, old_end)
+        _publish_cafe('held', date, start_min, start_min + duration_min)
+        return jsonify({
+            'success': True, 'hold_id': hold_id, 'date': date, 'time': _minutes_to_time(start_min),
+            'party_size': party_size, 'duration': duration_min, 'table_id': table_id,
+            'expires_in': int(expires_at - _time.time()),
+        }), 201
+
+    @app.route('/api/cafe/holds/<hold_id>', methods=['DELETE'])
+    def cafe_release_hold(hold_id: str):
+        if 'user' not in session and 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+        conn = None
+        try:
+            conn = dbconn.connect(_cafe_db_path())
+            conn.isolation_level = None
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            tables = table_cache.edit(conn, _table_layout())
+            found = cafe_holds.drop(conn, hold_id, int(session.get('user_id') or 0))
+            if found:
+                tables.release(found[0], found[4], found[1], found[2])
+            cur.execute("COMMIT")
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        finally:
+            if conn is not None:
+                conn.close()
+        if not found:
+            return jsonify({'error': 'Hold not found or expired'}), 404
+        tables.publish()
+        _publish_cafe('released', found[0], found[1], found[2])
+        return jsonify({'success': True})
+
+    @app.route('/api/cafe/book', methods=['POST'])
+    def cafe_book():
+        if 'user' not in session and 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        data = request.get_json(silent=True) or {}
+        note = (data.get('note') or '').strip()
+        # With a holdId the slot comes from the hold, whose seats are already taken
+        hold_id = (data.get('holdId') or '').strip()
+        if not hold_id:
+            parsed, err = _parse_slot_request(data)
+            if err:
+                return err
+            date, time, party_size, duration_min = parsed
 
         # Capacity check + Save booking atomically
         from datetime import datetime as _dt
+        uid = int(session.get('user_id') or 0)
+        notify_to = _notify_email(uid) if outbox.enabled() else None
+        conn = None
         try:
-            dbp = _cafe_db_path()
-            conn = sqlite3.connect(dbp)
+            conn = dbconn.connect(_cafe_db_path())
             conn.row_factory = sqlite3.Row
-            _ensure_cafe_tables(conn)
+            # Manual transactions: BEGIN IMMEDIATE takes the write lock up front so
+            # the capacity check and the insert cannot interleave with another booker
+            conn.isolation_level = None
             cur = conn.cursor()
-            # Check overlap usage
-            start_min = _parse_time_to_min(time)
-            used = _sum_booked_seats(conn, date, start_min, duration_min)
-            cap = _slot_capacity()
-            if used + party_size > cap:
-                remaining = max(0, cap - used)
-                conn.close()
-                return jsonify({'error': f'Not enough capacity in this slot', 'remaining': remaining, 'capacity': cap}), 409
+            cur.execute("BEGIN IMMEDIATE")
+            tables = table_cache.edit(conn, _table_layout())
+            expired, swept_at = _expire_holds(conn, tables)
+            if hold_id:
+                cur.execute(
+                    "SELECT date, start_min, end_min, seats, table_id FROM cafe_holds "
+                    "WHERE id=? AND user_id=? AND expires_at > ?",
+                    (hold_id, uid, _time.time())
+                )
+                hold = cur.fetchone()
+                if not hold:
+                    cur.execute("ROLLBACK")
+                    return jsonify({'error': 'Hold expired or not found'}), 410
+                date, start_min, party_size = hold['date'], int(hold['start_min']), int(hold['seats'])
+                duration_min = int(hold['end_min']) - start_min
+                table_id = hold['table_id']
+                # The hold's seats and table carry over to the booking
+                cur.execute("DELETE FROM cafe_holds WHERE id=?", (hold_id,))
+            else:
+                start_min = _parse_time_to_min(time)
+                table_id, err = _take_seats(conn, tables, date, start_min, start_min + duration_min, party_size)
+                if err:
+                    cur.execute("ROLLBACK")
+                    return err
             # Save
             cur.execute(
                 """
-                INSERT INTO cafe_bookings (user_id, date, time, party_size, note, status, created_at, duration_minutes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO cafe_bookings (user_id, date, time, party_size, note, status, created_at, duration_minutes, start_min, end_min, table_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                 (
-                    int(session.get('user_id') or 0),
+                    uid,
                     date,
-                    time,
+                    _minutes_to_time(start_min),
                     party_size,
                     note,
                     'confirmed',
                     _dt.utcnow().isoformat(),
-                    duration_min
+                    duration_min,
+                    start_min,
+                    start_min + duration_min,
+                    table_id
                 )
             )
-            conn.commit()
             bid = cur.lastrowid
-            conn.close()
-            return jsonify({'success': True, 'booking_id': bid, 'status': 'confirmed'})
+            queued = outbox.enqueue(
+                conn, 'cafe_booking', notify_to, f'Cafe booking #{bid} confirmed',
+                f"Your table for {party_size} on {date} at {_minutes_to_time(start_min)} "
+                f"({duration_min} min) is confirmed." + (f"\nNote: {note}" if note else '')
+            )
+            cur.execute("COMMIT")
         except Exception as e:
             return jsonify({'error': f'Failed to save booking: {e}'}), 500
+        finally:
+            if conn is not None:
+                conn.close()
+        tables.publish()
+        if swept_at is not None:
+            hold_expiry.mark_swept(swept_at)
+        if queued:
+            mailer.notify()
+        for old_date, old_start, old_end, _, _ in expired:
+            _publish_cafe('released', old_date, old_start, old_end)
+        _publish_cafe('booked', date, start_min, start_min + duration_min)
+        return jsonify({'success': True, 'booking_id': bid, 'status': 'confirmed', 'table_id': table_id})
+
+    def _stream_after():
+        # Where a reconnecting client left off (-1 on a first connect)
+        try:
+            return int(request.headers.get('Last-Event-ID') or request.args.get('lastEventId') or -1)
+        except ValueError:
+            return -1
+
+    def _cafe_stream():
+        # (topic, match, after) for /api/cafe/events[?date=YYYY-MM-DD], or None if not allowed
+        if 'user' not in session and 'user_id' not in session:
+            return None
+        date = (request.args.get('date') or '').strip()
+        return 'cafe', (lambda data: data.get('date') == date) if date else None, _stream_after()
+
+    @app.route('/api/cafe/events')
+    def cafe_events():
+        """
+        Live slot changes as Server-Sent Events (`slots` events carrying the
+        date/time/duration that changed). Request: /api/cafe/events[?date=YYYY-MM-DD]
+        """
+        params = _cafe_stream()
+        if params is None:
+            return jsonify({'error': 'Authentication required'}), 401
+        return _event_stream(*params)
+
+    def _event_stream(topic, match, after):
+        # The WSGI path: the stream holds this worker thread, so streams are capped
+        # and short-lived. Over the cap the client gets what it missed and a longer
+        # retry, i.e. a cheap poll from memory. asgi.py serves the same endpoints
+        # on its event loop instead, without a thread per client.
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        if not bus.acquire_stream():
+            chunks, _ = bus.preamble(topic, after, match, 10000)
+            return Response(''.join(chunks), mimetype='text/event-stream', headers=headers)
+        lifetime = max(5, int(os.getenv('SSE_STREAM_SECONDS', '30')))
+        resp = Response(bus.stream(topic, after, match, lifetime), mimetype='text/event-stream', headers=headers)
+        resp.call_on_close(bus.release_stream)
+        return resp
 
     @app.route('/api/cafe/bookings', methods=['GET'])
     def cafe_my_bookings():
         if 'user' not in session and 'user_id' not in session:
             return jsonify({'error': 'Authentication required'}), 401
+        # Paginated: upcoming bookings first (soonest first), then past ones (latest
+        # first). The next page's cursor is returned in the X-Next-Cursor header.
+        try:
+            limit = min(max(int(request.args.get('limit') or 20), 1), 100)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        try:
+            cursor = _parse_bookings_cursor(request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        from datetime import date as _date
+        today = _date.today().isoformat()
+        uid = int(session.get('user_id') or 0)
         try:
             dbp = _cafe_db_path()
-            conn = sqlite3.connect(dbp)
+            conn = dbconn.connect(dbp, readonly=True)
             conn.row_factory = sqlite3.Row
-            _ensure_cafe_tables(conn)
             cur = conn.cursor()
-            cur.execute(
-                "SELECT * FROM cafe_bookings WHERE user_id = ? ORDER BY date DESC, time DESC",
-                (int(session.get('user_id') or 0),)
-            )
-            rows = [dict(r) for r in cur.fetchall()]
+            rows = []
+            segment, key = cursor or ('u', None)
+            if segment == 'u':
+                query = "SELECT * FROM cafe_bookings WHERE user_id = ? AND date >= ?"
+                params = [uid, today]
+                if key:
+                    query += " AND (date, start_min, id) > (?, ?, ?)"
+                    params.extend(key)
+                cur.execute(query + " ORDER BY date, start_min, id LIMIT ?", params + [limit + 1])
+                rows = [dict(r) for r in cur.fetchall()]
+                key = None
+            if len(rows) <= limit:
+                query = "SELECT * FROM cafe_bookings WHERE user_id = ? AND date < ?"
+                params = [uid, today]
+                if key:
+                    query += " AND (date, start_min, id) < (?, ?, ?)"
+                    params.extend(key)
+                cur.execute(query + " ORDER BY date DESC, start_min DESC, id DESC LIMIT ?",
+                            params + [limit + 1 - len(rows)])
+                rows += [dict(r) for r in cur.fetchall()]
             conn.close()
-            return jsonify(rows)
+            resp = jsonify(rows[:limit])
+            if len(rows) > limit:
+                last = rows[limit - 1]
+                segment = 'u' if last['date'] >= today else 'p'
+                resp.headers['X-Next-Cursor'] = f"{segment}|{last['date']}|{last['start_min']}|{last['id']}"
+            return resp
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+    def _parse_bookings_cursor(raw):
+        # "<u|p>|YYYY-MM-DD|start_min|id" -> (segment, (date, start_min, id))
+        if not raw:
+            return None
+        segment, date, start, bid = raw.split('|')
+        if segment not in ('u', 'p') or len(date) != 10:
+            raise ValueError('bad cursor')
+        return segment, (date, int(start), int(bid))
+
     @app.route('/api/cafe/bookings/<int:bid>', methods=['DELETE'])
     def cafe_cancel_booking(bid: int):
         if 'user' not in session and 'user_id' not in session:
             return jsonify({'error': 'Authentication required'}), 401
+        conn = None
         try:
-            dbp = _cafe_db_path()
-            conn = sqlite3.connect(dbp)
+            conn = dbconn.connect(_cafe_db_path())
             conn.row_factory = sqlite3.Row
-            _ensure_cafe_tables(conn)
+            conn.isolation_level = None
             cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
             # verify ownership and current status
-            cur.execute("SELECT id, user_id, status FROM cafe_bookings WHERE id=?", (bid,))
+            cur.execute("SELECT id, user_id, status, date, start_min, end_min, party_size, table_id FROM cafe_bookings WHERE id=?", (bid,))
             row = cur.fetchone()
             if not row:
-                conn.close()
+                cur.execute("ROLLBACK")
                 return jsonify({'error': 'Booking not found'}), 404
             if int(row['user_id']) != int(session.get('user_id') or 0):
-                conn.close()
+                cur.execute("ROLLBACK")
                 return jsonify({'error': 'Forbidden'}), 403
             if row['status'] != 'confirmed':
-                conn.close()
+                cur.execute("ROLLBACK")
                 return jsonify({'error': 'Booking is not active'}), 400
             from datetime import datetime as _dt
             cur.execute(
                 "UPDATE cafe_bookings SET status='canceled', canceled_at=? WHERE id=?",
                 (_dt.utcnow().isoformat(), bid)
             )
-            conn.commit()
-            conn.close()
-            return jsonify({'success': True})
+            cafe_occupancy.release(conn, row['date'], int(row['start_min']), int(row['end_min']),
+                                   int(row['party_size'] or 0))
+            tables = table_cache.edit(conn, _table_layout())
+            tables.release(row['date'], row['table_id'], row['start_min'], row['end_min'])
+            cur.execute("COMMIT")
         except Exception as e:
             return jsonify({'error': str(e)}), 500
+        finally:
+            if conn is not None:
+                conn.close()
+        tables.publish()
+        _publish_cafe('canceled', row['date'], row['start_min'], row['end_min'])
+        return jsonify({'success': True})
 
     @app.route('/cart')
     def cart():
@@ -790,11 +1471,13 @@ def create_app(config=None):
         from datetime import datetime as _dt
         try:
             dbp = _community_db_path()
-            conn = sqlite3.connect(dbp)
+            conn = dbconn.connect(dbp)
             conn.row_factory = sqlite3.Row
-            _ensure_community_tables(conn)
             cur = conn.cursor()
-            cur.execute("INSERT OR IGNORE INTO community_subscribers(email, joined_at) VALUES(?, ?)", (email, _dt.utcnow().isoformat()))
+            cur.execute(
+                "INSERT OR IGNORE INTO community_subscribers(email, joined_at, email_masked) VALUES(?, ?, ?)",
+                (email, _dt.utcnow().isoformat(), community_directory.mask_email(email))
+            )
             # Link to account if logged in
             uid = int(session.get('user_id') or 0)
             if uid:
@@ -809,17 +1492,15 @@ def create_app(config=None):
     @app.route('/api/community/messages', methods=['GET', 'POST'])
     def community_messages():
         if request.method == 'GET':
-            # Public feed, but page access controls viewing UI
+            # Public feed, but page access controls viewing UI. Newest first;
+            # ?since_id=N returns messages after N, ?before_id=N older ones.
             try:
-                dbp = _community_db_path()
-                conn = sqlite3.connect(dbp)
-                conn.row_factory = sqlite3.Row
-                _ensure_community_tables(conn)
-                cur = conn.cursor()
-                cur.execute("SELECT id, author, content, is_admin, created_at FROM community_messages ORDER BY id DESC LIMIT 50")
-                rows = [dict(r) for r in cur.fetchall()]
-                conn.close()
-                return jsonify(rows)
+                since_id, before_id, limit = _feed_args()
+            except ValueError:
+                return jsonify({'error': 'since_id, before_id and limit must be integers'}), 400
+            try:
+                rows, more = _community_feed(since_id, before_id, limit)
+                return _feed_response(rows, more, since_id)
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
         # POST -> admin-only create message
@@ -832,66 +1513,200 @@ def create_app(config=None):
         from datetime import datetime as _dt
         try:
             dbp = _community_db_path()
-            conn = sqlite3.connect(dbp)
+            conn = dbconn.connect(dbp)
             conn.row_factory = sqlite3.Row
-            _ensure_community_tables(conn)
             cur = conn.cursor()
             author = session.get('user') or 'admin'
+            created_at = _dt.utcnow().isoformat()
             cur.execute(
                 """
                 INSERT INTO community_messages(user_id, author, content, is_admin, created_at)
                 VALUES(?, ?, ?, ?, ?)
                 """,
-                (int(session.get('user_id') or 0), author, content, 1, _dt.utcnow().isoformat())
+                (int(session.get('user_id') or 0), author, content, 1, created_at)
             )
-            conn.commit()
             mid = cur.lastrowid
+            # One fan-out row; the outbox workers expand it per subscriber
+            queued = outbox.enqueue(conn, 'community_update', outbox.FANOUT,
+                                    f'Community update from {author}', content)
+            conn.commit()
             conn.close()
+            if queued:
+                mailer.notify()
+            bus.publish('community', 'message', {
+                'id': mid, 'author': author, 'content': content, 'is_admin': 1, 'created_at': created_at,
+            })
             return jsonify({'success': True, 'id': mid})
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+    def _optional_int(value):
+        return int(value) if value not in (None, '') else None
+
+    def _feed_args():
+        return (_optional_int(request.args.get('since_id')), _optional_int(request.args.get('before_id')),
+                min(max(int(request.args.get('limit') or 50), 1), 100))
+
+    def _community_feed(since_id, before_id, limit):
+        conn = dbconn.connect(_community_db_path(), readonly=True)
+        conn.row_factory = sqlite3.Row
+        try:
+            return _community_page(conn.cursor(), since_id, before_id, limit)
+        finally:
+            conn.close()
+
+    def _feed_response(rows, more, since_id):
+        resp = jsonify(rows)
+        # Cursor for the next page in the same direction, when there is one
+        if more and since_id is not None:
+            resp.headers['X-Next-Since-Id'] = str(rows[0]['id'])
+        elif more:
+            resp.headers['X-Next-Before-Id'] = str(rows[-1]['id'])
+        return resp
+
+    def _community_page(cur, since_id, before_id, limit):
+        # Keyset page over the id primary key; returns (rows newest first, has_more)
+        cols = "SELECT id, author, content, is_admin, created_at FROM community_messages"
+        if since_id is not None:
+            # Oldest first after the cursor so a long gap is walked without skipping
+            query, params = cols + " WHERE id > ?", [since_id]
+            if before_id is not None:
+                query += " AND id < ?"
+                params.append(before_id)
+            cur.execute(query + " ORDER BY id ASC LIMIT ?", params + [limit + 1])
+            rows = [dict(r) for r in cur.fetchall()]
+            more = len(rows) > limit
+            return rows[:limit][::-1], more
+        query, params = cols, []
+        if before_id is not None:
+            query += " WHERE id < ?"
+            params.append(before_id)
+        cur.execute(query + " ORDER BY id DESC LIMIT ?", params + [limit + 1])
+        rows = [dict(r) for r in cur.fetchall()]
+        return rows[:limit], len(rows) > limit
+
+    UNREAD_CAP = 99
+
+    def _current_subscriber(cur):
+        # Subscriber row for the joined email, else for the logged-in account
+        email = (session.get('community_email') or '').strip().lower()
+        if email:
+            cur.execute("SELECT id, last_seen_message_id FROM community_subscribers WHERE email=?", (email,))
+            row = cur.fetchone()
+            if row:
+                return row
+        uid = int(session.get('user_id') or 0)
+        if uid:
+            cur.execute("SELECT id, last_seen_message_id FROM community_subscribers WHERE user_id=? ORDER BY id LIMIT 1", (uid,))
+            return cur.fetchone()
+        return None
+
+    @app.route('/api/community/unread')
+    def community_unread():
+        """
+        Unread message count for the header badge, without loading the feed.
+        Counts at most UNREAD_CAP + 1 rows of the id range (shown as "99+").
+        """
+        if not _community_can_access():
+            return jsonify({'error': 'Join the community first'}), 403
+        try:
+            conn = dbconn.connect(_community_db_path(), readonly=True)
+            cur = conn.cursor()
+            sub = _current_subscriber(cur)
+            if sub is None:
+                conn.close()
+                return jsonify({'subscribed': False, 'unread': 0})
+            last_seen = int(sub[1] or 0)
+            cur.execute(
+                "SELECT COUNT(*) FROM (SELECT 1 FROM community_messages WHERE id > ? LIMIT ?) AS unread",
+                (last_seen, UNREAD_CAP + 1)
+            )
+            unread = cur.fetchone()[0]
+            conn.close()
+            return jsonify({'subscribed': True, 'unread': unread, 'capped': unread > UNREAD_CAP,
+                            'last_seen_message_id': last_seen})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/community/seen', methods=['POST'])
+    def community_mark_seen():
+        # Request: { lastId } -- the newest message id the user has seen (never moves backwards)
+        if not _community_can_access():
+            return jsonify({'error': 'Join the community first'}), 403
+        data = request.get_json(silent=True) or {}
+        try:
+            last_id = int(data.get('lastId') or 0)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'lastId must be an integer'}), 400
+        try:
+            conn = dbconn.connect(_community_db_path())
+            cur = conn.cursor()
+            sub = _current_subscriber(cur)
+            if sub is None:
+                conn.close()
+                return jsonify({'error': 'Not subscribed'}), 404
+            cur.execute(
+                "UPDATE community_subscribers SET last_seen_message_id = "
+                "MAX(last_seen_message_id, MIN(?, (SELECT IFNULL(MAX(id), 0) FROM community_messages))) WHERE id=?",
+                (last_id, sub[0])
+            )
+            conn.commit()
+            conn.close()
+            return jsonify({'success': True})
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    def _community_stream():
+        return ('community', None, _stream_after()) if _community_can_access() else None
+
+    @app.route('/api/community/events')
+    def community_events():
+        # Live feed: new messages pushed as `message` events
+        params = _community_stream()
+        if params is None:
+            return jsonify({'error': 'Join the community first'}), 403
+        return _event_stream(*params)
+
+    # endpoint -> () -> (topic, match, after) or None, for asgi.py's native event streams
+    app.extensions['event_streams'] = {'cafe_events': _cafe_stream, 'community_events': _community_stream}
+
     @app.route('/api/community/subscribers', methods=['GET'])
     def community_subscribers():
-        # List subscribers; obfuscate emails for non-admins
+        """
+        Members directory, newest first; emails are masked for non-admins.
+        Request: ?limit=50&cursor=&q=<prefix>[&field=name|email]. Email search is
+        admin-only. The next page's cursor is returned in the X-Next-Cursor header.
+        """
         is_admin_flag = False
         try:
             is_admin_flag = _is_admin()
         except Exception:
             is_admin_flag = False
+        field = (request.args.get('field') or 'name').strip()
+        if field not in ('name', 'email'):
+            return jsonify({'error': 'field must be name or email'}), 400
+        if field == 'email' and not is_admin_flag:
+            return jsonify({'error': 'Admins only'}), 403
+        try:
+            limit = int(request.args.get('limit') or 50)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
         try:
             dbp = _community_db_path()
-            conn = sqlite3.connect(dbp)
+            conn = dbconn.connect(dbp, readonly=True)
             conn.row_factory = sqlite3.Row
-            _ensure_community_tables(conn)
             cur = conn.cursor()
-            cur.execute("SELECT id, email, joined_at, display_name, photo_path FROM community_subscribers ORDER BY id DESC LIMIT 200")
-            rows = []
-            for r in cur.fetchall():
-                email = r['email'] or ''
-                def _mask(e):
-                    try:
-                        name, dom = e.split('@', 1)
-                        shown = name[:2]
-                        return f"{shown}{'*'*(max(0,len(name)-2))}@{dom}"
-                    except Exception:
-                        return e
-                masked = email if is_admin_flag else _mask(email)
-                photo_url = None
-                if r['photo_path']:
-                    try:
-                        photo_url = url_for('static', filename=r['photo_path'])
-                    except Exception:
-                        photo_url = None
-                rows.append({
-                    'id': r['id'],
-                    'email': email if is_admin_flag else masked,
-                    'display_name': r['display_name'] or '',
-                    'joined_at': r['joined_at'] or '',
-                    'photo_url': photo_url
-                })
+            try:
+                rows, next_cursor = community_directory.list_page(
+                    cur, limit, request.args.get('cursor'), request.args.get('q'), field, is_admin_flag)
+            except ValueError:
+                conn.close()
+                return jsonify({'error': 'Invalid cursor'}), 400
             conn.close()
-            return jsonify(rows)
+            resp = jsonify(rows)
+            if next_cursor:
+                resp.headers['X-Next-Cursor'] = next_cursor
+            return resp
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -901,17 +1716,23 @@ def create_app(config=None):
         email = (session.get('community_email') or '').strip().lower()
         if not email:
             return jsonify({'success': False, 'error': 'Join the community with your email first from Home'}), 403
+        # Refuse oversized uploads from the declared length before parsing the body
+        max_bytes = _avatar_max_bytes()
+        if request.content_length and request.content_length > max_bytes + 64 * 1024:
+            return jsonify({'success': False, 'error': f'Image is larger than {max_bytes // 1024} KB'}), 413
         display_name = (request.form.get('display_name') or '').strip()
         photo = request.files.get('photo')
         # Find or create subscriber row
         from datetime import datetime as _dt
         try:
             dbp = _community_db_path()
-            conn = sqlite3.connect(dbp)
+            conn = dbconn.connect(dbp)
             conn.row_factory = sqlite3.Row
-            _ensure_community_tables(conn)
             cur = conn.cursor()
-            cur.execute("INSERT OR IGNORE INTO community_subscribers(email, joined_at) VALUES(?, ?)", (email, _dt.utcnow().isoformat()))
+            cur.execute(
+                "INSERT OR IGNORE INTO community_subscribers(email, joined_at, email_masked) VALUES(?, ?, ?)",
+                (email, _dt.utcnow().isoformat(), community_directory.mask_email(email))
+            )
             conn.commit()
             cur.execute("SELECT id, photo_path FROM community_subscribers WHERE email=?", (email,))
             row = cur.fetchone()
@@ -921,8 +1742,9 @@ def create_app(config=None):
             sub_id = int(row['id'])
             photo_path = row['photo_path']
 
-            # Handle upload if provided
+            # Handle upload if provided: stored once per distinct image (see avatars)
             saved_rel_path = None
+            new_blob = None
             if photo and getattr(photo, 'filename', ''):
                 fname = secure_filename(photo.filename)
                 ext = ''
@@ -931,20 +1753,40 @@ def create_app(config=None):
                 if ext not in ('.png', '.jpg', '.jpeg', '.webp'):
                     conn.close()
                     return jsonify({'success': False, 'error': 'Only PNG, JPG, JPEG, WEBP allowed'}), 400
-                # Save under static/uploads/community
-                upload_dir = os.path.join(app.static_folder, 'uploads', 'community')
-                os.makedirs(upload_dir, exist_ok=True)
-                new_name = f"sub_{sub_id}{ext}"
-                abs_path = os.path.join(upload_dir, new_name)
-                photo.save(abs_path)
-                saved_rel_path = os.path.join('uploads', 'community', new_name)
-
-            # Apply updates to subscriber
-            if display_name:
-                cur.execute("UPDATE community_subscribers SET display_name=? WHERE id=?", (display_name, sub_id))
-            if saved_rel_path:
-                cur.execute("UPDATE community_subscribers SET photo_path=? WHERE id=?", (saved_rel_path, sub_id))
-            conn.commit()
+                try:
+                    new_blob = avatars.store(app.instance_path, photo.stream, max_bytes)
+                except avatars.AvatarTooLarge as e:
+                    conn.close()
+                    return jsonify({'success': False, 'error': str(e)}), 413
+                except avatars.AvatarError as e:
+                    conn.close()
+                    return jsonify({'success': False, 'error': str(e)}), 400
+                saved_rel_path = avatars.PREFIX + new_blob
+
+            # Apply updates to subscriber; reference counts change in the same transaction
+            conn.isolation_level = None
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                if display_name:
+                    cur.execute("UPDATE community_subscribers SET display_name=?, name_key=? WHERE id=?",
+                                (display_name, community_directory.name_key(display_name), sub_id))
+                if saved_rel_path:
+                    avatars.incref(conn, new_blob, os.path.getsize(avatars.file_path(app.instance_path, new_blob)))
+                    cur.execute("UPDATE community_subscribers SET photo_path=?, photo_url=? WHERE id=?",
+                                (saved_rel_path, community_directory.photo_url(saved_rel_path, app.static_url_path), sub_id))
+                    old_blob = avatars.name_from_path(photo_path)
+                    # Under the write lock, so no other upload can be re-using the file
+                    if old_blob and avatars.decref(conn, old_blob):
+                        avatars.remove_file(app.instance_path, old_blob)
+                cur.execute("COMMIT")
+            except FileNotFoundError:
+                # The identical file was cleaned up between storing and counting it
+                cur.execute("ROLLBACK")
+                conn.close()
+                return jsonify({'success': False, 'error': 'Upload interrupted, please try again'}), 409
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
             # If logged in, also mirror to User profile
             uid = int(session.get('user_id') or 0)
             if uid:
@@ -956,6 +1798,7 @@ def create_app(config=None):
                         if saved_rel_path:
                             user.photo_path = saved_rel_path
                         db.session.commit()
+                        _cache_display_name(uid, user.display_name)
                 except Exception:
                     db.session.rollback()
             conn.close()
@@ -963,6 +1806,28 @@ def create_app(config=None):
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
 
+    AVATAR_MAX_AGE = 365 * 24 * 3600
+
+    def _avatar_max_bytes():
+        try:
+            return max(16 * 1024, int(os.getenv('AVATAR_MAX_BYTES', str(2 * 1024 * 1024))))
+        except Exception:
+            return 2 * 1024 * 1024
+
+    @app.route('/avatars/<name>')
+    def community_avatar(name: str):
+        # Content-addressed, so a name always means the same bytes: cache forever
+        if not avatars.NAME_RE.match(name):
+            return jsonify({'error': 'Not found'}), 404
+        path = avatars.file_path(app.instance_path, name)
+        if not os.path.exists(path):
+            return jsonify({'error': 'Not found'}), 404
+        from flask import send_file
+        resp = send_file(path, mimetype=avatars.MIMETYPES[name.rsplit('.', 1)[1]],
+                         etag=name.split('.', 1)[0], max_age=AVATAR_MAX_AGE, conditional=True)
+        resp.headers['Cache-Control'] = f'public, max-age={AVATAR_MAX_AGE}, immutable'
+        return resp
+
     @app.route('/api/community/me', methods=['GET'])
     def community_me():
         email = (session.get('community_email') or '').strip().lower()
@@ -970,26 +1835,19 @@ def create_app(config=None):
             return jsonify({'error': 'Not joined'}), 404
         try:
             dbp = _community_db_path()
-            conn = sqlite3.connect(dbp)
+            conn = dbconn.connect(dbp, readonly=True)
             conn.row_factory = sqlite3.Row
-            _ensure_community_tables(conn)
             cur = conn.cursor()
-            cur.execute("SELECT id, email, display_name, photo_path, joined_at FROM community_subscribers WHERE email=?", (email,))
+            cur.execute("SELECT id, email, display_name, photo_url, joined_at FROM community_subscribers WHERE email=?", (email,))
             row = cur.fetchone()
             conn.close()
             if not row:
                 return jsonify({'error': 'Not found'}), 404
-            photo_url = None
-            if row['photo_path']:
-                try:
-                    photo_url = url_for('static', filename=row['photo_path'])
-                except Exception:
-                    photo_url = None
             return jsonify({
                 'email': row['email'],
                 'display_name': row['display_name'] or '',
                 'joined_at': row['joined_at'] or '',
-                'photo_url': photo_url
+                'photo_url': row['photo_url']
             })
         except Exception as e:
             return jsonify({'error': str(e)}), 500
@@ -1027,7 +1885,9 @@ def create_app(config=None):
     app.register_blueprint(cart_bp)
 
     # init auth DB after app exists
-    init_auth_db(app)
+    with timer.phase('users'):
+        init_auth_db(app)
+        _init_users_db()
 
     # Enforce login for restricted paths
     RESTRICTED_PREFIXES = (
@@ -1042,26 +1902,53 @@ def create_app(config=None):
             if not session.get('user') and not session.get('user_id'):
                 return redirect(url_for('login'))
 
-    @app.context_processor
-    def inject_admin_flag():
-        # Provide a convenience flag to templates for showing admin-only UI
+    # ---------------- Template context ----------------
+    # Values are lazy: a template that never mentions one never computes it, and
+    # one that mentions it twice computes it once (memoized on flask.g).
+    def _per_request(key, fn):
+        def _get():
+            if key not in g:
+                with tracing.span(f'context {key}', 'context'):
+                    setattr(g, key, fn())
+            return getattr(g, key)
+        return LocalProxy(_get)
+
+    def _cache_display_name(uid, name):
+        ttl = int(os.getenv('DISPLAY_NAME_TTL', '300'))
+        session['display_name_cache'] = {'uid': int(uid), 'value': name or None, 'exp': _time.time() + ttl}
+
+    def _display_name():
+        # From the session while fresh; otherwise one users.db lookup, then cached again
+        uid = session.get('user_id')
+        if not uid:
+            return None
+        cached = session.get('display_name_cache') or {}
+        if cached.get('uid') == int(uid) and cached.get('exp', 0) > _time.time():
+            return cached.get('value')
         try:
-            return { 'is_admin': _is_admin() }
+            u = db.session.get(User, int(uid))
         except Exception:
-            return { 'is_admin': False }
+            return None
+        name = u.display_name if u and u.display_name else None
+        _cache_display_name(uid, name)
+        return name
 
-    @app.context_processor
-    def inject_user_profile():
-        # Provide current user's display name to templates if available
+    def _safe_is_admin():
         try:
-            uid = session.get('user_id')
-            if uid:
-                u = User.query.get(int(uid))
-                if u and getattr(u, 'display_name', None):
-                    return { 'user_display_name': u.display_name }
+            return _is_admin()
         except Exception:
-            pass
-        return { 'user_display_name': None }
+            return False
+
+    def _cart_count():
+        return sum(i.get('quantity', 1) for i in session.get('cart', {}).get('items', []))
+
+    @app.context_processor
+    def inject_template_context():
+        return {
+            'is_admin': _per_request('_ctx_is_admin', _safe_is_admin),
+            'user_display_name': _per_request('_ctx_display_name', _display_name),
+            'cart_count': _per_request('_ctx_cart_count', _cart_count),
+        }
 
     # ---------------- Admin Dashboard ----------------
     def _is_admin():
@@ -1071,11 +1958,8 @@ def create_app(config=None):
             return True
         if (session.get('user_id') or 0) == 1:
             return True
-        admin_users = os.getenv('ADMIN_USERS', '')
-        if admin_users:
-            allowed = {u.strip().lower() for u in admin_users.split(',') if u.strip()}
-            if uname.lower() in allowed:
-                return True
+        if uname.lower() in _admin_users(os.getenv('ADMIN_USERS', '')):
+            return True
         return False
 
     @app.route('/admin')
@@ -1084,7 +1968,15 @@ def create_app(config=None):
             return redirect(url_for('login'))
         if not _is_admin():
             return "Forbidden: Admins only", 403
+        # Identical for every admin, so concurrent refreshes share one aggregation
+        data = flights.do(('admin_dashboard',), _dashboard_data)
+        return render_template('admin.html', **data)
+
+    def _dashboard_data():
+        # One database after the other; /api/async/admin/dashboard reads them concurrently
+        return _dashboard_summary(_dashboard_purchases(), _dashboard_bookings())
 
+    def _dashboard_purchases():
         # Purchases summary (games.db)
         games_dbp = os.path.join(app.instance_path, 'games.db')
         purchases = []
@@ -1092,7 +1984,7 @@ def create_app(config=None):
         method_totals = {}
         daily_map = {}
         try:
-            gconn = sqlite3.connect(games_dbp)
+            gconn = dbconn.connect(games_dbp, readonly=True)
             gconn.row_factory = sqlite3.Row
             cur = gconn.cursor()
             cur.execute("SELECT COUNT(*) as c, IFNULL(SUM(total_amount),0) as s FROM purchase_history")
@@ -1124,12 +2016,14 @@ def create_app(config=None):
             gconn.close()
         except Exception:
             purchases = []
+        return totals, purchases, method_totals, daily_map
 
+    def _dashboard_bookings():
         # Cafe bookings (cafe.db)
         cafe_dbp = os.path.join(app.instance_path, 'cafe.db')
         bookings = []
         try:
-            cconn = sqlite3.connect(cafe_dbp)
+            cconn = dbconn.connect(cafe_dbp, readonly=True)
             cconn.row_factory = sqlite3.Row
             cur = cconn.cursor()
             cur.execute("SELECT * FROM cafe_bookings ORDER BY date DESC, time DESC")
@@ -1137,7 +2031,10 @@ def create_app(config=None):
             cconn.close()
         except Exception:
             bookings = []
+        return bookings
 
+    def _dashboard_summary(purchases_part, bookings):
+        totals, purchases, method_totals, daily_map = purchases_part
         # Derive simple members list from activity
         members = {}
         for p in purchases:
@@ -1159,16 +2056,15 @@ def create_app(config=None):
         daily_list = list(reversed(daily_list))  # chronological order for display
         daily_max = max((d['revenue'] for d in daily_list), default=0.0)
 
-        return render_template(
-            'admin.html',
-            totals=totals,
-            purchases=purchases,
-            bookings=bookings,
-            members=members_list,
-            method_totals=method_totals,
-            daily_revenue=daily_list,
-            daily_max=daily_max
-        )
+        return {
+            'totals': totals,
+            'purchases': purchases,
+            'bookings': bookings,
+            'members': members_list,
+            'method_totals': method_totals,
+            'daily_revenue': daily_list,
+            'daily_max': daily_max,
+        }
 
     @app.route('/admin/revenue.csv')
     def admin_revenue_csv():
@@ -1179,7 +2075,7 @@ def create_app(config=None):
         games_dbp = os.path.join(app.instance_path, 'games.db')
         rows = []
         try:
-            gconn = sqlite3.connect(games_dbp)
+            gconn = dbconn.connect(games_dbp, readonly=True)
             gconn.row_factory = sqlite3.Row
             cur = gconn.cursor()
             cur.execute("SELECT id, user_id, purchase_date, total_amount, COALESCE(payment_method,'Demo') as payment_method FROM purchase_history ORDER BY purchase_date DESC")
@@ -1198,6 +2094,333 @@ def create_app(config=None):
         resp.headers['Content-Disposition'] = 'attachment; filename=revenue.csv'
         return resp
 
+    @app.route('/admin/analytics.json')
+    def admin_analytics():
+        # Cohort / retention / conversion metrics computed column-wise with NumPy
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        try:
+            weeks = min(max(int(request.args.get('weeks') or 12), 1), 104)
+        except ValueError:
+            return jsonify({'error': 'weeks must be an integer'}), 400
+        try:
+            return jsonify(analytics.build_dashboard_analytics(app.instance_path, max_weeks=weeks))
+        except Exception as e:
+            app.logger.exception(f"Analytics failed: {e}")
+            return jsonify({'error': f'Failed to compute analytics: {e}'}), 500
+
+    @app.route('/admin/dashboard.json')
+    def admin_dashboard_json():
+        # The dashboard's data and analytics as JSON (sync; see /api/async/admin/dashboard)
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        return jsonify(dict(_dashboard_data(), analytics=analytics.build_dashboard_analytics(app.instance_path)))
+
+    @app.route('/admin/events.json')
+    def admin_event_metrics():
+        # Event bus counters: published/delivered, dropped slow subscribers, open streams
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        return jsonify(bus.metrics())
+
+    @app.route('/admin/metrics')
+    def admin_metrics():
+        # Prometheus text format; an admin session, or `Authorization: Bearer $METRICS_TOKEN` for scrapers
+        import hmac
+        token = os.getenv('METRICS_TOKEN')
+        auth = request.headers.get('Authorization', '')
+        scraper = bool(token) and hmac.compare_digest(auth.encode(), f'Bearer {token}'.encode())
+        if not scraper:
+            if not (session.get('user') or session.get('user_id')):
+                return jsonify({'error': 'Authentication required'}), 401
+            if not _is_admin():
+                return jsonify({'error': 'Admins only'}), 403
+        return Response(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    @app.route('/admin/profiles')
+    def admin_profiles():
+        # Most recent request profiles; add ?profile=1 (or X-Profile: 1) to any request to record one
+        if not (session.get('user') or session.get('user_id')):
+            return redirect(url_for('login'))
+        if not _is_admin():
+            return "Forbidden", 403
+        return render_template('admin_profiles.html', profiles=profiler.recent(), status=profiler.metrics())
+
+    @app.route('/admin/profiles/<profile_id>')
+    def admin_profile_report(profile_id):
+        # pstats table for one profile (?sort=cumulative|tottime|calls); ?format=prof|folded downloads the file
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        fmt = request.args.get('format')
+        if fmt in ('prof', 'folded'):
+            from flask import send_file
+            path = profiler.path_for(profile_id, '.' + fmt)
+            if path is None:
+                return jsonify({'error': 'Not found'}), 404
+            return send_file(path, mimetype='application/octet-stream' if fmt == 'prof' else 'text/plain',
+                             as_attachment=True, download_name=f"{profile_id}.{fmt}")
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in ('cumulative', 'tottime', 'calls', 'ncalls'):
+            sort = 'cumulative'
+        text_report = profiler.report(profile_id, sort)
+        if text_report is None:
+            return jsonify({'error': 'Not found'}), 404
+        return Response(text_report, mimetype='text/plain')
+
+    def _memory_admin_error():
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        return None
+
+    def _memory_view_args():
+        group = request.args.get('group', 'lineno')
+        if group not in memtrace.GROUPINGS:
+            group = 'lineno'
+        try:
+            limit = max(1, min(200, int(request.args.get('limit', 25))))
+        except ValueError:
+            limit = 25
+        return group, limit
+
+    @app.route('/admin/memory.json')
+    def admin_memory_status():
+        # Tracing state, traced/RSS size, kept snapshots and per-endpoint peak allocation of sampled requests
+        denied = _memory_admin_error()
+        if denied:
+            return denied
+        return jsonify(memory.status())
+
+    @app.route('/admin/memory/start', methods=['POST'])
+    def admin_memory_start():
+        denied = _memory_admin_error()
+        if denied:
+            return denied
+        data = request.get_json(silent=True) or {}
+        try:
+            frames = max(1, min(50, int(data.get('frames') or memory.frames)))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'frames must be a number'}), 400
+        memory.start(frames)
+        return jsonify(memory.status())
+
+    @app.route('/admin/memory/stop', methods=['POST'])
+    def admin_memory_stop():
+        denied = _memory_admin_error()
+        if denied:
+            return denied
+        memory.stop()
+        return jsonify(memory.status())
+
+    @app.route('/admin/memory/snapshots', methods=['POST'])
+    def admin_memory_snapshot():
+        denied = _memory_admin_error()
+        if denied:
+            return denied
+        snap_id = memory.snapshot()
+        if snap_id is None:
+            return jsonify({'error': 'Tracing is off; POST /admin/memory/start first'}), 409
+        group, limit = _memory_view_args()
+        return jsonify(memory.top(snap_id, group, limit)), 201
+
+    @app.route('/admin/memory/snapshots/<int:snap_id>')
+    def admin_memory_snapshot_top(snap_id):
+        denied = _memory_admin_error()
+        if denied:
+            return denied
+        group, limit = _memory_view_args()
+        result = memory.top(snap_id, group, limit)
+        if result is None:
+            return jsonify({'error': 'Snapshot not found'}), 404
+        return jsonify(result)
+
+    @app.route('/admin/memory/diff')
+    def admin_memory_diff():
+        # ?from=<id>&to=<id>; defaults to the two newest snapshots
+        denied = _memory_admin_error()
+        if denied:
+            return denied
+        ids = [s['id'] for s in memory.status()['snapshots']]
+        try:
+            old_id = int(request.args.get('from') or (ids[-2] if len(ids) > 1 else 0))
+            new_id = int(request.args.get('to') or (ids[-1] if ids else 0))
+        except ValueError:
+            return jsonify({'error': 'from and to must be snapshot ids'}), 400
+        group, limit = _memory_view_args()
+        result = memory.diff(old_id, new_id, group, limit)
+        if result is None:
+            return jsonify({'error': 'Snapshot not found', 'snapshots': ids}), 404
+        return jsonify(result)
+
+    @app.route('/admin/traces')
+    def admin_traces():
+        # Recent sampled traces from every worker; add ?trace=1 (or X-Trace: 1) to any request to record one
+        if not (session.get('user') or session.get('user_id')):
+            return redirect(url_for('login'))
+        if not _is_admin():
+            return "Forbidden", 403
+        return render_template('admin_traces.html', traces=tracer.recent(), sample_rate=tracer.sample_rate)
+
+    @app.route('/admin/traces/<trace_id>')
+    def admin_trace(trace_id):
+        # One trace as a waterfall; ?format=json for the exported record
+        if not (session.get('user') or session.get('user_id')):
+            return redirect(url_for('login'))
+        if not _is_admin():
+            return "Forbidden", 403
+        record = tracer.find(trace_id) if trace_id.isalnum() else None
+        if record is None:
+            return "Trace not found", 404
+        if request.args.get('format') == 'json':
+            return jsonify(record)
+        return render_template('admin_trace.html', trace=record, spans=tracing.waterfall(record))
+
+    @app.route('/admin/startup.json')
+    def admin_startup_report():
+        # This process's cold start (import, init phases, first response) and recent ones from startup.jsonl
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        return jsonify({'current': timer.report(),
+                        'history': startup.history(os.path.join(app.instance_path, 'startup.jsonl'))})
+
+    @app.route('/admin/singleflight.json')
+    def admin_singleflight_metrics():
+        # Per-key request coalescing counters (executions vs. coalesced waits)
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        return jsonify(flights.metrics())
+
+    @app.route('/admin/outbox.json')
+    def admin_outbox_metrics():
+        # Notification outbox: rows per status in each database, delivery counters
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        return jsonify(mailer.stats())
+
+    @app.route('/admin/db.json')
+    def admin_db_metrics():
+        # Connection pools: opened vs reused SQLite handles, or per-schema PostgreSQL pool stats
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        return jsonify(dict(dbconn.metrics(), async_executor=db_executor.metrics()))
+
+    @app.route('/admin/auth.json')
+    def admin_auth_metrics():
+        # Password hashing pool latency/backlog and login throttle rejections
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        return jsonify({'hashing': password_hasher.metrics(), 'throttle': login_throttle.metrics()})
+
+    # ---------- /api/async: async variants of the read-heavy JSON APIs ----------
+    # Same payloads as the sync routes. Each blocking DB call runs on
+    # db_executor, and independent ones are awaited together, so a request
+    # costs its slowest query rather than the sum of them.
+    async_api = Blueprint('async_api', __name__, url_prefix='/api/async')
+
+    @async_api.errorhandler(aio.ExecutorBusy)
+    def async_busy(_e):
+        resp = jsonify({'error': 'Server busy, please retry'})
+        resp.status_code = 503
+        resp.headers['Retry-After'] = '1'
+        return resp
+
+    @async_api.errorhandler(Exception)
+    def async_failed(e):
+        if isinstance(e, HTTPException):
+            return e
+        app.logger.exception(f"Async API error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    @async_api.route('/books')
+    async def async_books():
+        return jsonify(await db_executor.run(search_books, *book_filters(request.args)))
+
+    @async_api.route('/books/<int:book_id>')
+    async def async_book(book_id: int):
+        book = await db_executor.run(fetch_book, book_id)
+        if not book:
+            return jsonify({'error': 'Book not found'}), 404
+        return jsonify(book)
+
+    @async_api.route('/games')
+    async def async_games():
+        return jsonify(await db_executor.run(fetch_games))
+
+    @async_api.route('/purchase/history')
+    async def async_purchase_history():
+        if not session.get('user_id'):
+            return jsonify({'error': 'Authentication required'}), 401
+        return jsonify(await db_executor.run(fetch_purchase_history, session.get('user_id')))
+
+    @async_api.route('/cafe/slots')
+    async def async_cafe_slots():
+        if 'user' not in session and 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+        date, duration, early = _slots_request()
+        if early is not None:
+            return early
+        return jsonify(await db_executor.run(_shared_slots, date, duration))
+
+    @async_api.route('/community/messages')
+    async def async_community_messages():
+        try:
+            since_id, before_id, limit = _feed_args()
+        except ValueError:
+            return jsonify({'error': 'since_id, before_id and limit must be integers'}), 400
+        rows, more = await db_executor.run(_community_feed, since_id, before_id, limit)
+        return _feed_response(rows, more, since_id)
+
+    @async_api.route('/cart/quote')
+    async def async_cart_quote():
+        # Current prices for everything in the cart, one lookup per item, all at once
+        items = list((session.get('cart') or {}).get('items', []))
+        details = await db_executor.gather(*(
+            partial(fetch_item_details, it['item_type'], it['item_id'], it['action']) for it in items))
+        quoted = [dict(it, unit_price=d['unit_price'] if d else it['unit_price'], available=d is not None)
+                  for it, d in zip(items, details)]
+        subtotal = sum(q['unit_price'] * q['quantity'] for q in quoted if q['available'])
+        return jsonify({'items': quoted, 'subtotal': round(subtotal, 2),
+                        'total_quantity': sum(q['quantity'] for q in quoted)})
+
+    @async_api.route('/admin/dashboard')
+    async def async_admin_dashboard():
+        if not (session.get('user') or session.get('user_id')):
+            return jsonify({'error': 'Authentication required'}), 401
+        if not _is_admin():
+            return jsonify({'error': 'Admins only'}), 403
+        purchases_part, bookings, stats = await db_executor.gather(
+            _dashboard_purchases, _dashboard_bookings,
+            lambda: analytics.build_dashboard_analytics(app.instance_path))
+        return jsonify(dict(_dashboard_summary(purchases_part, bookings), analytics=stats))
+
+    app.register_blueprint(async_api)
+
+    # After every context processor is registered, before the warm-up compiles templates
+    tracing.instrument_flask(app)
+
+    if os.getenv('STARTUP_WARMUP', '1') == '1':
+        with timer.phase('warm-up'):
+            _warm_up()
+    timer.ready()
     return app
 
 
@@ -0,0 +1,144 @@
+"""
+ASGI entry point (run from A&A/):
+
+    pip install uvicorn a2wsgi
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+Flask itself is WSGI. a2wsgi runs each request on a pool of ASGI_THREADS
+threads; the /api/async views then await their DB calls on the app's own
+bounded executor (aio.DbExecutor). asgiref's WsgiToAsgi is not used here
+because it funnels every request through a single shared thread.
+
+The Server-Sent Events endpoints (/api/cafe/events, /api/community/events)
+do not go through a2wsgi. Their access check runs in a Flask request
+context, so the session cookie is read as usual. The stream itself is then
+written from the event loop (EventBus.astream). Waiting for the next event
+is a suspended coroutine, so idle clients hold no thread. Such a stream
+lasts up to SSE_ASYNC_STREAM_SECONDS before the browser reconnects. A
+request the check turns down goes to the Flask view, which answers 401/403.
+
+Lifespan: at startup the server's SIGTERM/SIGINT handlers are wrapped so
+that a stop request drains first (Lifecycle.drain: /readyz turns 503 and
+open streams end). Otherwise the server would wait for every stream to run
+out before exiting. Shutdown then stops the app's background work.
+gunicorn.conf.py sets recycle_after. After that many requests the process
+sends itself SIGTERM, so a recycled worker drains the same way.
+"""
+import asyncio
+import io
+import os
+import signal
+import threading
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+
+try:
+    from .app import create_app
+except ImportError:
+    from app import create_app
+
+_SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+
+class App:
+    """Event streams on the loop, everything else through a2wsgi to Flask."""
+
+    def __init__(self, flask_app, threads=32):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=threads)
+        self.bus = flask_app.extensions['events']
+        streams = flask_app.extensions['event_streams']
+        self.streams = {rule.rule: streams[rule.endpoint]
+                        for rule in flask_app.url_map.iter_rules() if rule.endpoint in streams}
+        self.lifetime = max(5, int(os.getenv('SSE_ASYNC_STREAM_SECONDS', '300')))
+        self.lifecycle = flask_app.extensions['lifecycle']
+        self.recycle_after = None
+        self.served = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] == 'http':
+            self.served += 1
+            if self.served == self.recycle_after:
+                os.kill(os.getpid(), signal.SIGTERM)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            path, root = scope['path'], scope.get('root_path', '')
+            check = self.streams.get(path[len(root):] if root and path.startswith(root) else path)
+            if check is not None and await self._event_stream(check, scope, receive, send):
+                return
+        await self.wsgi(scope, receive, send)
+
+    async def _event_stream(self, check, scope, receive, send):
+        # The Flask views' own check (it reads the session, not the database)
+        with self.flask_app.request_context(build_environ(scope, io.BytesIO())):
+            params = check()
+            if params is None:
+                return False
+            topic, match, after = params
+        bus = self.bus
+        await send({'type': 'http.response.start', 'status': 200, 'headers': _SSE_HEADERS})
+        if not bus.acquire_stream(asynchronous=True):
+            chunks, _ = bus.preamble(topic, after, match, 10000)
+            await send({'type': 'http.response.body', 'body': ''.join(chunks).encode()})
+            return True
+        try:
+            pump = asyncio.ensure_future(self._pump(bus.astream(topic, after, match, self.lifetime), send))
+            gone = asyncio.ensure_future(_disconnected(receive))
+            await asyncio.wait((pump, gone), return_when=asyncio.FIRST_COMPLETED)
+            for task in (pump, gone):
+                task.cancel()
+            await asyncio.gather(pump, gone, return_exceptions=True)
+        finally:
+            bus.release_stream(asynchronous=True)
+        return True
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._drain_on_stop()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.get_running_loop().run_in_executor(None, self.lifecycle.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _drain_on_stop(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        drain = self.lifecycle.drain
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            stop = signal.getsignal(sig)
+            if not callable(stop):
+                continue
+
+            def handler(signum, frame, stop=stop):
+                # Off the signal handler: closing streams takes the event bus lock
+                threading.Thread(target=drain, name='drain', daemon=True).start()
+                stop(signum, frame)
+
+            signal.signal(sig, handler)
+
+    @staticmethod
+    async def _pump(chunks, send):
+        try:
+            async for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await chunks.aclose()
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+flask_app = create_app()
+app = App(flask_app, threads=int(os.getenv('ASGI_THREADS', '32')))
@@ -1,10 +1,20 @@
-from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, session, jsonify
-import sqlite3, os
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+import sqlite3, os, math
 from pathlib import Path
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from functools import wraps
 
+try:
+    from . import passwords
+except ImportError:
+    import passwords
+
+try:
+    from . import dbconn
+except ImportError:
+    import dbconn
+
 auth_bp = Blueprint('auth', __name__)
 
 def get_db_path():
@@ -14,7 +24,7 @@ def get_db_path():
 
 def get_conn():
     dbp = get_db_path()
-    conn = sqlite3.connect(dbp)
+    conn = dbconn.connect(dbp)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -36,6 +46,32 @@ def init_db(conn=None):
     if close_after:
         conn.close()
 
+def _retry_response(template, status, message, wait):
+    flash(message, 'error')
+    resp = make_response(render_template(template), status)
+    resp.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return resp
+
+def login_throttled(template, account=None):
+    """A 429 page when this IP (or account) is over its attempt budget, else None."""
+    throttle = current_app.extensions.get('login_throttle')
+    wait = throttle.check(passwords.client_ip(request), account) if throttle else 0
+    if not wait:
+        return None
+    return _retry_response(template, 429, f'Too many attempts. Try again in {max(1, math.ceil(wait))} seconds.', wait)
+
+def hashing_busy(template):
+    """The 503 page for when every password-hashing worker and queue slot is taken, or a hash timed out."""
+    return _retry_response(template, 503, 'Sign-in is busy right now. Please try again in a moment.', 2)
+
+def hash_password(password):
+    pool = current_app.extensions.get('password_hasher')
+    return pool.hash(password) if pool else generate_password_hash(password)
+
+def verify_password(pwhash, password):
+    pool = current_app.extensions.get('password_hasher')
+    return pool.check(pwhash, password) if pool else check_password_hash(pwhash, password)
+
 # Replace the blueprint-level decorator with an explicit initializer:
 def init_app(app):
     """
@@ -56,7 +92,13 @@ def signup():
     if not username or not email or not password:
         flash('Username, email and password are required.', 'error')
         return redirect(url_for('signup'))
-    pw_hash = generate_password_hash(password)
+    throttled = login_throttled('signup.html')
+    if throttled:
+        return throttled
+    try:
+        pw_hash = hash_password(password)
+    except passwords.PoolBusy:
+        return hashing_busy('signup.html')
     conn = get_conn(); cur = conn.cursor()
     try:
         cur.execute("INSERT INTO users (username,email,password_hash,created_at) VALUES (?,?,?,?)",
@@ -93,13 +135,20 @@ def login():
     if not ident or not password:
         flash('Please provide username/email and password.', 'error')
         return redirect(url_for('login'))
+    throttled = login_throttled('login.html', ident)
+    if throttled:
+        return throttled
 
     conn = get_conn(); cur = conn.cursor()
     cur.execute("SELECT * FROM users WHERE username = ? OR email = ? LIMIT 1", (ident, ident.lower()))
     row = cur.fetchone()
     conn.close()
 
-    if not row or not check_password_hash(row['password_hash'], password):
+    try:
+        ok = bool(row) and verify_password(row['password_hash'], password)
+    except passwords.PoolBusy:
+        return hashing_busy('login.html')
+    if not ok:
         flash('Invalid credentials.', 'error')
         return redirect(url_for('login'))
 
@@ -0,0 +1,125 @@
+"""
+Content-addressed avatar storage.
+
+Uploads are streamed in chunks through sha256 into a temp file and abandoned
+as soon as they pass the size limit. The result is stored once as
+<instance>/avatars/<hh>/<sha256>.<ext>, so identical images share a file,
+and since a name never changes content it can be cached forever.
+
+avatar_blobs (community.db) counts how many subscribers point at each file.
+A file is deleted when its count drops to zero.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+CHUNK = 64 * 1024
+PREFIX = 'avatars/'
+NAME_RE = re.compile(r'^[0-9a-f]{64}\.(png|jpg|webp)$')
+MIMETYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp'}
+
+
+class AvatarError(ValueError):
+    pass
+
+
+class AvatarTooLarge(AvatarError):
+    pass
+
+
+def sniff(head):
+    """Image type from the first bytes; the client's filename is not trusted."""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def storage_dir(instance_path):
+    return os.path.join(instance_path, 'avatars')
+
+
+def file_path(instance_path, name):
+    return os.path.join(storage_dir(instance_path), name[:2], name)
+
+
+def store(instance_path, stream, max_bytes):
+    """
+    Hash and spool `stream` to disk, giving up past max_bytes. Returns the
+    stored name '<sha256>.<ext>'; an identical existing file is reused.
+    """
+    root = storage_dir(instance_path)
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    fd, tmp = tempfile.mkstemp(dir=root, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise AvatarTooLarge(f'Image is larger than {max_bytes // 1024} KB')
+                if len(head) < 16:
+                    head += chunk[:16]
+                digest.update(chunk)
+                out.write(chunk)
+        ext = sniff(head)
+        if ext is None:
+            raise AvatarError('Only PNG, JPG, JPEG, WEBP allowed')
+        name = f'{digest.hexdigest()}.{ext}'
+        final = file_path(instance_path, name)
+        if os.path.exists(final):
+            os.remove(tmp)
+        else:
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            os.replace(tmp, final)
+        return name
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def incref(conn, name, size=None):
+    conn.execute(
+        """
+        INSERT INTO avatar_blobs(name, size, refcount) VALUES (?, ?, 1)
+        ON CONFLICT(name) DO UPDATE SET refcount = avatar_blobs.refcount + 1
+        """,
+        (name, size)
+    )
+
+
+def decref(conn, name):
+    """Drop one reference; returns True when the file is no longer used."""
+    conn.execute("UPDATE avatar_blobs SET refcount = refcount - 1 WHERE name = ?", (name,))
+    row = conn.execute("SELECT refcount FROM avatar_blobs WHERE name = ?", (name,)).fetchone()
+    if row and row[0] <= 0:
+        conn.execute("DELETE FROM avatar_blobs WHERE name = ?", (name,))
+        return True
+    return False
+
+
+def remove_file(instance_path, name):
+    """Delete an unreferenced file; call under the same write lock as the decref."""
+    try:
+        os.remove(file_path(instance_path, name))
+    except FileNotFoundError:
+        pass
+
+
+def name_from_path(photo_path):
+    """The stored name for an 'avatars/<name>' photo_path, else None (legacy static upload)."""
+    if photo_path and photo_path.startswith(PREFIX):
+        name = photo_path[len(PREFIX):]
+        if NAME_RE.match(name):
+            return name
+    return None
@@ -2,90 +2,23 @@ import os
 import sqlite3
 from flask import Blueprint, request, jsonify, current_app, session
 
-books_bp = Blueprint('books_api', __name__, url_prefix='/api')
+try:
+    from . import dbconn
+except ImportError:
+    import dbconn
 
-def init_books_db():
-    """Initialize books database with sample data"""
-    try:
-        dbp = os.path.join(current_app.instance_path, 'books.db')
-        conn = sqlite3.connect(dbp)
-        cur = conn.cursor()
-        
-        # Create books table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                author TEXT NOT NULL,
-                description TEXT,
-                category TEXT,
-                genre TEXT,
-                buy_price REAL DEFAULT 0,
-                rent_price REAL DEFAULT 0,
-                image TEXT,
-                isbn TEXT,
-                pages INTEGER,
-                publication_year INTEGER
-            )
-        """)
-        
-        # Check if table is empty
-        cur.execute("SELECT COUNT(*) FROM books")
-        if cur.fetchone()[0] == 0:
-            # Seed with sample books
-            sample_books = [
-                # Manga
-                ("One Piece Vol. 1", "Eiichiro Oda", "...", "Manga", "Adventure,Shounen", 9.99, 2.99, "images/books/onepiece.jpg", "978-1421506333", 200, 1999),
-                ("Attack on Titan Vol. 1", "Hajime Isayama",
-                 "Humanity fights for survival against giant titans.",
-                 "Manga", "Action,Drama", 10.99, 3.49, "images/books/aot1.jpeg",
-                 "978-1612620244", 192, 2012),
-                ("Demon Slayer Vol. 1", "Koyoharu Gotouge", "...", "Manga", "Action,Supernatural", 9.99, 2.99, "images/books/DemonSlayerVol1.jpg", "978-1974700523", 192, 2018),
-                
-                # Light Novels
-                ("Sword Art Online Vol. 1", "Reki Kawahara", "Trapped in a virtual MMORPG where death is real.", "Light Novel", "Sci-Fi,Romance", 14.99, 4.99, "images/books/sao.jpeg", "978-0316371247", 240, 2014),
-                ("Re:Zero Vol. 1", "Tappei Nagatsuki", "Subaru discovers he can return from death in another world.", "Light Novel", "Fantasy,Psychological", 14.99, 4.99, "images/books/rezero.jpeg", "978-0316315302", 256, 2016),
-                ("Overlord Vol. 1", "Kugane Maruyama", "A player becomes trapped as his undead character in a game world.", "Light Novel", "Fantasy,Dark", 14.99, 4.99, "images/books/overlord.jpg", "978-0316272247", 272, 2016),
-                
-                # Traditional Novels
-                ("Dune", "Frank Herbert", "Epic sci-fi saga on the desert planet Arrakis.", "Novel", "Science Fiction", 16.99, 5.99, "images/books/Dune.jpeg", "978-0441172719", 688, 1965),
-                ("The Hobbit", "J.R.R. Tolkien", "Bilbo Baggins' unexpected journey to reclaim a treasure.", "Novel", "Fantasy", 14.99, 4.99, "images/books/hobbit.jpeg", "978-0547928227", 300, 1937),
-                ("1984", "George Orwell", "Dystopian masterpiece about surveillance and control.", "Novel", "Dystopian,Classic", 13.99, 4.49, "images/books/1984.jpg", "978-0452284234", 328, 1949),
-                
-                # Technical Books
-                ("Clean Code", "Robert C. Martin", "A handbook of agile software craftsmanship.", "Technical", "Programming", 49.99, 12.99, "images/books/clean.jpeg", "978-0132350884", 464, 2008),
-                ("Design Patterns", "Gang of Four", "Elements of reusable object-oriented software.", "Technical", "Programming", 54.99, 14.99, "images/books/designpatterns.jpg", "978-0201633612", 395, 1994),
-                
-                # Non-Fiction
-                ("Sapiens", "Yuval Noah Harari", "A brief history of humankind and our species' journey.", "Non-Fiction", "History,Science", 18.99, 6.99, "images/books/sapiens.jpeg", "978-0062316097", 443, 2014),
-                ("Atomic Habits", "James Clear", "Tiny changes that create remarkable results.", "Non-Fiction", "Self-Help", 16.99, 5.99, "images/books/atomic_habits.jpeg", "978-0735211292", 320, 2018)
-            ]
-            
-            cur.executemany("""
-                INSERT INTO books (title, author, description, category, genre, buy_price, rent_price, image, isbn, pages, publication_year) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, sample_books)
-            conn.commit()
-            
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Database error: {e}")
-        return False
+try:
+    from .singleflight import normalize_term
+except ImportError:
+    from singleflight import normalize_term
 
-@books_bp.route('/books')
-def get_books():
-    """Get all books with optional filtering"""
+books_bp = Blueprint('books_api', __name__, url_prefix='/api')
+
+def _query_books(category, genre, search):
+    dbp = os.path.join(current_app.instance_path, 'books.db')
+    conn = dbconn.connect(dbp, readonly=True)
+    conn.row_factory = sqlite3.Row
     try:
-        dbp = os.path.join(current_app.instance_path, 'books.db')
-        conn = sqlite3.connect(dbp)
-        conn.row_factory = sqlite3.Row
-        
-        # Get filter parameters
-        category = request.args.get('category')
-        genre = request.args.get('genre')
-        search = request.args.get('search')
-        
         query = "SELECT * FROM books WHERE 1=1"
         params = []
         
@@ -94,21 +27,50 @@ def get_books():
             params.append(category)
             
         if genre:
-            query += " AND genre LIKE ?"
-            params.append(f'%{genre}%')
+            query += " AND lower(genre) LIKE ?"
+            params.append(f'%{genre.lower()}%')
             
         if search:
-            query += " AND (title LIKE ? OR author LIKE ? OR description LIKE ?)"
-            params.extend([f'%{search}%', f'%{search}%', f'%{search}%'])
+            query += " AND (lower(title) LIKE ? OR lower(author) LIKE ? OR lower(description) LIKE ?)"
+            params.extend([f'%{search.lower()}%'] * 3)
             
         query += " ORDER BY title"
         
         cur = conn.cursor()
         cur.execute(query, params)
-        books = [dict(row) for row in cur.fetchall()]
+        return [dict(row) for row in cur.fetchall()]
+    finally:
         conn.close()
-        
-        return jsonify(books)
+
+def book_filters(args):
+    """(category, genre, search) from the query string, normalized so identical searches coalesce."""
+    return (normalize_term(args.get('category')), normalize_term(args.get('genre')),
+            normalize_term(args.get('search')))
+
+def search_books(category, genre, search):
+    flights = current_app.extensions.get('singleflight')
+    if flights is None:
+        return _query_books(category, genre, search)
+    return flights.do(('api_books', category, genre, search),
+                      lambda: _query_books(category, genre, search))
+
+def fetch_book(book_id):
+    dbp = os.path.join(current_app.instance_path, 'books.db')
+    conn = dbconn.connect(dbp, readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM books WHERE id = ?", (book_id,))
+        book = cur.fetchone()
+        return dict(book) if book else None
+    finally:
+        conn.close()
+
+@books_bp.route('/books')
+def get_books():
+    """Get all books with optional filtering"""
+    try:
+        return jsonify(search_books(*book_filters(request.args)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -116,17 +78,9 @@ def get_books():
 def get_book(book_id):
     """Get a specific book by ID"""
     try:
-        dbp = os.path.join(current_app.instance_path, 'books.db')
-        conn = sqlite3.connect(dbp)
-        conn.row_factory = sqlite3.Row
-        
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM books WHERE id = ?", (book_id,))
-        book = cur.fetchone()
-        conn.close()
-        
+        book = fetch_book(book_id)
         if book:
-            return jsonify(dict(book))
+            return jsonify(book)
         else:
             return jsonify({'error': 'Book not found'}), 404
     except Exception as e:
@@ -147,7 +101,7 @@ def purchase_book():
     try:
         # Get book details
         dbp = os.path.join(current_app.instance_path, 'books.db')
-        conn = sqlite3.connect(dbp)
+        conn = dbconn.connect(dbp, readonly=True)
         conn.row_factory = sqlite3.Row
         
         cur = conn.cursor()
@@ -187,7 +141,7 @@ def rent_book():
     
     try:
         dbp = os.path.join(current_app.instance_path, 'books.db')
-        conn = sqlite3.connect(dbp)
+        conn = dbconn.connect(dbp, readonly=True)
         conn.row_factory = sqlite3.Row
         
         cur = conn.cursor()
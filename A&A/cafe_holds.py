@@ -0,0 +1,125 @@
+"""
+Short-lived seat holds for the cafe booking flow.
+
+A hold takes seats in the cafe_occupancy counters exactly like a booking, so
+the slot engine and the booking check both see it, and gives them back when it
+expires, is dropped, or is turned into a booking.
+
+Holds live in cafe_holds so they survive a restart. Each process also keeps a
+min-heap of (expires_at, hold_id) so checking "is anything due?" is a peek at
+the top of the heap. When something is due, one indexed DELETE-style sweep
+releases every expired row, so each hold is released once and the cost per
+hold is O(1) amortized. A periodic sweep also catches holds created by other
+worker processes, whose deadlines are not in this heap.
+"""
+import heapq
+import threading
+import time
+
+try:
+    from . import cafe_occupancy
+except ImportError:
+    import cafe_occupancy
+
+
+def ensure_holds_table(conn):
+    """Create cafe_holds and its indexes (run from migrations; caller commits)."""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cafe_holds (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            start_min INTEGER NOT NULL,
+            end_min INTEGER NOT NULL,
+            seats INTEGER NOT NULL,
+            table_id INTEGER,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_cafe_holds_date ON cafe_holds(date, start_min)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_cafe_holds_expires ON cafe_holds(expires_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_cafe_holds_user ON cafe_holds(user_id)")
+
+
+class ExpiryQueue:
+    """Per-process deadlines of known holds; dropped holds are skipped lazily."""
+
+    def __init__(self, sweep_interval=30.0):
+        self._heap = []
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._last_sweep = 0.0
+        self.sweep_interval = sweep_interval
+
+    def load(self, conn):
+        """Seed the heap from cafe_holds once per process (restart recovery)."""
+        if self._loaded:
+            return
+        rows = conn.execute("SELECT expires_at, id FROM cafe_holds").fetchall()
+        with self._lock:
+            if not self._loaded:
+                for expires_at, hold_id in rows:
+                    self._heap.append((float(expires_at), hold_id))
+                heapq.heapify(self._heap)
+                self._loaded = True
+
+    def push(self, expires_at, hold_id):
+        with self._lock:
+            heapq.heappush(self._heap, (float(expires_at), hold_id))
+
+    def due(self, now=None):
+        """True when a known hold has expired or the periodic sweep is due."""
+        now = time.time() if now is None else now
+        with self._lock:
+            if now - self._last_sweep >= self.sweep_interval:
+                return True
+            return bool(self._heap) and self._heap[0][0] <= now
+
+    def mark_swept(self, now):
+        with self._lock:
+            self._last_sweep = now
+            while self._heap and self._heap[0][0] <= now:
+                heapq.heappop(self._heap)
+
+    def __len__(self):
+        return len(self._heap)
+
+
+def expire(conn, now=None):
+    """
+    Release and delete every hold whose deadline has passed; returns the
+    released (date, start_min, end_min, seats, table_id) rows. Call inside the
+    caller's write transaction.
+    """
+    now = time.time() if now is None else now
+    rows = conn.execute(
+        "SELECT date, start_min, end_min, seats, table_id FROM cafe_holds WHERE expires_at <= ?", (now,)
+    ).fetchall()
+    for date, start, end, seats, _ in rows:
+        cafe_occupancy.release(conn, date, int(start), int(end), int(seats))
+    if rows:
+        conn.execute("DELETE FROM cafe_holds WHERE expires_at <= ?", (now,))
+    return rows
+
+
+def drop(conn, hold_id, user_id=None):
+    """
+    Release one hold (optionally only if it belongs to user_id).
+    Returns its (date, start_min, end_min, seats, table_id), or None if there
+    was none.
+    """
+    query = "SELECT date, start_min, end_min, seats, table_id FROM cafe_holds WHERE id = ?"
+    params = [hold_id]
+    if user_id is not None:
+        query += " AND user_id = ?"
+        params.append(user_id)
+    row = conn.execute(query, params).fetchone()
+    if not row:
+        return None
+    date, start, end, seats, _ = row
+    cafe_occupancy.release(conn, date, int(start), int(end), int(seats))
+    conn.execute("DELETE FROM cafe_holds WHERE id = ?", (hold_id,))
+    return row
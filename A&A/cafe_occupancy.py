@@ -0,0 +1,155 @@
+"""
+Seat occupancy engine for the cafe.
+
+A day's bookings are turned into a step function of seats in use (one sweep
+over start/end events), and each slot window is then answered with a binary
+search into that profile. Computing every slot of a day therefore costs
+O((n + k) log n) for n bookings and k slots instead of one query and n overlap
+checks per slot.
+
+Intervals are half-open minutes-since-midnight: a booking [600, 660) ends
+exactly when one starting at 660 begins, so the two never overlap.
+"""
+import time
+from bisect import bisect_left, bisect_right
+
+
+def build_profile(intervals):
+    """
+    Sweep (start_min, end_min, seats) intervals into (times, levels):
+    levels[i] seats are in use on [times[i], times[i+1]).
+    """
+    deltas = {}
+    for start, end, seats in intervals:
+        if end <= start or seats <= 0:
+            continue
+        deltas[start] = deltas.get(start, 0) + seats
+        deltas[end] = deltas.get(end, 0) - seats
+    times = sorted(deltas)
+    levels = []
+    level = 0
+    for t in times:
+        level += deltas[t]
+        levels.append(level)
+    return times, levels
+
+
+def peak_seats(profile, start, end):
+    """Highest number of seats in use at any minute of [start, end)."""
+    times, levels = profile
+    if end <= start or not times:
+        return 0
+    lo = bisect_right(times, start) - 1  # breakpoint in effect at `start`
+    hi = bisect_left(times, end)
+    window = levels[max(lo, 0):hi]
+    if lo < 0:
+        window = [0] + window
+    return max(window) if window else 0
+
+
+def remaining_for_windows(intervals, windows, capacity):
+    """Remaining seats for each (start_min, duration_min) window, in order."""
+    profile = build_profile(intervals)
+    return [max(0, capacity - peak_seats(profile, s, s + d)) for s, d in windows]
+
+
+# ---------------- Persistent per-bucket counters ----------------
+# cafe_occupancy(date, minute_bucket, seats) holds seats in use per BUCKET_MIN
+# minutes. Bookings are widened to whole buckets both here and in the sweep
+# (see quantize) so reads and the booking check always agree.
+BUCKET_MIN = 15
+
+
+def quantize(start, end, size=BUCKET_MIN):
+    """Widen [start, end) outward to bucket boundaries."""
+    lo = (start // size) * size
+    hi = -(-end // size) * size
+    return lo, hi
+
+
+def ensure_occupancy_table(conn):
+    """Create cafe_occupancy and backfill it the first time (run from migrations; caller commits)."""
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='cafe_occupancy'")
+    if cur.fetchone():
+        return
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cafe_occupancy (
+            date TEXT NOT NULL,
+            minute_bucket INTEGER NOT NULL,
+            seats INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, minute_bucket)
+        ) WITHOUT ROWID
+        """
+    )
+    rebuild_occupancy(conn)
+
+
+def rebuild_occupancy(conn):
+    """Recompute every counter from confirmed bookings and live holds (backfill / repair)."""
+    cur = conn.cursor()
+    cur.execute("DELETE FROM cafe_occupancy")
+    cur.execute("SELECT date, start_min, end_min, party_size FROM cafe_bookings WHERE status='confirmed'")
+    rows = cur.fetchall()
+    # Unexpired holds take seats too (see cafe_holds)
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='cafe_holds'")
+    if cur.fetchone():
+        cur.execute("SELECT date, start_min, end_min, seats FROM cafe_holds WHERE expires_at > ?", (time.time(),))
+        rows += cur.fetchall()
+    totals = {}
+    for date, start, end, p in rows:
+        lo, hi = quantize(int(start or 0), int(end or 0))
+        for b in range(lo, hi, BUCKET_MIN):
+            totals[(date, b)] = totals.get((date, b), 0) + int(p or 0)
+    cur.executemany(
+        "INSERT INTO cafe_occupancy(date, minute_bucket, seats) VALUES (?, ?, ?)",
+        [(date, b, seats) for (date, b), seats in totals.items()]
+    )
+
+
+def reserve(conn, date, start, end, seats, capacity):
+    """
+    Add `seats` to every bucket of [start, end) unless that would push any
+    bucket over `capacity`. Must run inside a BEGIN IMMEDIATE transaction;
+    returns True when the seats were taken.
+    """
+    lo, hi = quantize(start, end)
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT OR IGNORE INTO cafe_occupancy(date, minute_bucket, seats) VALUES (?, ?, 0)",
+        [(date, b) for b in range(lo, hi, BUCKET_MIN)]
+    )
+    # One conditional statement: either every bucket is incremented or none is
+    cur.execute(
+        """
+        UPDATE cafe_occupancy SET seats = seats + :seats
+        WHERE date = :date AND minute_bucket >= :lo AND minute_bucket < :hi
+          AND (SELECT MAX(seats) FROM cafe_occupancy
+               WHERE date = :date AND minute_bucket >= :lo AND minute_bucket < :hi) + :seats <= :cap
+        """,
+        {'seats': seats, 'date': date, 'lo': lo, 'hi': hi, 'cap': capacity}
+    )
+    return cur.rowcount == len(range(lo, hi, BUCKET_MIN))
+
+
+def release(conn, date, start, end, seats):
+    """Give back seats taken by reserve(); call in the same transaction as the status change."""
+    lo, hi = quantize(start, end)
+    conn.execute(
+        """
+        UPDATE cafe_occupancy SET seats = MAX(0, seats - ?)
+        WHERE date = ? AND minute_bucket >= ? AND minute_bucket < ?
+        """,
+        (seats, date, lo, hi)
+    )
+
+
+def peak_reserved(conn, date, start, end):
+    """Highest bucket count inside [start, end) according to the counters."""
+    lo, hi = quantize(start, end)
+    row = conn.execute(
+        "SELECT IFNULL(MAX(seats), 0) FROM cafe_occupancy WHERE date = ? AND minute_bucket >= ? AND minute_bucket < ?",
+        (date, lo, hi)
+    ).fetchone()
+    return int(row[0] or 0)
@@ -0,0 +1,257 @@
+"""
+Table-level seat assignment for the cafe.
+
+The venue layout comes from CAFE_TABLES, e.g. "2:4,4:6,6:2" for four 2-seat,
+six 4-seat and two 6-seat tables (table ids are assigned 1..N in that order).
+When it is empty, the cafe keeps using pooled capacity only.
+
+Each table keeps the bookings and holds of one day as sorted, non-overlapping
+half-open intervals in a pair of plain lists (starts, ends). Because
+intervals on a single table never overlap, "is [s, e) free?" is one binary
+search, so placing a party costs O(T log n) for T tables and n intervals per
+table. Adding or removing an interval shifts the lists, O(n). n is bounded
+by what fits on one table in one opening day (a few dozen at most), where
+list.insert beats any tree, so there is no balanced structure here.
+
+The schedules live in memory between requests (ScheduleCache, one per
+process). A day is built from SQL once, with one sort, and then changed in
+place by the writes: a booking or hold adds its interval, a cancel, a dropped
+hold or an expiry sweep removes it. Every such write also bumps the day's row
+in cafe_table_versions inside the same transaction, so a request checks one
+primary-key row and rebuilds only when another process changed the day. A
+write works on a copy of the tables it touches and installs it after COMMIT,
+so a rollback leaves nothing behind and readers never see a half-applied
+change. Expired holds keep their table until the sweep deletes them, the same
+as their seats in cafe_occupancy.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+def parse_layout(spec):
+    """Parse '2:4,4:6' into [(table_id, seats), ...] sorted by seats, ids starting at 1."""
+    tables = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        size, _, count = part.partition(':')
+        size, count = int(size), int(count or 1)
+        if size < 1 or count < 1:
+            raise ValueError(f'Invalid CAFE_TABLES entry: {part!r}')
+        tables.extend([size] * count)
+    return [(i + 1, size) for i, size in enumerate(sorted(tables))]
+
+
+def ensure_versions_table(conn):
+    """Create cafe_table_versions (run from migrations; caller commits)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cafe_table_versions (
+            date TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def day_version(conn, date):
+    row = conn.execute("SELECT version FROM cafe_table_versions WHERE date = ?", (date,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def _bump_version(conn, date, version):
+    # Inside the writer's transaction, which holds the write lock
+    if version:
+        conn.execute("UPDATE cafe_table_versions SET version = ? WHERE date = ?", (version + 1, date))
+    else:
+        conn.execute("INSERT INTO cafe_table_versions (date, version) VALUES (?, 1)", (date,))
+    return version + 1
+
+
+def day_assignments(conn, date):
+    """(table_id, start_min, end_min) of the day's confirmed bookings and holds."""
+    return conn.execute(
+        "SELECT table_id, start_min, end_min FROM cafe_bookings "
+        "WHERE date = ? AND status = 'confirmed' AND table_id IS NOT NULL "
+        "UNION ALL SELECT table_id, start_min, end_min FROM cafe_holds "
+        "WHERE date = ? AND table_id IS NOT NULL",
+        (date, date)
+    ).fetchall()
+
+
+class TableSchedule:
+    """Bookings on one table for one day."""
+    __slots__ = ('table_id', 'seats', 'starts', 'ends')
+
+    def __init__(self, table_id, seats):
+        self.table_id = table_id
+        self.seats = seats
+        self.starts = []
+        self.ends = []
+
+    def is_free(self, start, end):
+        i = bisect_right(self.starts, start)
+        if i > 0 and self.ends[i - 1] > start:
+            return False
+        return i == len(self.starts) or self.starts[i] >= end
+
+    def add(self, start, end):
+        # O(n) list shift; n is one table's intervals for one day
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+
+    def remove(self, start, end):
+        i = bisect_left(self.starts, start)
+        if i < len(self.starts) and self.starts[i] == start and self.ends[i] == end:
+            del self.starts[i]
+            del self.ends[i]
+
+    def copy(self):
+        other = TableSchedule(self.table_id, self.seats)
+        other.starts = self.starts[:]
+        other.ends = self.ends[:]
+        return other
+
+
+class DayTables:
+    """All tables for one day, grouped by size for best-fit placement."""
+
+    def __init__(self, layout, assignments=()):
+        self.sizes = sorted({seats for _, seats in layout})
+        self.by_size = {size: [] for size in self.sizes}
+        self.by_id = {}
+        self._shared = set()  # tables still shared with the DayTables this was copied from
+        for table_id, seats in layout:
+            sched = TableSchedule(table_id, seats)
+            self.by_size[seats].append(sched)
+            self.by_id[table_id] = sched
+        # One sort, then appends: each table's arrays come out sorted
+        for table_id, start, end in sorted(assignments, key=lambda row: row[1]):
+            sched = self.by_id.get(table_id)
+            if sched is not None:
+                sched.starts.append(int(start))
+                sched.ends.append(int(end))
+
+    def copy(self):
+        """A copy for a writer; a table's arrays are copied when it is first changed."""
+        other = DayTables.__new__(DayTables)
+        other.sizes = self.sizes
+        other.by_size = {size: scheds[:] for size, scheds in self.by_size.items()}
+        other.by_id = dict(self.by_id)
+        other._shared = set(self.by_id)
+        return other
+
+    def _own(self, sched):
+        if sched.table_id not in self._shared:
+            return sched
+        self._shared.discard(sched.table_id)
+        mine = sched.copy()
+        scheds = self.by_size[sched.seats]
+        scheds[scheds.index(sched)] = mine
+        self.by_id[sched.table_id] = mine
+        return mine
+
+    @property
+    def largest(self):
+        return self.sizes[-1] if self.sizes else 0
+
+    def find(self, party_size, start, end):
+        """Smallest free table that seats the party, or None."""
+        for size in self.sizes[bisect_right(self.sizes, party_size - 1):]:
+            for sched in self.by_size[size]:
+                if sched.is_free(start, end):
+                    return sched
+        return None
+
+    def assign(self, party_size, start, end):
+        sched = self.find(party_size, start, end)
+        if sched is None:
+            return None
+        self._own(sched).add(start, end)
+        return sched.table_id
+
+    def release(self, table_id, start, end):
+        sched = self.by_id.get(table_id)
+        if sched is not None:
+            self._own(sched).remove(int(start), int(end))
+
+    def free_by_size(self, start, end):
+        """{seats: number of tables of that size free for the whole window}."""
+        return {
+            size: sum(1 for sched in self.by_size[size] if sched.is_free(start, end))
+            for size in self.sizes
+        }
+
+
+class ScheduleCache:
+    """This process's DayTables by date, checked against cafe_table_versions."""
+
+    def __init__(self, max_days=64):
+        self.max_days = max_days
+        self._days = OrderedDict()  # date -> (version, layout, DayTables)
+        self._lock = threading.Lock()
+
+    def day(self, conn, date, layout):
+        """The day's tables; shared with other requests, so only read them."""
+        return self._current(conn, date, tuple(layout))[1]
+
+    def edit(self, conn, layout):
+        """Changes for the caller's write transaction; publish() them after COMMIT."""
+        return ScheduleEdit(self, conn, tuple(layout))
+
+    def _current(self, conn, date, layout, keep=True):
+        # Version first: rows loaded after it are at least that new
+        version = day_version(conn, date)
+        with self._lock:
+            entry = self._days.get(date)
+            if entry is not None and entry[0] == version and entry[1] == layout:
+                self._days.move_to_end(date)
+                return version, entry[2]
+        day = DayTables(layout, day_assignments(conn, date))
+        if keep:
+            self._store(date, version, layout, day)
+        return version, day
+
+    def _store(self, date, version, layout, day):
+        with self._lock:
+            entry = self._days.get(date)
+            if entry is not None and entry[1] == layout and entry[0] > version:
+                return
+            self._days[date] = (version, layout, day)
+            self._days.move_to_end(date)
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+
+    def __len__(self):
+        return len(self._days)
+
+
+class ScheduleEdit:
+    """Table changes made inside one write transaction (no-ops without a layout)."""
+
+    def __init__(self, cache, conn, layout):
+        self.cache = cache
+        self.conn = conn
+        self.layout = layout
+        self._days = {}  # date -> (version after COMMIT, DayTables copy)
+
+    def day(self, date):
+        """The day's tables for this transaction; changing them bumps the version."""
+        if date not in self._days:
+            # Not kept when rebuilt: the rows may hold this transaction's own writes
+            version, day = self.cache._current(self.conn, date, self.layout, keep=False)
+            self._days[date] = (_bump_version(self.conn, date, version), day.copy())
+        return self._days[date][1]
+
+    def release(self, date, table_id, start, end):
+        if table_id is not None and self.layout:
+            self.day(date).release(table_id, start, end)
+
+    def publish(self):
+        """Install the changed days; call only after COMMIT."""
+        for date, (version, day) in self._days.items():
+            self.cache._store(date, version, self.layout, day)
+        self._days.clear()
@@ -4,6 +4,16 @@ import sqlite3
 from datetime import datetime
 from flask import Blueprint, request, jsonify, session, current_app
 
+try:
+    from . import outbox
+except ImportError:
+    import outbox
+
+try:
+    from . import dbconn
+except ImportError:
+    import dbconn
+
 cart_bp = Blueprint('cart_api', __name__, url_prefix='/api/cart')
 
 def _ensure_cart():
@@ -14,11 +24,11 @@ def _ensure_cart():
 def _item_key(item_type, item_id, action):
     return f"{item_type}-{item_id}-{action}"
 
-def _fetch_item_details(item_type, item_id, action):
+def fetch_item_details(item_type, item_id, action):
     # Returns title and unit_price for given item
     if item_type == 'book':
         dbp = os.path.join(current_app.instance_path, 'books.db')
-        conn = sqlite3.connect(dbp)
+        conn = dbconn.connect(dbp, readonly=True)
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         cur.execute("SELECT id, title, buy_price, rent_price FROM books WHERE id = ?", (item_id,))
@@ -30,7 +40,7 @@ def _fetch_item_details(item_type, item_id, action):
         return {'title': row['title'], 'unit_price': float(unit_price)}
     elif item_type == 'game':
         dbp = os.path.join(current_app.instance_path, 'games.db')
-        conn = sqlite3.connect(dbp)
+        conn = dbconn.connect(dbp, readonly=True)
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         cur.execute("SELECT id, title, buy_price, rent_price FROM games WHERE id = ?", (item_id,))
@@ -53,31 +63,6 @@ def _games_db_path():
     os.makedirs(inst, exist_ok=True)
     return os.path.join(inst, 'games.db')
 
-def _ensure_purchase_history_table(conn):
-    cur = conn.cursor()
-    # Create table if it doesn't exist (base columns)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS purchase_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            purchase_date TEXT NOT NULL,
-            total_amount REAL NOT NULL,
-            buyer_name TEXT,
-            buyer_email TEXT,
-            items_json TEXT NOT NULL
-        )
-        """
-    )
-    conn.commit()
-
-    # Ensure payment_method column exists for compatibility with cart checkout
-    cur.execute("PRAGMA table_info(purchase_history)")
-    existing = {row[1] for row in cur.fetchall()}
-    if 'payment_method' not in existing:
-        cur.execute("ALTER TABLE purchase_history ADD COLUMN payment_method TEXT")
-        conn.commit()
-
 @cart_bp.route('', methods=['GET'])
 def get_cart():
     cart = _ensure_cart()
@@ -109,7 +94,7 @@ def add_to_cart():
     if item_type not in ('book', 'game') or not item_id or action not in ('buy', 'rent') or quantity < 1:
         return jsonify({'error': 'Invalid payload'}), 400
 
-    details = _fetch_item_details(item_type, item_id, action)
+    details = fetch_item_details(item_type, item_id, action)
     if not details:
         return jsonify({'error': 'Item not found'}), 404
 
@@ -188,9 +173,8 @@ def checkout():
     # Persist purchase history into games.db (shared demo history store)
     try:
         dbp = _games_db_path()
-        conn = sqlite3.connect(dbp)
+        conn = dbconn.connect(dbp)
         conn.row_factory = sqlite3.Row
-        _ensure_purchase_history_table(conn)
         cur = conn.cursor()
         cur.execute(
             """
@@ -207,9 +191,20 @@ def checkout():
                 json.dumps(items)
             )
         )
-        conn.commit()
         purchase_id = cur.lastrowid
+        lines = '\n'.join(f"{i['quantity']} x {i['title']} ({i['action']}) @ {i['unit_price']:.2f}" for i in items)
+        # Only to the address this account joined the community with: the buyer
+        # fields come from the request body, so they stay out of the email entirely
+        queued = outbox.enqueue(
+            conn, 'order_receipt',
+            (session.get('community_email') or '').strip().lower(),
+            f'Your receipt for order #{purchase_id}',
+            f"{lines}\n\nTotal: {subtotal:.2f}"
+        )
+        conn.commit()
         conn.close()
+        if queued and 'outbox' in current_app.extensions:
+            current_app.extensions['outbox'].notify()
     except Exception as e:
         current_app.logger.exception(f"Failed to save purchase history: {e}")
         return jsonify({'error': 'Failed to record purchase'}), 500
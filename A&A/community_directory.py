@@ -0,0 +1,90 @@
+"""
+Community members directory: display fields computed on write and keyset pages.
+
+community_subscribers stores email_masked, photo_url and name_key (lower-cased
+display name) next to the raw columns, so listing a page is just a read.
+Pages are keyset ranges over an index, and never use OFFSET: id DESC for the
+full list, (name_key, id) for a display-name prefix search, and the unique
+email index for admin email search. Any page, including the last of 100k
+members, costs the same.
+"""
+
+PAGE_MAX = 100
+# Sorts after every real character, so [p, p + _PREFIX_END) is "starts with p"
+_PREFIX_END = '\U0010ffff'
+
+
+def mask_email(email):
+    """'jane@example.com' -> 'ja**@example.com'."""
+    name, sep, dom = (email or '').partition('@')
+    if not sep:
+        return email or ''
+    return f"{name[:2]}{'*' * max(0, len(name) - 2)}@{dom}"
+
+
+def name_key(display_name):
+    return (display_name or '').strip().lower() or None
+
+
+def photo_url(photo_path, static_url_path='/static'):
+    if not photo_path:
+        return None
+    if photo_path.startswith('avatars/'):
+        # Content-addressed upload, served by the /avatars/<name> route
+        return f"/{photo_path}"
+    return f"{static_url_path}/{photo_path.replace(chr(92), '/')}"
+
+
+def _row(r, admin):
+    return {
+        'id': r['id'],
+        'email': r['email'] if admin else r['email_masked'],
+        'display_name': r['display_name'] or '',
+        'joined_at': r['joined_at'] or '',
+        'photo_url': r['photo_url'],
+    }
+
+
+def list_page(cur, limit, cursor=None, q='', field='name', admin=False):
+    """
+    One page of members as (rows, next_cursor). cursor is the opaque string
+    returned by the previous page; raises ValueError if it is malformed.
+    """
+    limit = min(max(int(limit), 1), PAGE_MAX)
+    cols = "SELECT id, email, email_masked, display_name, joined_at, photo_url, name_key FROM community_subscribers"
+    q = (q or '').strip().lower()
+    if not q:
+        query, params = cols, []
+        if cursor:
+            query += " WHERE id < ?"
+            params.append(int(cursor))
+        cur.execute(query + " ORDER BY id DESC LIMIT ?", params + [limit + 1])
+        rows = cur.fetchall()
+        next_cursor = str(rows[limit - 1]['id']) if len(rows) > limit else None
+        return [_row(r, admin) for r in rows[:limit]], next_cursor
+
+    if field == 'email':
+        # Emails are unique, so the email alone is the keyset position
+        query = cols + " WHERE email >= ? AND email < ?"
+        params = [q, q + _PREFIX_END]
+        if cursor:
+            query += " AND email > ?"
+            params.append(cursor)
+        cur.execute(query + " ORDER BY email LIMIT ?", params + [limit + 1])
+        rows = cur.fetchall()
+        next_cursor = rows[limit - 1]['email'] if len(rows) > limit else None
+        return [_row(r, admin) for r in rows[:limit]], next_cursor
+
+    query = cols + " WHERE name_key >= ? AND name_key < ?"
+    params = [q, q + _PREFIX_END]
+    if cursor:
+        key, _, last_id = cursor.rpartition('|')
+        query += " AND (name_key, id) > (?, ?)"
+        params.extend([key, int(last_id)])
+    cur.execute(query + " ORDER BY name_key, id LIMIT ?", params + [limit + 1])
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last['name_key']}|{last['id']}"
+    return [_row(r, admin) for r in rows[:limit]], next_cursor
@@ -0,0 +1,378 @@
+"""
+Pooled, tuned SQLite connections for every instance database.
+
+connect(path) is a drop-in for sqlite3.connect(path): it returns a
+Checkout, a handle that forwards to a pooled sqlite3.Connection, and its
+close() hands the connection back to a small per-file pool instead of
+closing it. The next request reuses the open file, page cache, mmap and
+statement cache instead of paying for them again. close() also kills the
+handle: a second close() is a no-op and any other use raises
+sqlite3.ProgrammingError, so a stale handle on an error path can never
+reach a connection another thread has since checked out.
+
+Each connection is configured once, when it is opened:
+
+    journal_mode=WAL       readers never block the writer, and vice versa
+    synchronous=NORMAL     fsync at checkpoints, not on every commit (safe with WAL)
+    mmap_size              reads served from the OS page cache without copies
+    cache_size             a larger per-connection page cache
+    busy_timeout           wait for the write lock instead of failing at once
+
+connect(path, readonly=True) opens a `mode=ro` URI for pure read paths, so
+a stray write fails loudly instead of taking the write lock.
+
+A pooled connection is only ever used by one thread at a time. On return it
+is rolled back if a transaction was left open, and row_factory /
+isolation_level are reset to the defaults callers expect from a fresh
+connection. Pools are per process: after a fork the child starts empty.
+
+configure(url) swaps the storage backend: with a postgresql:// URL every
+connect(path) is served by pgbackend (one schema per file name) instead,
+and the call sites don't change.
+
+add_listener(fn) sees every statement run through these connections (and
+the SQLAlchemy engine, via instrument_sqlalchemy): fn(database, sql, started,
+seconds) is called after each execute, with the database's file name. With
+no listeners the only cost is one list check per statement.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+_DEFAULTS = {
+    'DB_MMAP_SIZE': 64 * 1024 * 1024,
+    'DB_CACHE_KIB': 16 * 1024,
+    'DB_BUSY_TIMEOUT_MS': 5000,
+    'DB_POOL_SIZE': 8,
+}
+
+
+def _setting(name):
+    try:
+        return int(os.getenv(name, str(_DEFAULTS[name])))
+    except ValueError:
+        return _DEFAULTS[name]
+
+
+_listeners = []
+
+
+def add_listener(fn):
+    """Call fn(database, sql, started, seconds) after every statement; registering twice is a no-op."""
+    if fn not in _listeners:
+        _listeners.append(fn)
+    return fn
+
+
+def observing():
+    return bool(_listeners)
+
+
+def observe(database, sql, started):
+    """Report one finished statement (started is a time.perf_counter() value) to the listeners."""
+    elapsed = time.perf_counter() - started
+    for fn in _listeners:
+        fn(database, sql, started, elapsed)
+
+
+class ObservedCursor(sqlite3.Cursor):
+    _generation = None  # the checkout this cursor was made in
+
+    def _check(self):
+        if self._generation != self.connection._generation:
+            raise sqlite3.ProgrammingError('Cannot operate on a cursor from a closed checkout.')
+
+    def execute(self, sql, parameters=()):
+        self._check()
+        if not _listeners:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe(self.connection._database, sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._check()
+        if not _listeners:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observe(self.connection._database, sql, started)
+
+    def executescript(self, sql_script):
+        self._check()
+        if not _listeners:
+            return super().executescript(sql_script)
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            observe(self.connection._database, sql_script, started)
+
+
+class PooledConnection(sqlite3.Connection):
+    _pool = None
+    _key = None
+    _idle = False
+    _database = None
+    _generation = 0  # bumped on every return to the pool, retiring that checkout's cursors
+
+    # sqlite3's own Connection.execute* bypass Cursor.execute*, so route them through one
+    def cursor(self, factory=ObservedCursor):
+        cur = super().cursor(factory)
+        cur._generation = self._generation
+        return cur
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def close(self):
+        """Return to the pool (or really close if the pool is full or gone)."""
+        if self._idle:
+            return
+        self._generation += 1
+        pool = self._pool
+        if pool is None or not pool.put(self):
+            super().close()
+
+    def close_for_real(self):
+        self._pool = None
+        super().close()
+
+
+class Checkout:
+    """One checkout of a pooled connection; dead after close()."""
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn):
+        object.__setattr__(self, '_conn', conn)
+
+    def _live(self):
+        conn = self._conn
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return conn
+
+    # The calls every request makes, without a __getattr__ round trip
+    def cursor(self, *args):
+        return self._live().cursor(*args)
+
+    def execute(self, sql, parameters=()):
+        return self._live().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._live().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._live().executescript(sql_script)
+
+    def commit(self):
+        self._live().commit()
+
+    def rollback(self):
+        self._live().rollback()
+
+    @property
+    def in_transaction(self):
+        return self._live().in_transaction
+
+    def __getattr__(self, name):
+        return getattr(self._live(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._live(), name, value)
+
+    def __enter__(self):
+        self._live().__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._live().__exit__(*exc)
+
+    def close(self):
+        conn = self._conn
+        if conn is not None:
+            object.__setattr__(self, '_conn', None)
+            conn.close()
+
+
+class Pool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._pid = os.getpid()
+        self.stats = {'opened': 0, 'reused': 0, 'discarded': 0}
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Connections must not cross a fork; drop the parent's without touching them
+            self._idle = {}
+            self._pid = os.getpid()
+
+    def get(self, path, readonly):
+        key = (os.path.abspath(path), bool(readonly))
+        with self._lock:
+            self._check_fork()
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+                conn._idle = False
+                self.stats['reused'] += 1
+                return conn
+        conn = _open(key[0], key[1])
+        conn._pool, conn._key = self, key
+        with self._lock:
+            self.stats['opened'] += 1
+        return conn
+
+    def put(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            conn.isolation_level = ''
+        except sqlite3.Error:
+            return False
+        with self._lock:
+            self._check_fork()
+            idle = self._idle.setdefault(conn._key, [])
+            if len(idle) >= _setting('DB_POOL_SIZE'):
+                self.stats['discarded'] += 1
+                return False
+            conn._idle = True
+            idle.append(conn)
+            return True
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close_for_real()
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, idle={f"{os.path.basename(p)}{' (ro)' if ro else ''}": len(c)
+                                          for (p, ro), c in self._idle.items()})
+
+
+def apply_pragmas(conn, readonly=False):
+    """The per-connection settings above (WAL is skipped on read-only handles)."""
+    cur = conn.cursor()
+    cur.execute(f"PRAGMA busy_timeout = {_setting('DB_BUSY_TIMEOUT_MS')}")
+    if not readonly:
+        cur.execute("PRAGMA journal_mode = WAL")
+    cur.execute("PRAGMA synchronous = NORMAL")
+    cur.execute(f"PRAGMA mmap_size = {_setting('DB_MMAP_SIZE')}")
+    cur.execute(f"PRAGMA cache_size = -{_setting('DB_CACHE_KIB')}")
+    cur.execute("PRAGMA temp_store = MEMORY")
+    cur.close()
+
+
+def _open(path, readonly):
+    timeout = _setting('DB_BUSY_TIMEOUT_MS') / 1000.0
+    if readonly and os.path.exists(path):
+        conn = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True, timeout=timeout,
+                               factory=PooledConnection, check_same_thread=False, cached_statements=256)
+    else:
+        conn = sqlite3.connect(path, timeout=timeout, factory=PooledConnection,
+                               check_same_thread=False, cached_statements=256)
+        readonly = False
+    conn._database = os.path.basename(path)
+    apply_pragmas(conn, readonly)
+    return conn
+
+
+_pool = Pool()
+_backend = None
+
+
+def configure(url=None):
+    """Select the backend from a DATABASE_URL (unset or sqlite: keeps the instance files)."""
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None
+    if url and re.match(r'^postgres(ql)?(\+\w+)?://', url):
+        try:
+            from .pgbackend import PostgresBackend
+        except ImportError:
+            from pgbackend import PostgresBackend
+        _backend = PostgresBackend(url, os.getenv('DATABASE_READ_URL'))
+    return _backend
+
+
+def backend_name():
+    return 'postgresql' if _backend is not None else 'sqlite'
+
+
+def connect(path, readonly=False):
+    """A pooled connection to `path`; close() returns it to the pool."""
+    if _backend is not None:
+        return _backend.connect(os.path.basename(path), readonly)
+    return Checkout(_pool.get(path, readonly))
+
+
+def exists(path):
+    """Whether the database behind `path` exists (always true for a server backend)."""
+    return _backend is not None or os.path.exists(path)
+
+
+def ensure_databases(paths):
+    """Create what a migration needs before it can connect (schemas on PostgreSQL)."""
+    if _backend is not None:
+        _backend.ensure_schemas([os.path.basename(p) for p in paths])
+
+
+def schema_changed(path):
+    """Drop what the backend cached about the tables of `path` (call after migrating it)."""
+    if _backend is not None:
+        _backend.schema_changed(os.path.basename(path))
+
+
+def metrics():
+    if _backend is not None:
+        return {'backend': 'postgresql', 'pools': _backend.metrics()}
+    return _pool.metrics()
+
+
+def close_all():
+    _pool.close_all()
+    if _backend is not None:
+        _backend.close()
+
+
+def install_sqlalchemy(engine):
+    """Apply the same PRAGMAs to every new DBAPI connection of a SQLAlchemy SQLite engine."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_conn, _record):
+        apply_pragmas(dbapi_conn)
+
+
+def instrument_sqlalchemy(engine, database):
+    """Report the statements of a SQLAlchemy engine to the listeners as `database`."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('query_started', None)
+        if started is not None and _listeners:
+            observe(database, statement, started)
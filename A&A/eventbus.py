@@ -0,0 +1,427 @@
+"""
+Publish/subscribe bus behind the Server-Sent Events endpoints.
+
+Under gunicorn a client's stream and the booking or post that should reach
+it are often served by different worker processes. With an EventLog the
+bus therefore publishes into a shared table (sse_events in events.db, or
+its PostgreSQL schema). Its autoincrement id is the event id, the same in
+every process. Each process follows the table from one background thread:
+it polls every poll_seconds (at once after a local publish) and hands new
+rows to its own subscribers. Writers take the write lock (BEGIN IMMEDIATE,
+an advisory lock on PostgreSQL), so ids become visible in order and a
+follower never skips one. Rows older than the newest `keep` are pruned.
+Without a log the bus stays inside one process (tools, tests).
+
+Each topic keeps a short ring buffer of recent events, so a client that
+reconnects with Last-Event-ID, to this worker or another, is sent what it
+missed instead of refetching everything. When its id is older than what the
+ring still covers, the client gets a single "reset" event and reloads.
+
+Backpressure: every subscriber has a bounded queue. A subscriber that falls
+behind is dropped rather than letting its queue grow; its stream ends and the
+browser reconnects and replays from the ring.
+
+Streams are served two ways:
+
+- astream(): on an event loop (the ASGI entry point, asgi.py). An idle
+  client is one suspended coroutine and one socket, no thread. Capped at
+  max_async_streams per process, mostly as a file-descriptor guard.
+- stream(): a blocking generator for WSGI servers, which hold a thread for
+  as long as the stream is open. These are capped (max_streams), and each
+  one closes after a short lifetime.
+
+Clients over either cap get the replay plus a longer `retry:` hint in a
+response that closes immediately. That is a cheap poll served from memory,
+not a database query.
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+
+try:
+    from . import dbconn
+except ImportError:
+    import dbconn
+
+Event = namedtuple('Event', 'id name data wire')
+
+
+def format_sse(event_id, name, data):
+    return f"id: {event_id}\nevent: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def ensure_events_table(conn):
+    """Create sse_events (run from migrations; caller commits)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sse_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            name TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """
+    )
+
+
+class EventLog:
+    """The sse_events table every worker process publishes to and follows."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, topic, name, data):
+        conn = dbconn.connect(self.path)
+        try:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute(
+                "INSERT INTO sse_events (topic, name, data, created_at) VALUES (?, ?, ?, ?)",
+                (topic, name, json.dumps(data, separators=(',', ':')), time.time())
+            )
+            conn.execute("COMMIT")
+            return cur.lastrowid
+        finally:
+            conn.close()  # rolls back whatever is still open
+
+    def tail(self, limit):
+        """The newest `limit` rows, oldest first."""
+        return self._rows("SELECT id, topic, name, data FROM sse_events ORDER BY id DESC LIMIT ?",
+                          (limit,))[::-1]
+
+    def after(self, last_id, limit):
+        return self._rows("SELECT id, topic, name, data FROM sse_events WHERE id > ? ORDER BY id LIMIT ?",
+                          (last_id, limit))
+
+    def prune(self, up_to):
+        conn = dbconn.connect(self.path)
+        try:
+            conn.execute("DELETE FROM sse_events WHERE id <= ?", (up_to,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _rows(self, sql, params):
+        conn = dbconn.connect(self.path, readonly=True)
+        try:
+            return [(int(i), topic, name, json.loads(data)) for i, topic, name, data in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+
+def _wire(ev, match):
+    # Filtered-out events still advance the client's Last-Event-ID (bare id line)
+    return ev.wire if match is None or match(ev.data) else f"id: {ev.id}\n\n"
+
+
+class Subscription:
+    __slots__ = ('topic', 'queue', 'dropped')
+
+    def __init__(self, topic, maxsize):
+        self.topic = topic
+        self.queue = queue.Queue(maxsize)
+        self.dropped = False
+
+    def put_nowait(self, ev):
+        self.queue.put_nowait(ev)
+
+    def get(self, timeout):
+        """Next event, or None on timeout."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """A subscription read on an event loop; publishers hand events over thread-safely."""
+    __slots__ = ('topic', 'queue', 'dropped', '_loop')
+
+    def __init__(self, topic, maxsize, loop):
+        self.topic = topic
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = False
+        self._loop = loop
+
+    def put_nowait(self, ev):
+        # Runs on the publisher's thread: the size check may lag a few in-flight
+        # hand-overs behind, and _put catches the rest
+        if self.queue.full():
+            raise queue.Full
+        try:
+            self._loop.call_soon_threadsafe(self._put, ev)
+        except RuntimeError:  # the loop is closed
+            raise queue.Full
+
+    def _put(self, ev):
+        try:
+            self.queue.put_nowait(ev)
+        except asyncio.QueueFull:
+            self.dropped = True
+
+    async def get(self, timeout):
+        """Next event, or None on timeout."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class _Topic:
+    __slots__ = ('floor', 'ring', 'subs')
+
+    def __init__(self, history, floor):
+        self.floor = floor  # the ring holds every event of the topic with a larger id
+        self.ring = deque(maxlen=history)
+        self.subs = set()
+
+
+class EventBus:
+    def __init__(self, history=256, queue_size=64, max_streams=32, max_async_streams=1000,
+                 log=None, poll_seconds=0.25, keep=10000):
+        self._lock = threading.Lock()
+        self._topics = {}
+        self._history = history
+        self._queue_size = queue_size
+        self._streams = threading.BoundedSemaphore(max_streams)
+        self._async_streams = threading.BoundedSemaphore(max_async_streams)
+        self.max_streams = max_streams
+        self.max_async_streams = max_async_streams
+        self.log = log
+        self.poll_seconds = poll_seconds
+        self.keep = max(keep, history)
+        self._stats = {'published': 0, 'delivered': 0, 'dropped_subscribers': 0, 'streams_rejected': 0,
+                       'follow_errors': 0}
+        self.closed = False
+        self._position = 0  # newest event id handed to this process's subscribers
+        self._start = 0     # where this process started following; older ids can't be replayed
+        self._pruned = 0
+        self._follow_lock = threading.Lock()
+        self._follower_pid = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def _topic(self, name):
+        t = self._topics.get(name)
+        if t is None:
+            t = self._topics[name] = _Topic(self._history, self._start)
+        return t
+
+    def publish(self, topic, name, data):
+        """Publish an event (to every process when there is a log); returns its id."""
+        if self.log is None:
+            with self._lock:
+                self._stats['published'] += 1
+                self._deliver(self._position + 1, topic, name, data)
+                return self._position
+        self._follow()
+        event_id = self.log.append(topic, name, data)
+        with self._lock:
+            self._stats['published'] += 1
+        self._wake.set()  # the follower hands it to this process's subscribers
+        return event_id
+
+    def _deliver(self, event_id, topic, name, data):
+        # Under self._lock
+        t = self._topic(topic)
+        if len(t.ring) == t.ring.maxlen:
+            t.floor = t.ring[0].id
+        ev = Event(event_id, name, data, format_sse(event_id, name, data))
+        t.ring.append(ev)
+        self._position = event_id
+        for sub in list(t.subs):
+            try:
+                sub.put_nowait(ev)
+                self._stats['delivered'] += 1
+            except queue.Full:
+                # Slow consumer: cut it loose, it will replay from the ring
+                sub.dropped = True
+                t.subs.discard(sub)
+                self._stats['dropped_subscribers'] += 1
+
+    # ---------- following the shared log ----------
+    def _follow(self):
+        """Load the recent events and start the follower thread, once per process."""
+        if self.log is None or self._follower_pid == os.getpid():
+            return
+        with self._follow_lock:
+            if self._follower_pid == os.getpid():
+                return
+            rows = self.log.tail(self._history)
+            with self._lock:
+                # A forked worker starts over from the table, not from the master's copy
+                self._topics = {}
+                self._start = self._position = rows[0][0] - 1 if rows else 0
+                for row in rows:
+                    self._deliver(*row)
+                self._pruned = self._position
+            self._stop.clear()
+            threading.Thread(target=self._follow_loop, name='event-follow', daemon=True).start()
+            self._follower_pid = os.getpid()
+
+    def _follow_loop(self):
+        while not self._stop.is_set():
+            try:
+                while self._poll():
+                    pass
+            except Exception:
+                # Database unreachable for a moment: streams just wait, try again next round
+                with self._lock:
+                    self._stats['follow_errors'] += 1
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def _poll(self, batch=500):
+        """Hand new rows to the subscribers; True when there may be more."""
+        rows = self.log.after(self._position, batch)
+        if rows:
+            with self._lock:
+                for row in rows:
+                    self._deliver(*row)
+        if self._position - self._pruned >= self.keep:
+            self.log.prune(self._position - self.keep)
+            self._pruned = self._position
+        return len(rows) == batch
+
+    def subscribe(self, topic, loop=None):
+        """A Subscription, or an AsyncSubscription read on `loop`."""
+        self._follow()
+        if loop is None:
+            sub = Subscription(topic, self._queue_size)
+        else:
+            sub = AsyncSubscription(topic, self._queue_size, loop)
+        with self._lock:
+            self._topic(topic).subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            t = self._topics.get(sub.topic)
+            if t is not None:
+                t.subs.discard(sub)
+
+    def last_id(self, topic=None):
+        """The newest event id this process has seen (ids are shared by all topics)."""
+        self._follow()
+        with self._lock:
+            return self._position
+
+    def replay(self, topic, after_id):
+        """
+        Events with id > after_id as (events, complete). complete is False when
+        some of them already fell out of the ring, or when after_id is older
+        than anything this process can vouch for (before it started following,
+        or from an in-process bus before a restart).
+        """
+        self._follow()
+        with self._lock:
+            if after_id >= self._position:
+                # Ahead of this process: the rest arrives with the next poll
+                return [], self.log is not None or after_id == self._position
+            t = self._topics.get(topic)
+            floor = t.floor if t else self._start
+            events = [ev for ev in t.ring if ev.id > after_id] if t else []
+            return events, after_id >= floor
+
+    def acquire_stream(self, asynchronous=False):
+        slots = self._async_streams if asynchronous else self._streams
+        if not self.closed and slots.acquire(blocking=False):
+            return True
+        with self._lock:
+            self._stats['streams_rejected'] += 1
+        return False
+
+    def release_stream(self, asynchronous=False):
+        (self._async_streams if asynchronous else self._streams).release()
+
+    def preamble(self, topic, after, match=None, retry_ms=1000):
+        """
+        The opening chunks of a stream and the last id they cover. after < 0
+        is a first connect: the page just loaded current state, start from here.
+        """
+        if after < 0:
+            last = self.last_id(topic)
+            return [f"retry: {retry_ms}\n\n", format_sse(last, 'ready', {'last_id': last})], last
+        events, complete = self.replay(topic, after)
+        if not complete:
+            last = self.last_id(topic)
+            return [f"retry: {retry_ms}\n\n", format_sse(last, 'reset', {'last_id': last})], last
+        chunks = [f"retry: {retry_ms}\n\n"] + [_wire(ev, match) for ev in events]
+        return chunks, (events[-1].id if events else after)
+
+    def stream(self, topic, after=-1, match=None, lifetime=30.0, keepalive=15.0):
+        """SSE chunks for one client; blocks the iterating thread between events."""
+        sub = self.subscribe(topic)
+        try:
+            # Subscribed before replaying, so nothing published in between is lost
+            chunks, seen = self.preamble(topic, after, match)
+            yield ''.join(chunks)
+            deadline = time.monotonic() + lifetime
+            while True:
+                left = deadline - time.monotonic()
+                if left <= 0 or (sub.dropped and sub.queue.empty()):
+                    return
+                ev = sub.get(min(keepalive, left))
+                if ev is None:
+                    yield ": keepalive\n\n"
+                    continue
+                if ev.id <= seen:
+                    continue
+                seen = ev.id
+                yield _wire(ev, match)
+        finally:
+            self.unsubscribe(sub)
+
+    async def astream(self, topic, after=-1, match=None, lifetime=300.0, keepalive=15.0):
+        """stream() for an event loop: waiting for the next event holds no thread."""
+        sub = self.subscribe(topic, asyncio.get_running_loop())
+        try:
+            chunks, seen = self.preamble(topic, after, match)
+            yield ''.join(chunks)
+            deadline = time.monotonic() + lifetime
+            while True:
+                left = deadline - time.monotonic()
+                if left <= 0 or (sub.dropped and sub.queue.empty()):
+                    return
+                ev = await sub.get(min(keepalive, left))
+                if ev is None:
+                    yield ": keepalive\n\n"
+                    continue
+                if ev.id <= seen:
+                    continue
+                seen = ev.id
+                yield _wire(ev, match)
+        finally:
+            self.unsubscribe(sub)
+
+    def close(self):
+        """
+        End every open stream (the process is shutting down): subscribers are
+        dropped and woken, and new streams get the over-the-cap replay response.
+        """
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            self.closed = True
+            subs = [sub for t in self._topics.values() for sub in t.subs]
+            for t in self._topics.values():
+                t.subs.clear()
+        for sub in subs:
+            sub.dropped = True
+            try:
+                sub.put_nowait(None)  # wakes the stream's get(); it then sees dropped + empty
+            except queue.Full:
+                pass
+
+    def metrics(self):
+        with self._lock:
+            topics = {name: {'last_id': t.ring[-1].id if t.ring else t.floor, 'subscribers': len(t.subs),
+                             'buffered': len(t.ring)}
+                      for name, t in self._topics.items()}
+            return dict(self._stats, topics=topics, last_id=self._position, shared=self.log is not None,
+                        max_streams=self.max_streams, max_async_streams=self.max_async_streams)
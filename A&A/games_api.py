@@ -3,6 +3,11 @@ from flask import Blueprint, current_app, jsonify, request, session
 from pathlib import Path
 from datetime import datetime
 
+try:
+    from . import dbconn
+except ImportError:
+    import dbconn
+
 games_bp = Blueprint('games_api', __name__)
 
 def get_db_path():
@@ -10,54 +15,6 @@ def get_db_path():
     Path(inst).mkdir(parents=True, exist_ok=True)
     return os.path.join(inst, 'games.db')
 
-def init_purchase_history_db(conn):
-    """
-    Ensure purchase_history table exists and contains all expected columns.
-    Adds missing columns via ALTER TABLE to avoid runtime insert failures.
-    """
-    cur = conn.cursor()
-    # Create table if it doesn't exist (without assuming all columns are present)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS purchase_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            purchase_date TEXT NOT NULL,
-            total_amount REAL NOT NULL,
-            buyer_name TEXT,
-            buyer_email TEXT,
-            items_json TEXT NOT NULL
-        )
-        """
-    )
-    conn.commit()
-
-    # Introspect existing columns
-    cur.execute("PRAGMA table_info(purchase_history)")
-    cols = {row[1] for row in cur.fetchall()}
-
-    # Add missing columns as needed
-    if 'payment_method' not in cols:
-        cur.execute("ALTER TABLE purchase_history ADD COLUMN payment_method TEXT")
-        conn.commit()
-
-def init_db(conn):
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS games (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            category TEXT,
-            buy_price REAL DEFAULT 0,
-            rent_price REAL DEFAULT 0,
-            image TEXT
-        )
-    """)
-    conn.commit()
-    # Also initialize purchase history table
-    init_purchase_history_db(conn)
-
 def row_to_game(r):
     return {
         "id": r["id"],
@@ -69,17 +26,51 @@ def row_to_game(r):
         "image": r["image"]
     }
 
-@games_bp.route('/api/games', methods=['GET'])
-def list_games():
+def fetch_games():
     dbp = get_db_path()
-    conn = sqlite3.connect(dbp)
+    conn = dbconn.connect(dbp, readonly=True)
     conn.row_factory = sqlite3.Row
-    init_db(conn)
     cur = conn.cursor()
     cur.execute("SELECT * FROM games ORDER BY id")
     rows = cur.fetchall()
     conn.close()
-    return jsonify([row_to_game(r) for r in rows])
+    return [row_to_game(r) for r in rows]
+
+def fetch_purchase_history(user_id):
+    dbp = get_db_path()
+    conn = dbconn.connect(dbp, readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """SELECT * FROM purchase_history 
+               WHERE user_id = ? 
+               ORDER BY purchase_date DESC""",
+            (user_id,)
+        )
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    history = []
+    for row in rows:
+        items = json.loads(row['items_json'])
+        history.append({
+            "id": row['id'],
+            "date": row['purchase_date'],
+            "total": row['total_amount'],
+            "paymentMethod": row['payment_method'] if 'payment_method' in row.keys() else None,
+            "buyer": {
+                "name": row['buyer_name'],
+                "email": row['buyer_email']
+            },
+            "items": items
+        })
+    return history
+
+@games_bp.route('/api/games', methods=['GET'])
+def list_games():
+    return jsonify(fetch_games())
 
 @games_bp.route('/admin/seed_games', methods=['POST'])
 def seed_games():
@@ -97,9 +88,8 @@ def seed_games():
         ("God of War (2018)", "A mythic reimagining: father, son, and monsters.", "Action,Adventure", 29.99, 6.99, "images/games/god.jpeg")
     ]
     dbp = get_db_path()
-    conn = sqlite3.connect(dbp)
+    conn = dbconn.connect(dbp)
     conn.row_factory = sqlite3.Row
-    init_db(conn)
     cur = conn.cursor()
     cur.executemany("INSERT INTO games (title, description, category, buy_price, rent_price, image) VALUES (?,?,?,?,?,?)", sample)
     conn.commit()
@@ -126,12 +116,9 @@ def save_purchase():
         items_json = json.dumps(data.get('items', []))
         
         dbp = get_db_path()
-        conn = sqlite3.connect(dbp)
+        conn = dbconn.connect(dbp)
         conn.row_factory = sqlite3.Row
         
-        # Ensure both tables exist
-        init_db(conn)
-        
         cur = conn.cursor()
         cur.execute(
             """INSERT INTO purchase_history 
@@ -156,41 +143,7 @@ def get_purchase_history():
         return jsonify({"error": "Authentication required"}), 401
     
     try:
-        user_id = session.get('user_id')
-        dbp = get_db_path()
-        conn = sqlite3.connect(dbp)
-        conn.row_factory = sqlite3.Row
-        
-        # Ensure both tables exist
-        init_db(conn)
-        
-        cur = conn.cursor()
-        cur.execute(
-            """SELECT * FROM purchase_history 
-               WHERE user_id = ? 
-               ORDER BY purchase_date DESC""",
-            (user_id,)
-        )
-        rows = cur.fetchall()
-        
-        history = []
-        for row in rows:
-            items = json.loads(row['items_json'])
-            history.append({
-                "id": row['id'],
-                "date": row['purchase_date'],
-                "total": row['total_amount'],
-                "paymentMethod": row['payment_method'] if 'payment_method' in row.keys() else None,
-                "buyer": {
-                    "name": row['buyer_name'],
-                    "email": row['buyer_email']
-                },
-                "items": items
-            })
-        
-        conn.close()
-        return jsonify(history)
-        
+        return jsonify(fetch_purchase_history(session.get('user_id')))
     except Exception as e:
         current_app.logger.error(f"Get history error: {str(e)}")
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+gunicorn settings for production (run from A&A/):
+
+    gunicorn -c gunicorn.conf.py asgi:app
+
+A pre-fork server: WEB_CONCURRENCY worker processes (default: one per CPU),
+each running uvicorn's event loop. Flask requests run on GUNICORN_THREADS
+threads per worker (asgi.py hands them to a2wsgi). The Server-Sent Events
+streams stay on the loop and hold no thread, so any number of open
+cafe/community tabs can't starve pages, the APIs or /readyz. The app is loaded once
+in the master (preload_app) and the workers fork from it. dbconn,
+pgbackend, the outbox and the hash/async pools already notice the fork and
+build their own connections and threads. The SQLAlchemy engine for
+users.db is reset below.
+
+Stopping: a worker that gets SIGTERM (deploy, scale down, HUP reload)
+drains first (asgi.py). /readyz answers 503 and SSE streams end, then
+in-flight requests get up to GUNICORN_GRACEFUL_TIMEOUT seconds before the
+background work is shut down. Workers are also recycled after about
+GUNICORN_MAX_REQUESTS requests (plus jitter, so they don't all restart at
+once), which bounds slow memory growth. A recycled worker stops the same
+way.
+
+Metrics: each worker writes its /admin/metrics series to METRICS_DIR (by
+default a fresh directory per server run, removed when the master exits),
+and a scrape of any worker reports the sum over all of them (metrics.py).
+
+wsgi.py still serves the app on WSGI servers (gthread, the dev server).
+There every open stream holds a thread, so keep SSE_MAX_STREAMS below the
+thread count.
+"""
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', str(os.cpu_count() or 1)))
+worker_class = 'uvicorn_worker.UvicornWorker'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+os.environ.setdefault('ASGI_THREADS', str(threads))  # read by asgi.py when the master loads it
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '20'))
+keepalive = 5
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+if os.path.isdir('/dev/shm'):
+    # Heartbeat file on tmpfs: a slow disk must not make workers look hung
+    worker_tmp_dir = '/dev/shm'
+# Shared by this server's workers (metrics.py); create_app reads it
+_metrics_dir = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                            f'aa-metrics-{os.getpid()}')
+os.environ.setdefault('METRICS_DIR', _metrics_dir)
+
+
+def when_ready(server):
+    # Connections the master opened while loading the app are never used again
+    from models import db
+    import dbconn
+    with server.app.wsgi().flask_app.app_context():
+        db.engine.dispose()
+    dbconn.close_all()
+
+
+def post_worker_init(worker):
+    from models import db
+    app = worker.wsgi
+    with app.flask_app.app_context():
+        # The engine's pool may hold the master's sockets; drop them without closing
+        db.engine.dispose(close=False)
+
+    # Recycle through asgi.py (SIGTERM to itself, so it drains) rather than
+    # uvicorn's own limit, which would wait for every open stream to run out
+    app.recycle_after = worker.config.limit_max_requests
+    worker.config.limit_max_requests = None
+
+    # uvicorn re-raises the stop signal once it has shut down. Exit normally then,
+    # so worker_exit and the multiprocessing finalizers still run
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+
+    # Spawn the password hash processes in the background, so the worker's first
+    # sign-in doesn't wait for them (they can't be started before the fork)
+    threading.Thread(target=app.flask_app.extensions['password_hasher'].warm, name='hash-warm', daemon=True).start()
+
+
+def worker_exit(server, worker):
+    app = getattr(worker, 'wsgi', None)
+    if app is not None:
+        app.flask_app.extensions['lifecycle'].shutdown()
+
+
+def on_exit(server):
+    # Only the directory made above, not one set in the environment
+    if os.environ.get('METRICS_DIR') == _metrics_dir:
+        shutil.rmtree(_metrics_dir, ignore_errors=True)
@@ -0,0 +1,55 @@
+"""
+Process lifecycle for production serving (see gunicorn.conf.py and asgi.py).
+
+drain() runs when a worker is asked to stop (SIGTERM on deploys, scale-down
+and max_requests recycling). /readyz starts answering 503 so the load
+balancer stops sending traffic, and open SSE streams end at once instead
+of holding the worker for up to SSE_STREAM_SECONDS. Browsers reconnect
+with Last-Event-ID to another worker, which follows the same event log
+(see eventbus) and replays what they missed.
+
+shutdown() runs once the worker has finished its in-flight requests and
+stops what create_app() started in the background: outbox delivery
+threads, the password hash processes, the async views' loop and executor,
+and pooled database connections. Each step is independent; one failing
+doesn't skip the rest. Both run at most once.
+"""
+import threading
+
+
+class Lifecycle:
+    def __init__(self, logger=None):
+        self.draining = threading.Event()
+        self._on_drain = []
+        self._on_shutdown = []
+        self._logger = logger
+        self._shut_down = False
+
+    def on_drain(self, fn):
+        self._on_drain.append(fn)
+        return fn
+
+    def on_shutdown(self, fn):
+        self._on_shutdown.append(fn)
+        return fn
+
+    def _run_all(self, fns, phase):
+        for fn in fns:
+            try:
+                fn()
+            except Exception as e:
+                if self._logger is not None:
+                    self._logger.warning(f"{phase} step {getattr(fn, '__qualname__', fn)} failed: {e}")
+
+    def drain(self):
+        if self.draining.is_set():
+            return
+        self.draining.set()
+        self._run_all(self._on_drain, 'drain')
+
+    def shutdown(self):
+        self.drain()
+        if self._shut_down:
+            return
+        self._shut_down = True
+        self._run_all(self._on_shutdown, 'shutdown')
@@ -0,0 +1,203 @@
+"""
+Memory instrumentation with tracemalloc (the /admin/memory* endpoints).
+
+Tracing is off by default: it slows every allocation down. An admin
+starts it (POST /admin/memory/start), takes snapshots as traffic flows
+and compares them. A snapshot's top allocation sites, or the diff
+between two snapshots, are grouped by line, file or traceback. That
+answers "what grew between 10:00 and 11:00".
+Only the newest MEMORY_SNAPSHOTS snapshots are kept, in memory.
+
+Per-request peaks answer "which route allocates the most". A sampled
+request (MEMORY_SAMPLE_RATE, or an admin's `?memory=1` /
+`X-Memory: 1`) resets tracemalloc's peak before it runs and reads it
+afterwards. The results are aggregated per endpoint: count, average and
+max peak, and what was still allocated when the response was ready
+(including the response body). If tracing is off, it is turned on just
+for that request, unless an admin starts tracing meanwhile: tracing that
+was asked for is only stopped by POST /admin/memory/stop. Only one request is measured at a time, but allocations
+made by other threads meanwhile still count. Treat a single number as an
+upper bound and look at the max/avg over many.
+"""
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+GROUPINGS = ('lineno', 'filename', 'traceback')
+
+_IGNORE = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def rss_bytes():
+    """Resident set size of this process (Linux /proc), or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _stat_dict(stat, group):
+    frame = stat.traceback[0]
+    out = {
+        'file': frame.filename,
+        'size_kib': round(stat.size / 1024, 1),
+        'count': stat.count,
+    }
+    if group != 'filename':
+        out['line'] = frame.lineno
+    if group == 'traceback':
+        out['traceback'] = [f"{f.filename}:{f.lineno}" for f in stat.traceback]
+    if hasattr(stat, 'size_diff'):
+        out['size_diff_kib'] = round(stat.size_diff / 1024, 1)
+        out['count_diff'] = stat.count_diff
+    return out
+
+
+class MemoryTracer:
+    def __init__(self, sample_rate=0.0, keep=5, frames=1):
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.keep = max(1, keep)
+        self.frames = max(1, frames)
+        self._snapshots = OrderedDict()  # id -> (taken_at, Snapshot)
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._measuring = threading.Lock()
+        self._explicit = False  # started by start(), not just for one measured request
+        self._routes = {}  # endpoint -> {'count', 'peak_sum', 'peak_max', 'retained_sum'}
+
+    @classmethod
+    def from_env(cls):
+        tracer = cls(
+            sample_rate=float(os.getenv('MEMORY_SAMPLE_RATE', '0')),
+            keep=int(os.getenv('MEMORY_SNAPSHOTS', '5')),
+            frames=int(os.getenv('MEMORY_TRACE_FRAMES', '1')),
+        )
+        if tracer.sample_rate:
+            # Sampling compares peaks across many requests; keep tracing on for that
+            tracer.start()
+        return tracer
+
+    # ---- tracing and snapshots ----
+    def start(self, frames=None):
+        with self._lock:
+            self._explicit = True
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames or self.frames)
+
+    def stop(self):
+        """Stop tracing and drop the snapshots (they can't be compared with later ones)."""
+        with self._lock:
+            self._explicit = False
+            tracemalloc.stop()
+            self._snapshots.clear()
+
+    def snapshot(self):
+        """Take and keep a snapshot; returns its id (None while tracing is off)."""
+        if not tracemalloc.is_tracing():
+            return None
+        snap = tracemalloc.take_snapshot().filter_traces(_IGNORE)
+        with self._lock:
+            snap_id = self._next_id
+            self._next_id += 1
+            self._snapshots[snap_id] = (time.time(), snap)
+            while len(self._snapshots) > self.keep:
+                self._snapshots.popitem(last=False)
+        return snap_id
+
+    def _get(self, snap_id):
+        with self._lock:
+            entry = self._snapshots.get(snap_id)
+        return entry[1] if entry else None
+
+    def top(self, snap_id, group='lineno', limit=25):
+        snap = self._get(snap_id)
+        if snap is None:
+            return None
+        stats = snap.statistics(group)
+        return {
+            'id': snap_id,
+            'group': group,
+            'total_kib': round(sum(s.size for s in stats) / 1024, 1),
+            'top': [_stat_dict(s, group) for s in stats[:limit]],
+        }
+
+    def diff(self, old_id, new_id, group='lineno', limit=25):
+        old, new = self._get(old_id), self._get(new_id)
+        if old is None or new is None:
+            return None
+        stats = new.compare_to(old, group)
+        return {
+            'from': old_id,
+            'to': new_id,
+            'group': group,
+            'size_diff_kib': round(sum(s.size_diff for s in stats) / 1024, 1),
+            'top': [_stat_dict(s, group) for s in stats[:limit]],
+        }
+
+    # ---- per-request peaks ----
+    def wanted(self, requested):
+        return requested or bool(self.sample_rate and random.random() < self.sample_rate)
+
+    def begin_request(self):
+        """Start measuring one request; None when another one is being measured."""
+        if not self._measuring.acquire(blocking=False):
+            return None
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(self.frames)
+        tracemalloc.reset_peak()
+        return (tracemalloc.get_traced_memory()[0], started_tracing)
+
+    def end_request(self, token, endpoint):
+        """Finish a measurement; returns (peak, retained) in bytes above the starting point."""
+        base, started_tracing = token
+        try:
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                with self._lock:
+                    # Leave it on if an admin started tracing while this request ran
+                    if not self._explicit:
+                        tracemalloc.stop()
+        finally:
+            self._measuring.release()
+        peak, retained = max(0, peak - base), current - base
+        with self._lock:
+            st = self._routes.setdefault(endpoint or 'unmatched',
+                                         {'count': 0, 'peak_sum': 0, 'peak_max': 0, 'retained_sum': 0})
+            st['count'] += 1
+            st['peak_sum'] += peak
+            st['peak_max'] = max(st['peak_max'], peak)
+            st['retained_sum'] += retained
+        return peak, retained
+
+    def status(self):
+        current, peak = tracemalloc.get_traced_memory()
+        rss = rss_bytes()
+        with self._lock:
+            snapshots = [{'id': i, 'taken_at': t} for i, (t, _) in self._snapshots.items()]
+            routes = sorted(
+                ({'endpoint': e, 'count': st['count'],
+                  'avg_peak_kib': round(st['peak_sum'] / st['count'] / 1024, 1),
+                  'max_peak_kib': round(st['peak_max'] / 1024, 1),
+                  'avg_retained_kib': round(st['retained_sum'] / st['count'] / 1024, 1)}
+                 for e, st in self._routes.items()),
+                key=lambda r: -r['max_peak_kib'])
+        return {
+            'tracing': tracemalloc.is_tracing(),
+            'traced_kib': round(current / 1024, 1),
+            'traced_peak_kib': round(peak / 1024, 1),
+            'tracemalloc_overhead_kib': round(tracemalloc.get_tracemalloc_memory() / 1024, 1),
+            'rss_kib': round(rss / 1024, 1) if rss is not None else None,
+            'sample_rate': self.sample_rate,
+            'snapshots': snapshots,
+            'requests': routes,
+        }
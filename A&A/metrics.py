@@ -0,0 +1,371 @@
+"""
+Request and SQL metrics in Prometheus text format (GET /admin/metrics).
+
+Per endpoint (the Flask endpoint name, so /api/books/<id> is one series):
+
+    http_requests_total{endpoint, method, status}
+    http_request_duration_seconds       histogram {endpoint, method}
+    http_response_size_bytes            histogram {endpoint} (streamed responses are skipped)
+    http_request_sql_statements         histogram {endpoint}: statements per request
+    http_request_sql_seconds            histogram {endpoint}: time in execute per request
+
+and per database, for every statement the process runs (requests,
+outbox workers, migrations):
+
+    db_statements_total{database}, db_statement_seconds_total{database}
+
+SQL is observed through dbconn's listener hook: the pooled SQLite and
+PostgreSQL connections and the users.db SQLAlchemy engine report each
+execute. A request's statements are attributed through a contextvar, so
+calls the async views run on the executor threads are counted as well.
+The time is execute() only. Fetching rows afterwards is not included.
+
+Recording a request is a few dict lookups and bisects under one lock.
+Rendering the text only happens when /admin/metrics is scraped.
+
+Under a pre-fork server each worker counts for itself, so on its own a
+scrape would only see the worker that served it. With METRICS_DIR set
+(gunicorn.conf.py sets one per server run), every process writes a snapshot
+of its series to <pid>-<start>.json there every METRICS_FLUSH_SECONDS and
+when it shuts down, in the manner of prometheus_client's multiprocess mode. A
+scrape sums the files of all workers. Files of workers that have exited are
+folded into archive.json, so counters keep growing across worker recycling.
+Other workers' series can lag by up to one flush interval.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+try:
+    import fcntl
+except ImportError:  # Windows: no pre-fork servers there, METRICS_DIR is not used
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SQL_SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Statement timings of the request being served (a list, appended to from any thread)
+_request_sql = ContextVar('request_sql', default=None)
+
+_sql_lock = threading.Lock()
+_sql_totals = {}  # database -> [statements, seconds]
+
+ARCHIVE = 'archive.json'
+
+
+def _reset_sql():
+    # A forked worker starts from zero; what the master ran before the fork isn't its work
+    global _sql_lock, _sql_totals
+    _sql_lock = threading.Lock()
+    _sql_totals = {}
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_sql)
+
+
+def record_sql(database, sql, started, seconds):
+    """dbconn listener."""
+    timings = _request_sql.get()
+    if timings is not None:
+        timings.append(seconds)
+    with _sql_lock:
+        total = _sql_totals.get(database)
+        if total is None:
+            total = _sql_totals[database] = [0, 0.0]
+        total[0] += 1
+        total[1] += seconds
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+def _labels(**kv):
+    return ','.join(f'{k}="{_escape(v)}"' for k, v in kv.items())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _bound(b):
+    return repr(float(b)) if isinstance(b, float) else str(b)
+
+
+# (attribute, metric, help, label names, buckets)
+HISTOGRAMS = (
+    ('_latency', 'http_request_duration_seconds', 'Request latency.', ('endpoint', 'method'), LATENCY_BUCKETS),
+    ('_size', 'http_response_size_bytes', 'Response body size (non-streamed).', ('endpoint',), SIZE_BUCKETS),
+    ('_sql_count', 'http_request_sql_statements', 'SQL statements executed per request.', ('endpoint',),
+     SQL_COUNT_BUCKETS),
+    ('_sql_time', 'http_request_sql_seconds', 'Time spent executing SQL per request.', ('endpoint',),
+     SQL_SECONDS_BUCKETS),
+)
+
+
+class RequestMetrics:
+    def __init__(self, directory=None, flush_seconds=2.0):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._requests = {}   # (endpoint, method, status) -> count
+        self._latency = {}    # (endpoint, method) -> Histogram
+        self._size = {}       # (endpoint,) -> Histogram
+        self._sql_count = {}  # (endpoint,) -> Histogram
+        self._sql_time = {}   # (endpoint,) -> Histogram
+        self.started = time.time()
+        self._stop = threading.Event()
+        self._flusher_pid = None
+        self._written = None
+
+    def start(self):
+        """Begin a request: returns the token finish() needs."""
+        timings = []
+        return time.perf_counter(), timings, _request_sql.set(timings)
+
+    def finish(self, token, endpoint, method, status, size):
+        started, timings, var_token = token
+        elapsed = time.perf_counter() - started
+        try:
+            _request_sql.reset(var_token)
+        except (ValueError, RuntimeError):
+            _request_sql.set(None)  # finished in a different context, or already finished
+        statements, sql_seconds = len(timings), sum(timings)
+        endpoint = endpoint or 'unmatched'
+        if self.directory and self._flusher_pid != os.getpid():
+            self._start_flusher()
+        with self._lock:
+            key = (endpoint, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            hist = self._latency.get((endpoint, method))
+            if hist is None:
+                hist = self._latency[(endpoint, method)] = Histogram(LATENCY_BUCKETS)
+            hist.observe(elapsed)
+            if size is not None:
+                hist = self._size.get((endpoint,))
+                if hist is None:
+                    hist = self._size[(endpoint,)] = Histogram(SIZE_BUCKETS)
+                hist.observe(size)
+            hist = self._sql_count.get((endpoint,))
+            if hist is None:
+                hist = self._sql_count[(endpoint,)] = Histogram(SQL_COUNT_BUCKETS)
+                self._sql_time[(endpoint,)] = Histogram(SQL_SECONDS_BUCKETS)
+            hist.observe(statements)
+            self._sql_time[(endpoint,)].observe(sql_seconds)
+
+    # ---------- worker files (METRICS_DIR) ----------
+    def snapshot(self):
+        """This process's series as plain data (what its file in METRICS_DIR holds)."""
+        with self._lock:
+            out = {'requests': [[list(key), n] for key, n in self._requests.items()]}
+            for attr, name, _, _, _ in HISTOGRAMS:
+                out[name] = [[list(key), hist.counts[:], hist.sum] for key, hist in getattr(self, attr).items()]
+        with _sql_lock:
+            out['sql'] = [[db, n, seconds] for db, (n, seconds) in _sql_totals.items()]
+        return out
+
+    def flush(self):
+        if not self.directory:
+            return
+        snap = self.snapshot()
+        if snap != self._written:
+            _write_json(os.path.join(self.directory, f'{os.getpid()}-{int(self.started * 1000)}.json'), snap)
+            self._written = snap
+
+    def close(self):
+        """Final flush when the worker stops (a lifecycle shutdown step)."""
+        self._stop.set()
+        self.flush()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except OSError:
+                pass  # the next round tries again
+
+    def _collect(self):
+        # Snapshots of the live workers plus the archive; exited workers are folded in first
+        snaps, dead = [], []
+        archive_path = os.path.join(self.directory, ARCHIVE)
+        with _locked(os.path.join(self.directory, '.lock')):
+            archive = _read_json(archive_path) or {}
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json') or name == ARCHIVE:
+                    continue
+                path = os.path.join(self.directory, name)
+                snap = _read_json(path)
+                if snap is None:
+                    continue
+                if _alive(int(name.split('-', 1)[0])):
+                    snaps.append(snap)
+                else:
+                    dead.append((path, snap))
+            if dead:
+                total = _empty()
+                for snap in [archive] + [snap for _, snap in dead]:
+                    _merge(total, snap)
+                archive = _plain(total)
+                _write_json(archive_path, archive)
+                for path, _ in dead:
+                    os.remove(path)
+        return snaps, archive
+
+    @staticmethod
+    def _histogram(lines, name, help_text, series):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, hist in sorted(series.items()):
+            label_str = _labels(**labels) if isinstance(labels, dict) else labels
+            cumulative = 0
+            for bound, count in zip(hist.bounds, hist.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{label_str},le="{_bound(bound)}"}} {cumulative}')
+            cumulative += hist.counts[-1]
+            lines.append(f'{name}_bucket{{{label_str},le="+Inf"}} {cumulative}')
+            lines.append(f'{name}_sum{{{label_str}}} {hist.sum!r}')
+            lines.append(f'{name}_count{{{label_str}}} {cumulative}')
+
+    def render(self):
+        workers = 1
+        if self.directory:
+            self.flush()
+            snaps, archive = self._collect()
+            workers = len(snaps)
+            snaps.append(archive)
+        else:
+            snaps = [self.snapshot()]
+        total = _empty()
+        for snap in snaps:
+            _merge(total, snap)
+
+        lines = [
+            '# HELP process_info The process that rendered this scrape.',
+            '# TYPE process_info gauge',
+            f'process_info{{{_labels(pid=os.getpid())}}} 1',
+            '# HELP process_start_time_seconds When this process started recording, as a Unix time.',
+            '# TYPE process_start_time_seconds gauge',
+            f'process_start_time_seconds {self.started!r}',
+            '# HELP metrics_worker_processes Live worker processes that have reported into these series.',
+            '# TYPE metrics_worker_processes gauge',
+            f'metrics_worker_processes {workers}',
+            '# HELP http_requests_total Requests served, by endpoint, method and status.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (endpoint, method, status), n in sorted(total['requests'].items()):
+            lines.append(f'http_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {n}')
+        for _, name, help_text, label_names, _ in HISTOGRAMS:
+            series = {_labels(**dict(zip(label_names, key))): hist for key, hist in total[name].items()}
+            self._histogram(lines, name, help_text, series)
+        sql_totals = total['sql']
+        lines += ['# HELP db_statements_total SQL statements executed, by database.',
+                  '# TYPE db_statements_total counter']
+        lines += [f'db_statements_total{{{_labels(database=db)}}} {n}' for db, (n, _) in sorted(sql_totals.items())]
+        lines += ['# HELP db_statement_seconds_total Time spent executing SQL, by database.',
+                  '# TYPE db_statement_seconds_total counter']
+        lines += [f'db_statement_seconds_total{{{_labels(database=db)}}} {s!r}' for db, (_, s) in sorted(sql_totals.items())]
+        return '\n'.join(lines) + '\n'
+
+
+def _empty():
+    return {'requests': {}, 'sql': {}, **{name: {} for _, name, _, _, _ in HISTOGRAMS}}
+
+
+def _merge(total, snap):
+    requests = total['requests']
+    for key, n in snap.get('requests', ()):
+        key = tuple(key)
+        requests[key] = requests.get(key, 0) + n
+    for _, name, _, _, bounds in HISTOGRAMS:
+        series = total[name]
+        for key, counts, hist_sum in snap.get(name, ()):
+            if len(counts) != len(bounds) + 1:
+                continue  # written by a release with other buckets
+            key = tuple(key)
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram(bounds)
+            hist.counts = [a + b for a, b in zip(hist.counts, counts)]
+            hist.sum += hist_sum
+    for db, n, seconds in snap.get('sql', ()):
+        t = total['sql'].setdefault(db, [0, 0.0])
+        t[0] += n
+        t[1] += seconds
+
+
+def _plain(total):
+    out = {'requests': [[list(key), n] for key, n in total['requests'].items()],
+           'sql': [[db, n, seconds] for db, (n, seconds) in total['sql'].items()]}
+    for _, name, _, _, _ in HISTOGRAMS:
+        out[name] = [[list(key), hist.counts, hist.sum] for key, hist in total[name].items()]
+    return out
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _locked(path):
+    # Two scrapes must not fold the same exited worker into the archive twice
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
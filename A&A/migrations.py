@@ -0,0 +1,382 @@
+"""
+Versioned schema migrations for the SQLite databases under instance/
+(or their schemas in PostgreSQL when DATABASE_URL is set, see pgbackend).
+
+Each database has a schema_version table listing the migrations applied to
+it. run_all() applies whatever is missing, once, when the app boots (or
+ahead of time with `flask --app app migrate` / `python migrations.py` during
+a deploy), so request handlers carry no DDL or introspection.
+
+Databases created before this runner existed have no schema_version but
+already contain some of these tables and columns. Every migration is
+therefore written to be safe on such a file (IF NOT EXISTS, and a column is
+added only when missing), and the first run simply records the versions.
+
+Add new migrations at the end of a database's list with the next version
+number; never edit or renumber one that has shipped.
+"""
+import os
+import sys
+from datetime import datetime
+
+try:
+    from . import cafe_occupancy, cafe_holds, cafe_tables, community_directory, dbconn, eventbus, outbox
+except ImportError:
+    import cafe_occupancy
+    import cafe_holds
+    import cafe_tables
+    import community_directory
+    import dbconn
+    import eventbus
+    import outbox
+
+
+def _columns(conn, table):
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _add_column(conn, table, column, decl):
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _outbox_claims(conn):
+    # Claim token, so a worker records results only for rows it still holds
+    _add_column(conn, 'outbox', 'claimed_by', 'TEXT')
+
+
+# ---------------- cafe.db ----------------
+def _cafe_baseline(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cafe_bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            party_size INTEGER NOT NULL DEFAULT 1,
+            note TEXT,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            duration_minutes INTEGER NOT NULL DEFAULT 60,
+            canceled_at TEXT
+        )
+        """
+    )
+    _add_column(conn, 'cafe_bookings', 'duration_minutes', 'INTEGER NOT NULL DEFAULT 60')
+    _add_column(conn, 'cafe_bookings', 'canceled_at', 'TEXT')
+
+
+def _cafe_minutes(conn):
+    # Integer minutes-since-midnight so overlap checks run in SQL, not Python
+    _add_column(conn, 'cafe_bookings', 'start_min', 'INTEGER')
+    _add_column(conn, 'cafe_bookings', 'end_min', 'INTEGER')
+    conn.execute(
+        """
+        UPDATE cafe_bookings
+        SET start_min = CAST(substr(time, 1, instr(time, ':') - 1) AS INTEGER) * 60
+                      + CAST(substr(time, instr(time, ':') + 1) AS INTEGER)
+        WHERE start_min IS NULL
+        """
+    )
+    conn.execute("UPDATE cafe_bookings SET end_min = start_min + IFNULL(duration_minutes, 60) WHERE end_min IS NULL")
+    # Indexes for per-day overlap scans and per-user listings
+    conn.execute("DROP INDEX IF EXISTS idx_cafe_date_time_status")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cafe_date_status_start ON cafe_bookings(date, status, start_min)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cafe_user_date ON cafe_bookings(user_id, date)")
+
+
+def _cafe_tables(conn):
+    _add_column(conn, 'cafe_bookings', 'table_id', 'INTEGER')
+
+
+CAFE = [
+    (1, 'cafe_bookings baseline', _cafe_baseline),
+    (2, 'integer start/end minutes and indexes', _cafe_minutes),
+    (3, 'table assignment column', _cafe_tables),
+    (4, 'seat holds', cafe_holds.ensure_holds_table),
+    (5, 'per-bucket occupancy counters', cafe_occupancy.ensure_occupancy_table),
+    (6, 'notification outbox', outbox.ensure_outbox_table),
+    (7, 'per-day table schedule versions', cafe_tables.ensure_versions_table),
+    (8, 'outbox claim tokens', _outbox_claims),
+]
+
+
+# ---------------- community.db ----------------
+def _community_baseline(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS community_subscribers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            email TEXT UNIQUE NOT NULL,
+            joined_at TEXT NOT NULL,
+            display_name TEXT,
+            photo_path TEXT
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS community_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            author TEXT,
+            content TEXT NOT NULL,
+            is_admin INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    _add_column(conn, 'community_subscribers', 'user_id', 'INTEGER')
+    _add_column(conn, 'community_subscribers', 'display_name', 'TEXT')
+    _add_column(conn, 'community_subscribers', 'photo_path', 'TEXT')
+
+
+def _community_last_seen(conn):
+    # Unread = messages with id > last_seen_message_id (a rowid range count)
+    _add_column(conn, 'community_subscribers', 'last_seen_message_id', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_community_subscribers_user ON community_subscribers(user_id)")
+
+
+def _community_directory(conn):
+    # Display fields computed on write (see community_directory) plus search indexes
+    _add_column(conn, 'community_subscribers', 'email_masked', 'TEXT')
+    _add_column(conn, 'community_subscribers', 'photo_url', 'TEXT')
+    _add_column(conn, 'community_subscribers', 'name_key', 'TEXT')
+    rows = conn.execute("SELECT id, email, display_name, photo_path FROM community_subscribers").fetchall()
+    conn.executemany(
+        "UPDATE community_subscribers SET email_masked=?, photo_url=?, name_key=? WHERE id=?",
+        [(community_directory.mask_email(email), community_directory.photo_url(photo),
+          community_directory.name_key(name), sid) for sid, email, name, photo in rows]
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_community_subscribers_name ON community_subscribers(name_key, id)")
+
+
+def _community_avatar_blobs(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS avatar_blobs (
+            name TEXT PRIMARY KEY,
+            size INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """
+    )
+
+
+COMMUNITY = [
+    (1, 'subscribers and messages baseline', _community_baseline),
+    (2, 'per-subscriber last seen message', _community_last_seen),
+    (3, 'precomputed directory fields and name index', _community_directory),
+    (4, 'avatar blob reference counts', _community_avatar_blobs),
+    (5, 'notification outbox', outbox.ensure_outbox_table),
+    (6, 'outbox claim tokens', _outbox_claims),
+]
+
+
+# ---------------- games.db ----------------
+SAMPLE_GAMES = [
+    ("Baldur's Gate 3", "Epic CRPG adventure with deep choices and co-op.", "RPG,Co-op", 59.99, 9.99, "images/games/Baldurs_Gate_3.jpeg"),
+    ("Alan Wake 2", "Psychological horror thriller with cinematic storytelling.", "Horror,Narrative", 49.99, 7.99, "images/games/Alan_Wake_2.jpeg"),
+    ("Cyberpunk 2077", "Open-world RPG in a neon-soaked metropolis.", "RPG,Open-World", 29.99, 6.99, "images/games/cyberpunk.jpeg"),
+    ("Red Dead Redemption 2", "Open-world western with cinematic storytelling.", "Open-World,Action", 39.99, 8.99, "images/games/red.jpeg"),
+    ("The Witcher 3", "Open-world RPG full of monsters and choices.", "RPG,Open-World", 29.99, 6.49, "images/games/witcher.jpeg"),
+    ("Disco Elysium", "A groundbreaking RPG focused on choice and investigation.", "Indie,RPG", 19.99, 4.49, "images/games/Disco.jpeg"),
+    ("Silent Hill 2 (Remake)", "Reimagined survival-horror classic.", "Horror,Survival", 39.99, 8.49, "images/games/hill.jpeg"),
+    ("God of War", "A mythic reimagining: father, son, and monsters.", "Action,Adventure", 29.99, 6.99, "images/games/god.jpeg")
+]
+
+
+def _games_baseline(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            category TEXT,
+            buy_price REAL DEFAULT 0,
+            rent_price REAL DEFAULT 0,
+            image TEXT
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS purchase_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            purchase_date TEXT NOT NULL,
+            total_amount REAL NOT NULL,
+            buyer_name TEXT,
+            buyer_email TEXT,
+            items_json TEXT NOT NULL
+        )
+        """
+    )
+    _add_column(conn, 'purchase_history', 'payment_method', 'TEXT')
+
+
+def _games_seed(conn):
+    if conn.execute("SELECT COUNT(*) FROM games").fetchone()[0] == 0:
+        conn.executemany(
+            "INSERT INTO games (title, description, category, buy_price, rent_price, image) VALUES (?, ?, ?, ?, ?, ?)",
+            SAMPLE_GAMES
+        )
+
+
+GAMES = [
+    (1, 'games and purchase_history baseline', _games_baseline),
+    (2, 'seed sample games', _games_seed),
+    (3, 'notification outbox', outbox.ensure_outbox_table),
+    (4, 'outbox claim tokens', _outbox_claims),
+]
+
+
+# ---------------- books.db ----------------
+SAMPLE_BOOKS = [
+    # Manga
+    ("One Piece Vol. 1", "Eiichiro Oda", "...", "Manga", "Adventure,Shounen", 9.99, 2.99, "images/books/onepiece.jpg", "978-1421506333", 200, 1999),
+    ("Attack on Titan Vol. 1", "Hajime Isayama",
+     "Humanity fights for survival against giant titans.",
+     "Manga", "Action,Drama", 10.99, 3.49, "images/books/aot1.jpeg",
+     "978-1612620244", 192, 2012),
+    ("Demon Slayer Vol. 1", "Koyoharu Gotouge", "...", "Manga", "Action,Supernatural", 9.99, 2.99, "images/books/DemonSlayerVol1.jpg", "978-1974700523", 192, 2018),
+
+    # Light Novels
+    ("Sword Art Online Vol. 1", "Reki Kawahara", "Trapped in a virtual MMORPG where death is real.", "Light Novel", "Sci-Fi,Romance", 14.99, 4.99, "images/books/sao.jpeg", "978-0316371247", 240, 2014),
+    ("Re:Zero Vol. 1", "Tappei Nagatsuki", "Subaru discovers he can return from death in another world.", "Light Novel", "Fantasy,Psychological", 14.99, 4.99, "images/books/rezero.jpeg", "978-0316315302", 256, 2016),
+    ("Overlord Vol. 1", "Kugane Maruyama", "A player becomes trapped as his undead character in a game world.", "Light Novel", "Fantasy,Dark", 14.99, 4.99, "images/books/overlord.jpg", "978-0316272247", 272, 2016),
+
+    # Traditional Novels
+    ("Dune", "Frank Herbert", "Epic sci-fi saga on the desert planet Arrakis.", "Novel", "Science Fiction", 16.99, 5.99, "images/books/Dune.jpeg", "978-0441172719", 688, 1965),
+    ("The Hobbit", "J.R.R. Tolkien", "Bilbo Baggins' unexpected journey to reclaim a treasure.", "Novel", "Fantasy", 14.99, 4.99, "images/books/hobbit.jpeg", "978-0547928227", 300, 1937),
+    ("1984", "George Orwell", "Dystopian masterpiece about surveillance and control.", "Novel", "Dystopian,Classic", 13.99, 4.49, "images/books/1984.jpg", "978-0452284234", 328, 1949),
+
+    # Technical Books
+    ("Clean Code", "Robert C. Martin", "A handbook of agile software craftsmanship.", "Technical", "Programming", 49.99, 12.99, "images/books/clean.jpeg", "978-0132350884", 464, 2008),
+    ("Design Patterns", "Gang of Four", "Elements of reusable object-oriented software.", "Technical", "Programming", 54.99, 14.99, "images/books/designpatterns.jpg", "978-0201633612", 395, 1994),
+
+    # Non-Fiction
+    ("Sapiens", "Yuval Noah Harari", "A brief history of humankind and our species' journey.", "Non-Fiction", "History,Science", 18.99, 6.99, "images/books/sapiens.jpeg", "978-0062316097", 443, 2014),
+    ("Atomic Habits", "James Clear", "Tiny changes that create remarkable results.", "Non-Fiction", "Self-Help", 16.99, 5.99, "images/books/atomic_habits.jpeg", "978-0735211292", 320, 2018)
+]
+
+
+def _books_baseline(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            description TEXT,
+            category TEXT,
+            genre TEXT,
+            buy_price REAL DEFAULT 0,
+            rent_price REAL DEFAULT 0,
+            image TEXT,
+            isbn TEXT,
+            pages INTEGER,
+            publication_year INTEGER
+        )
+        """
+    )
+
+
+def _books_seed(conn):
+    if conn.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 0:
+        conn.executemany(
+            """
+            INSERT INTO books (title, author, description, category, genre, buy_price, rent_price, image, isbn, pages, publication_year)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            SAMPLE_BOOKS
+        )
+
+
+BOOKS = [
+    (1, 'books baseline', _books_baseline),
+    (2, 'seed sample books', _books_seed),
+]
+
+
+EVENTS = [
+    (1, 'shared log behind the SSE streams', eventbus.ensure_events_table),
+]
+
+
+DATABASES = {
+    'books.db': BOOKS,
+    'games.db': GAMES,
+    'cafe.db': CAFE,
+    'community.db': COMMUNITY,
+    'events.db': EVENTS,
+}
+
+
+# ---------------- Runner ----------------
+def current_version(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+        """
+    )
+    return conn.execute("SELECT IFNULL(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(db_path, migrations):
+    """Apply pending migrations to one database; returns the versions applied."""
+    # dbconn switches the file to WAL before any request opens it (or, on
+    # PostgreSQL, hands out a connection to the database's schema)
+    conn = dbconn.connect(db_path)
+    conn.isolation_level = None
+    applied = []
+    try:
+        for version, name, fn in migrations:
+            if version <= current_version(conn):
+                continue
+            # One write transaction per migration; re-check under the lock in
+            # case another worker process applied it meanwhile
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if version <= current_version(conn):
+                    conn.execute("ROLLBACK")
+                    continue
+                fn(conn)
+                conn.execute(
+                    "INSERT INTO schema_version(version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.utcnow().isoformat())
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(version)
+    finally:
+        conn.close()
+        dbconn.schema_changed(db_path)
+    return applied
+
+
+def run_all(instance_path):
+    """Migrate every database under instance_path; returns {db_name: [versions applied]}."""
+    os.makedirs(instance_path, exist_ok=True)
+    dbconn.ensure_databases([os.path.join(instance_path, name) for name in DATABASES])
+    return {
+        name: migrate(os.path.join(instance_path, name), migrations)
+        for name, migrations in DATABASES.items()
+    }
+
+
+if __name__ == '__main__':
+    target = sys.argv[1] if len(sys.argv) > 1 else os.environ.get(
+        'INSTANCE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance'))
+    dbconn.configure(os.environ.get('DATABASE_URL'))
+    for name, versions in run_all(target).items():
+        print(f"{name}: {'applied ' + ', '.join(map(str, versions)) if versions else 'up to date'}")
@@ -0,0 +1,413 @@
+"""
+Transactional outbox for notification emails.
+
+Request handlers never talk to SMTP. They call enqueue() inside the same
+transaction as the booking, purchase or post, so an email exists exactly when
+the business row does. The outbox table lives in the same database as that
+row (cafe.db, games.db, community.db).
+
+A Dispatcher owns a few background threads. Each one claims a batch of due
+rows under BEGIN IMMEDIATE, which also sets a lease, so workers in other
+processes never send the same row twice. It sends the batch over a pooled
+SMTP connection and records every result in one short transaction. The claim
+stamps the rows with a random token (claimed_by), and a result is recorded
+only while the row still carries it: a worker that stalled past its lease
+leaves the row to whoever claimed it next. Failures
+are retried with exponential backoff and jitter. Permanent (5xx) failures,
+and rows out of attempts, become 'dead' and are kept for inspection. A worker
+that crashes mid-batch loses only its lease, and the rows come back once the
+lease expires.
+
+A community post is one fan-out row (recipient '*'). The worker expands it
+into per-subscriber rows one keyset batch at a time, so posting stays a
+single insert however many members there are.
+"""
+import logging
+import os
+import random
+import secrets
+import smtplib
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from email.message import EmailMessage
+
+try:
+    from . import dbconn
+except ImportError:
+    import dbconn
+
+FANOUT = '*'
+LEASE_SECONDS = 120
+BACKOFF_BASE = 30
+BACKOFF_MAX = 3600
+
+
+def ensure_outbox_table(conn):
+    """Create outbox and its claim index (run from migrations; caller commits)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            fanout_after INTEGER,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            sent_at TEXT
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+
+
+def enabled():
+    return bool(os.getenv('SMTP_HOST'))
+
+
+def enqueue(conn, kind, recipient, subject, body):
+    """
+    Queue one email in the caller's open transaction. Does nothing (returns
+    None) when SMTP is not configured or there is no recipient.
+    """
+    if not enabled() or not recipient:
+        return None
+    cur = conn.execute(
+        "INSERT INTO outbox(kind, recipient, subject, body, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (kind, recipient, subject, body, time.time(), datetime.utcnow().isoformat())
+    )
+    return cur.lastrowid
+
+
+def backoff(attempts):
+    """Seconds before retry number `attempts` (1-based), with +/-20% jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _permanent(exc):
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return True
+    code = getattr(exc, 'smtp_code', None)
+    return isinstance(code, int) and code >= 500
+
+
+class SmtpPool:
+    """
+    Reusable SMTP sessions. Idle sessions are probed with NOOP before reuse and
+    closed once they have idled past `idle_seconds` (servers drop them anyway).
+    """
+
+    def __init__(self, host, port=25, user=None, password=None, starttls=False,
+                 timeout=10.0, max_idle=4, idle_seconds=60.0):
+        self.host, self.port = host, int(port)
+        self.user, self.password = user, password
+        self.starttls, self.timeout = starttls, timeout
+        self.max_idle, self.idle_seconds = max_idle, idle_seconds
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv('SMTP_HOST'),
+            int(os.getenv('SMTP_PORT', '25')),
+            os.getenv('SMTP_USER') or None,
+            os.getenv('SMTP_PASSWORD') or None,
+            os.getenv('SMTP_STARTTLS', '0') == '1',
+        )
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.user:
+            smtp.login(self.user, self.password or '')
+        self.opened += 1
+        return smtp
+
+    def acquire(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                smtp, since = self._idle.pop()
+            if now - since < self.idle_seconds:
+                try:
+                    if smtp.noop()[0] == 250:
+                        return smtp
+                except (smtplib.SMTPException, OSError):
+                    pass
+            self._close(smtp)
+        return self._open()
+
+    def release(self, smtp, broken=False):
+        if not broken:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append((smtp, time.monotonic()))
+                    return
+        self._close(smtp)
+
+    def forget(self):
+        """Drop sessions inherited across a fork without talking to the server."""
+        with self._lock:
+            self._idle = []
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp, _ in idle:
+            self._close(smtp)
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            try:
+                smtp.close()
+            except OSError:
+                pass
+
+
+class Dispatcher:
+    """Background delivery for the outbox tables in `db_paths`."""
+
+    def __init__(self, db_paths, pool=None, workers=2, batch=50, max_attempts=8,
+                 poll_seconds=5.0, sender='no-reply@localhost', logger=None):
+        self.db_paths = list(db_paths)
+        self.pool = pool
+        self.workers = workers
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.sender = sender
+        self._logger = logger if logger is not None else logging.getLogger(__name__)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self.counters = {'sent': 0, 'retried': 0, 'dead': 0, 'batches': 0, 'expanded': 0, 'errors': 0,
+                         'lease_lost': 0}
+
+    @classmethod
+    def from_env(cls, db_paths, logger=None):
+        return cls(
+            db_paths,
+            SmtpPool.from_env() if enabled() else None,
+            workers=max(1, int(os.getenv('OUTBOX_WORKERS', '2'))),
+            batch=max(1, int(os.getenv('OUTBOX_BATCH', '50'))),
+            max_attempts=max(1, int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))),
+            poll_seconds=max(0.5, float(os.getenv('OUTBOX_POLL_SECONDS', '5'))),
+            sender=os.getenv('SMTP_FROM', 'no-reply@localhost'),
+            logger=logger,
+        )
+
+    # ---------- lifecycle ----------
+    def ensure_started(self):
+        """Start the worker threads once per process (forked workers start their own)."""
+        if self.pool is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self.pool.forget()
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'outbox-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for t in self._threads:
+                t.start()
+
+    def notify(self):
+        """Wake the workers after a commit that queued mail."""
+        self.ensure_started()
+        self._wake.set()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._pid = None
+        if self.pool:
+            self.pool.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                busy = self.run_once()
+            except Exception:
+                # Claimed rows come back when their lease expires; wait a poll before retrying
+                self._logger.exception('outbox pass failed')
+                with self._lock:
+                    self.counters['errors'] += 1
+                busy = False
+            if not busy:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    # ---------- one pass ----------
+    def run_once(self, now=None):
+        """Claim and deliver one batch per database; True if anything was done."""
+        busy = False
+        for path in self.db_paths:
+            if not dbconn.exists(path):
+                continue
+            rows, expanded, token = self._claim(path, time.time() if now is None else now)
+            busy = busy or expanded or bool(rows)
+            if rows:
+                self._deliver(path, rows, token)
+        return busy
+
+    def _connect(self, path):
+        conn = dbconn.connect(path)
+        conn.isolation_level = None
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _claim(self, path, now):
+        # (rows, expanded fan-outs, claim token)
+        token = secrets.token_hex(8)
+        conn = self._connect(path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # 'sending' rows whose lease ran out belonged to a worker that died
+            rows = conn.execute(
+                "SELECT id, kind, recipient, subject, body, attempts, fanout_after FROM outbox "
+                "WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, self.batch)
+            ).fetchall()
+            fanouts = [r for r in rows if r['recipient'] == FANOUT]
+            for r in fanouts:
+                self._expand(conn, r, now)
+            rows = [r for r in rows if r['recipient'] != FANOUT]
+            conn.executemany(
+                "UPDATE outbox SET status='sending', next_attempt_at=?, claimed_by=? WHERE id=?",
+                [(now + LEASE_SECONDS, token, r['id']) for r in rows]
+            )
+            conn.execute("COMMIT")
+            return rows, bool(fanouts), token
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _expand(self, conn, row, now):
+        # One keyset batch of subscribers per pass; the row remembers where it got to
+        after = int(row['fanout_after'] or 0)
+        ids = [r[0] for r in conn.execute(
+            "SELECT id FROM community_subscribers WHERE id > ? ORDER BY id LIMIT ?", (after, self.batch)
+        ).fetchall()]
+        if ids:
+            conn.execute(
+                "INSERT INTO outbox(kind, recipient, subject, body, next_attempt_at, created_at) "
+                "SELECT ?, email, ?, ?, ?, ? FROM community_subscribers WHERE id > ? AND id <= ?",
+                (row['kind'], row['subject'], row['body'], now, datetime.utcnow().isoformat(), after, ids[-1])
+            )
+            with self._lock:
+                self.counters['expanded'] += len(ids)
+        if len(ids) < self.batch:
+            conn.execute("UPDATE outbox SET status='sent', sent_at=?, fanout_after=? WHERE id=?",
+                         (datetime.utcnow().isoformat(), ids[-1] if ids else after, row['id']))
+        else:
+            conn.execute("UPDATE outbox SET fanout_after=? WHERE id=?", (ids[-1], row['id']))
+
+    def _deliver(self, path, rows, token):
+        results = []
+        smtp = None
+        try:
+            for r in rows:
+                msg = EmailMessage()
+                msg['From'] = self.sender
+                msg['To'] = r['recipient']
+                msg['Subject'] = r['subject']
+                msg.set_content(r['body'])
+                try:
+                    if smtp is None:
+                        smtp = self.pool.acquire()
+                    smtp.send_message(msg)
+                    results.append((r, None))
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    # Connection-level failure: drop the session, later rows get a new one
+                    if smtp is not None:
+                        self.pool.release(smtp, broken=True)
+                        smtp = None
+                    results.append((r, e))
+                except smtplib.SMTPException as e:
+                    results.append((r, e))
+        finally:
+            if smtp is not None:
+                self.pool.release(smtp)
+        self._record(path, results, token)
+
+    def _record(self, path, results, token):
+        now = time.time()
+        stamp = datetime.utcnow().isoformat()
+        sent, retry, dead = [], [], []
+        for r, err in results:
+            attempts = int(r['attempts']) + 1
+            if err is None:
+                sent.append((attempts, stamp, r['id']))
+            elif _permanent(err) or attempts >= self.max_attempts:
+                dead.append((attempts, str(err)[:500], r['id']))
+            else:
+                retry.append((attempts, now + backoff(attempts), str(err)[:500], r['id']))
+        # Only rows this claim still holds; the others were re-claimed after the lease ran out
+        held = " WHERE id=? AND status='sending' AND claimed_by=?"
+        conn = self._connect(path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            counts = []
+            for sql, group in (
+                ("UPDATE outbox SET status='sent', attempts=?, sent_at=?, last_error=NULL", sent),
+                ("UPDATE outbox SET status='pending', attempts=?, next_attempt_at=?, last_error=?", retry),
+                ("UPDATE outbox SET status='dead', attempts=?, last_error=?", dead),
+            ):
+                counts.append(sum(conn.execute(sql + held, params + (token,)).rowcount for params in group))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        with self._lock:
+            self.counters['batches'] += 1
+            self.counters['sent'] += counts[0]
+            self.counters['retried'] += counts[1]
+            self.counters['dead'] += counts[2]
+            self.counters['lease_lost'] += len(results) - sum(counts)
+
+    # ---------- admin ----------
+    def stats(self):
+        out = {'enabled': self.pool is not None, 'running': self._pid == os.getpid(),
+               'workers': self.workers, 'counters': dict(self.counters),
+               'smtp_connections_opened': self.pool.opened if self.pool else 0, 'databases': {}}
+        for path in self.db_paths:
+            if not dbconn.exists(path):
+                continue
+            conn = dbconn.connect(path, readonly=True)
+            try:
+                rows = conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+                oldest = conn.execute(
+                    "SELECT MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()[0]
+            except sqlite3.OperationalError:
+                continue
+            finally:
+                conn.close()
+            out['databases'][os.path.basename(path)] = {'by_status': dict(rows), 'oldest_pending': oldest}
+        return out
@@ -0,0 +1,229 @@
+"""
+Password hashing off the request threads, and login throttling in front of it.
+
+scrypt is deliberately slow, and a burst of logins used to pin every request
+thread on it. HashPool runs the werkzeug hash/check functions in a small
+process pool (spawned, so it is safe under forking servers) behind a
+semaphore sized workers + queue. When the pool and its queue are full, the
+caller gets PoolBusy at once instead of waiting in line. A call that waits
+longer than the timeout gets PoolTimeout (a PoolBusy), so both turn into the
+same 503. Its slot stays taken until the worker is done with it. If a
+worker process dies, the broken pool is shut down and replaced on the next
+call; the calls caught by it get PoolBusy too rather than hashing on the
+request thread.
+
+LoginThrottle keeps token buckets per client IP and per account name and
+rejects an attempt before any database read or hashing happens. Each bucket
+map is an LRU with a fixed size, so a spray of addresses can't grow it.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _ready():
+    # Run in each new worker process: unpickling it imports werkzeug.security there
+    return os.getpid()
+
+
+class PoolBusy(Exception):
+    """All hashing workers and queue slots are taken."""
+
+
+class PoolTimeout(PoolBusy):
+    """The hash did not finish within the pool's timeout."""
+
+
+class HashPool:
+    def __init__(self, workers=2, max_queue=8, timeout=10.0):
+        self.workers = workers
+        self.timeout = timeout
+        # workers=0 hashes inline (development, single-threaded servers)
+        self._slots = threading.BoundedSemaphore(max(1, workers) + max_queue)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {op: {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(BUCKETS) + 1)}
+                       for op in ('hash', 'check')}
+        self.rejected = 0
+        self.inflight = 0
+        self.broken = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_env(cls):
+        default = str(min(2, os.cpu_count() or 1))
+        return cls(
+            workers=max(0, int(os.getenv('PASSWORD_HASH_WORKERS', default))),
+            max_queue=max(0, int(os.getenv('PASSWORD_HASH_QUEUE', '8'))),
+            timeout=float(os.getenv('PASSWORD_HASH_TIMEOUT', '10')),
+        )
+
+    def _pool(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, op, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolBusy()
+        t0 = time.perf_counter()
+        held = True
+        with self._lock:
+            self.inflight += 1
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            pool = self._pool()
+            try:
+                future = pool.submit(fn, *args)
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                with self._lock:
+                    self.timeouts += 1
+                if not future.cancel():
+                    # Already running: its worker stays busy, so keep the slot until it is done
+                    held = False
+                    future.add_done_callback(lambda _: self._slots.release())
+                raise PoolTimeout() from None
+            except BrokenProcessPool:
+                # A worker died (OOM, kill). Never hash on the request thread: drop the
+                # pool (the next call starts a fresh one) and answer this one busy
+                with self._lock:
+                    if self._executor is pool:
+                        self._executor = None
+                        self.broken += 1
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise PoolBusy() from None
+        finally:
+            elapsed = time.perf_counter() - t0
+            if held:
+                self._slots.release()
+            with self._lock:
+                self.inflight -= 1
+                st = self._stats[op]
+                st['count'] += 1
+                st['sum'] += elapsed
+                st['max'] = max(st['max'], elapsed)
+                st['buckets'][next((i for i, b in enumerate(BUCKETS) if elapsed <= b), len(BUCKETS))] += 1
+
+    def hash(self, password):
+        return self._run('hash', generate_password_hash, password)
+
+    def check(self, pwhash, password):
+        return self._run('check', check_password_hash, pwhash, password)
+
+    def warm(self):
+        """Start the worker processes now, so the first sign-in doesn't wait for them to spawn."""
+        if self.workers == 0:
+            return
+        pool = self._pool()
+        for f in [pool.submit(_ready) for _ in range(self.workers)]:
+            f.result(timeout=self.timeout)
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def metrics(self):
+        with self._lock:
+            out = {'workers': self.workers, 'inflight': self.inflight, 'rejected_busy': self.rejected,
+                   'pool_restarts': self.broken, 'timeouts': self.timeouts}
+            for op, st in self._stats.items():
+                out[op] = {
+                    'count': st['count'],
+                    'avg_ms': round(st['sum'] / st['count'] * 1000, 2) if st['count'] else 0.0,
+                    'max_ms': round(st['max'] * 1000, 2),
+                    'le_ms': {('+Inf' if i == len(BUCKETS) else str(int(BUCKETS[i] * 1000))): n
+                              for i, n in enumerate(st['buckets'])},
+                }
+            return out
+
+
+class TokenBuckets:
+    """`burst` tokens per key, refilled at `per_minute`; oldest keys are evicted past max_keys."""
+
+    def __init__(self, per_minute, burst, max_keys=10000):
+        self.rate = per_minute / 60.0
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, now=None):
+        """Spend one token; returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                wait = 0.0
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate if self.rate > 0 else 60.0
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+def client_ip(request):
+    """
+    The caller's address. Behind TRUSTED_PROXIES reverse proxies (e.g. 1 on
+    Render), it is the address the outermost trusted proxy saw, not a value the
+    client can forge in X-Forwarded-For.
+    """
+    hops = int(os.getenv('TRUSTED_PROXIES', '0') or 0)
+    route = request.access_route
+    if hops > 0 and request.headers.get('X-Forwarded-For') and len(route) >= hops:
+        return route[-hops]
+    return request.remote_addr
+
+
+class LoginThrottle:
+    def __init__(self, ip_per_minute=20, ip_burst=10, account_per_minute=5, account_burst=5):
+        self.by_ip = TokenBuckets(ip_per_minute, ip_burst)
+        self.by_account = TokenBuckets(account_per_minute, account_burst)
+        self.rejected = {'ip': 0, 'account': 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            float(os.getenv('LOGIN_IP_PER_MINUTE', '20')), int(os.getenv('LOGIN_IP_BURST', '10')),
+            float(os.getenv('LOGIN_ACCOUNT_PER_MINUTE', '5')), int(os.getenv('LOGIN_ACCOUNT_BURST', '5')),
+        )
+
+    def check(self, ip, account=None):
+        """
+        Seconds the caller must wait (0 = go ahead). The IP is charged first, so
+        a throttled address can't drain somebody else's account bucket.
+        """
+        wait = self.by_ip.take(ip or '-')
+        if wait:
+            self.rejected['ip'] += 1
+            return wait
+        if account:
+            wait = self.by_account.take(account.strip().lower())
+            if wait:
+                self.rejected['account'] += 1
+        return wait
+
+    def metrics(self):
+        return {'rejected': dict(self.rejected),
+                'tracked_ips': len(self.by_ip._buckets), 'tracked_accounts': len(self.by_account._buckets)}
@@ -0,0 +1,472 @@
+"""
+PostgreSQL storage backend behind dbconn.connect().
+
+With DATABASE_URL=postgresql://... every instance "file" becomes a schema in
+one Postgres database (books.db -> books, cafe.db -> cafe, ...). The request
+handlers keep their SQL and their sqlite3-style calls. connect() returns a
+Connection that looks like a sqlite3.Connection: execute/executemany,
+cursor().lastrowid, row_factory = sqlite3.Row, isolation_level, implicit
+transactions, and sqlite3 exception types. Each statement is translated
+once (cached) into Postgres SQL:
+
+    ?, :name                  -> %s, %(name)s
+    IFNULL / instr / julianday / scalar MAX(a, b), MIN(a, b)
+                              -> COALESCE / strpos / epoch arithmetic / GREATEST, LEAST
+    INSERT OR IGNORE          -> INSERT ... ON CONFLICT DO NOTHING
+    BEGIN IMMEDIATE           -> BEGIN + a per-schema advisory lock, the same
+                                 single-writer guarantee the capacity checks rely on
+    AUTOINCREMENT / REAL / WITHOUT ROWID, PRAGMA table_info, sqlite_master
+                              -> identity columns / double precision / information_schema
+
+LIKE is passed through unchanged, so it is case-sensitive on Postgres where
+SQLite ignores ASCII case. The searches that want case-insensitive matching
+say so themselves (lower(col) LIKE ? with a lower-cased pattern), and both
+backends then agree.
+
+Connections come from one psycopg_pool per schema, with search_path set at
+connect time, so a checkout costs no round trip. Statements run often enough
+(PG_PREPARE_THRESHOLD) become server-side prepared statements; translation
+is deterministic, so one SQL text always maps to one prepared statement.
+Read-only checkouts use DATABASE_READ_URL (a replica) when it is set.
+
+Requires `pip install "psycopg[binary,pool]"`; nothing imports this module
+unless DATABASE_URL points at Postgres.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+try:
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+    from psycopg.pq import TransactionStatus
+    from psycopg.types.numeric import FloatLoader
+    from psycopg_pool import ConnectionPool
+except ImportError:  # pragma: no cover - optional dependency
+    psycopg = None
+
+try:
+    from . import dbconn
+except ImportError:
+    import dbconn
+
+
+def schema_for(db_name):
+    """'cafe.db' -> 'cafe'."""
+    return os.path.splitext(os.path.basename(db_name))[0].lower()
+
+
+# ---------------- SQL translation ----------------
+_DML = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.I)
+_INSERT_TABLE = re.compile(r'^\s*INSERT\s+(?:OR\s+IGNORE\s+)?INTO\s+(\w+)', re.I)
+_DDL = re.compile(r'^\s*(CREATE\s+TABLE|ALTER\s+TABLE)\b', re.I)
+
+
+def _split_literals(sql):
+    """Yield (is_literal, text) chunks so rewrites never touch quoted strings."""
+    out, i, n = [], 0, len(sql)
+    while i < n:
+        q = sql.find("'", i)
+        if q < 0:
+            out.append((False, sql[i:]))
+            break
+        out.append((False, sql[i:q]))
+        j = q + 1
+        while True:
+            j = sql.find("'", j)
+            if j < 0:
+                j = n
+                break
+            if j + 1 < n and sql[j + 1] == "'":
+                j += 2
+                continue
+            break
+        out.append((True, sql[q:j + 1]))
+        i = j + 1
+    return out
+
+
+def _matching_paren(s, open_idx):
+    depth = 0
+    for k in range(open_idx, len(s)):
+        if s[k] == '(':
+            depth += 1
+        elif s[k] == ')':
+            depth -= 1
+            if depth == 0:
+                return k
+    return -1
+
+
+def _has_top_level_comma(s):
+    depth = 0
+    for ch in s:
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            return True
+    return False
+
+
+def _rewrite_calls(sql, name, fn):
+    """Replace every call name(args) with fn(args) (or leave it when fn returns None)."""
+    pattern = re.compile(r'\b' + name + r'\s*\(', re.I)
+    pos = 0
+    while True:
+        m = pattern.search(sql, pos)
+        if not m:
+            return sql
+        open_idx = m.end() - 1
+        close_idx = _matching_paren(sql, open_idx)
+        if close_idx < 0:
+            return sql
+        inner = _rewrite_calls(sql[open_idx + 1:close_idx], name, fn)
+        repl = fn(inner)
+        if repl is None:
+            repl = sql[m.start():open_idx + 1] + inner + ')'
+        sql = sql[:m.start()] + repl + sql[close_idx + 1:]
+        pos = m.start() + len(repl)
+
+
+def _code(sql, ddl):
+    sql = sql.replace('%', '%%')
+    sql = re.sub(r'(?<!:):(\w+)', r'%(\1)s', sql)
+    sql = sql.replace('?', '%s')
+    sql = re.sub(r'\bIFNULL\s*\(', 'COALESCE(', sql, flags=re.I)
+    sql = re.sub(r'\binstr\s*\(', 'strpos(', sql, flags=re.I)
+    sql = _rewrite_calls(sql, 'julianday',
+                         lambda a: f"(EXTRACT(EPOCH FROM CAST({a} AS timestamp)) / 86400.0 + 2440587.5)")
+    for fn, pg in (('MAX', 'GREATEST'), ('MIN', 'LEAST')):
+        sql = _rewrite_calls(sql, fn, lambda a, pg=pg: f"{pg}({a})" if _has_top_level_comma(a) else None)
+    if ddl:
+        sql = re.sub(r'\bINTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT\b',
+                     'BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY', sql, flags=re.I)
+        sql = re.sub(r'\bREAL\b', 'DOUBLE PRECISION', sql, flags=re.I)
+        sql = re.sub(r'\bWITHOUT\s+ROWID\b', '', sql, flags=re.I)
+    return sql
+
+
+@lru_cache(maxsize=1024)
+def translate(sql, returning_id=False):
+    """SQLite statement -> Postgres statement (None for PRAGMAs that have no equivalent)."""
+    stripped = sql.strip().rstrip(';')
+    m = re.match(r'^PRAGMA\s+table_info\s*\(\s*(\w+)\s*\)$', stripped, re.I)
+    if m:
+        return ("SELECT ordinal_position - 1, column_name FROM information_schema.columns "
+                f"WHERE table_schema = current_schema() AND table_name = '{m.group(1).lower()}' ORDER BY ordinal_position")
+    if re.match(r'^PRAGMA\b', stripped, re.I):
+        return None
+    stripped = re.sub(r"\bsqlite_master\s+WHERE\s+type\s*=\s*'table'\s+AND\s+name\s*=",
+                      "information_schema.tables WHERE table_schema = current_schema() AND table_name =",
+                      stripped, flags=re.I)
+    ddl = bool(_DDL.match(stripped))
+    sql = ''.join(chunk.replace('%', '%%') if lit else _code(chunk, ddl)
+                  for lit, chunk in _split_literals(stripped))
+    ignore = re.match(r'^\s*INSERT\s+OR\s+IGNORE\s+', sql, re.I)
+    if ignore:
+        sql = 'INSERT ' + sql[ignore.end():] + ' ON CONFLICT DO NOTHING'
+    if returning_id:
+        sql += ' RETURNING id'
+    return sql
+
+
+# ---------------- sqlite3-compatible wrappers ----------------
+def _translate_error(exc):
+    if isinstance(exc, psycopg.IntegrityError):
+        return sqlite3.IntegrityError(str(exc))
+    return sqlite3.OperationalError(str(exc))
+
+
+class Row(tuple):
+    """Enough of sqlite3.Row: index, name access, keys() (so dict(row) works)."""
+
+    def __new__(cls, values, names, index):
+        row = super().__new__(cls, values)
+        row._names, row._index = names, index
+        return row
+
+    @staticmethod
+    def index_for(names):
+        """Name -> position, shared by every row of one result (case-insensitive like sqlite3.Row)."""
+        index = {}
+        for i, name in enumerate(names):
+            index.setdefault(name, i)
+            index.setdefault(name.lower(), i)
+        return index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            i = self._index.get(key)
+            if i is None:
+                i = self._index.get(key.lower())
+                if i is None:
+                    raise IndexError('No item with that key')
+            return tuple.__getitem__(self, i)
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._names)
+
+
+class Cursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._raw = conn._live()
+        self._cur = self._raw.cursor()
+        self.lastrowid = None
+        self._names = None  # column names of the current result set, None when there is none
+        self._index = None
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def _result(self):
+        # psycopg rebuilds description on every access; read it once per result set
+        desc = self._cur.description
+        self._names = [d.name for d in desc] if desc else None
+        self._index = Row.index_for(self._names) if self._names else None
+
+    def _rows(self, values):
+        if self._conn.row_factory is sqlite3.Row:
+            names, index = self._names, self._index
+            return [Row(v, names, index) for v in values]
+        return values
+
+    def execute(self, sql, params=()):
+        if not dbconn.observing():
+            return self._execute(sql, params)
+        started = time.perf_counter()
+        try:
+            return self._execute(sql, params)
+        finally:
+            dbconn.observe(self._conn._database, sql, started)
+
+    def executemany(self, sql, seq):
+        if not dbconn.observing():
+            return self._executemany(sql, seq)
+        started = time.perf_counter()
+        try:
+            return self._executemany(sql, seq)
+        finally:
+            dbconn.observe(self._conn._database, sql, started)
+
+    def _execute(self, sql, params):
+        stripped = sql.strip().rstrip(';')
+        upper = stripped.upper()
+        self._names = self._index = None
+        self.lastrowid = None
+        conn = self._conn
+        if conn._raw is not self._raw:
+            raise sqlite3.ProgrammingError('Cannot operate on a cursor from a closed connection.')
+        try:
+            if upper in ('BEGIN', 'BEGIN DEFERRED', 'BEGIN IMMEDIATE', 'BEGIN EXCLUSIVE'):
+                self._cur.execute('BEGIN')
+                if upper != 'BEGIN DEFERRED' and upper != 'BEGIN':
+                    # SQLite takes the file's write lock here; serialize writers per schema the same way
+                    self._cur.execute('SELECT pg_advisory_xact_lock(%s)', (conn._lock_key,))
+                return self
+            if upper in ('COMMIT', 'END', 'ROLLBACK'):
+                if conn.in_transaction:
+                    self._cur.execute('ROLLBACK' if upper == 'ROLLBACK' else 'COMMIT')
+                return self
+            table = _INSERT_TABLE.match(stripped)
+            returning = bool(table) and conn._backend.has_identity_id(conn._schema, table.group(1).lower(), conn._raw)
+            pg_sql = translate(stripped, returning)
+            if pg_sql is None:
+                return self
+            if conn.isolation_level is not None and _DML.match(stripped) and not conn.in_transaction:
+                self._cur.execute('BEGIN')  # sqlite3's implicit transaction before DML
+            self._cur.execute(pg_sql, params if params else None)
+            if returning:
+                row = self._cur.fetchone()
+                self.lastrowid = row[0] if row else None
+            else:
+                self._result()
+        except psycopg.Error as e:
+            raise _translate_error(e) from e
+        return self
+
+    def _executemany(self, sql, seq):
+        seq = list(seq)
+        if not seq:
+            return self
+        conn = self._conn
+        if conn._raw is not self._raw:
+            raise sqlite3.ProgrammingError('Cannot operate on a cursor from a closed connection.')
+        self._names = self._index = None
+        pg_sql = translate(sql.strip().rstrip(';'))
+        try:
+            if conn.isolation_level is not None and _DML.match(sql) and not conn.in_transaction:
+                self._cur.execute('BEGIN')
+            self._cur.executemany(pg_sql, seq)
+        except psycopg.Error as e:
+            raise _translate_error(e) from e
+        return self
+
+    def fetchone(self):
+        if self._names is None:
+            return None
+        row = self._cur.fetchone()
+        return None if row is None else self._rows([row])[0]
+
+    def fetchall(self):
+        if self._names is None:
+            return []
+        return self._rows(self._cur.fetchall())
+
+    def fetchmany(self, size=100):
+        if self._names is None:
+            return []
+        return self._rows(self._cur.fetchmany(size))
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(500)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        self._cur.close()
+
+
+class Connection:
+    """A pooled psycopg connection with the sqlite3.Connection surface the app uses."""
+
+    def __init__(self, backend, pool, raw, schema):
+        self._backend, self._pool, self._raw, self._schema = backend, pool, raw, schema
+        self._lock_key = zlib.crc32(schema.encode())
+        self._database = f'{schema}.db'  # the instance file name this schema stands for
+        self.row_factory = None
+        self.isolation_level = ''
+
+    @property
+    def in_transaction(self):
+        return self._raw is not None and self._raw.info.transaction_status != TransactionStatus.IDLE
+
+    def _live(self):
+        if self._raw is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return self._raw
+
+    def cursor(self):
+        return Cursor(self)
+
+    def execute(self, sql, params=()):
+        return Cursor(self).execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return Cursor(self).executemany(sql, seq)
+
+    def commit(self):
+        if self.in_transaction:
+            self._raw.execute('COMMIT')
+
+    def rollback(self):
+        if self.in_transaction:
+            self._raw.execute('ROLLBACK')
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        try:
+            if raw.info.transaction_status != TransactionStatus.IDLE:
+                raw.execute('ROLLBACK')
+        finally:
+            self._pool.putconn(raw)
+
+
+class PostgresBackend:
+    def __init__(self, url, read_url=None):
+        if psycopg is None:
+            raise RuntimeError('DATABASE_URL points at PostgreSQL but psycopg is not installed: '
+                               'pip install "psycopg[binary,pool]"')
+        self.url, self.read_url = url, read_url or None
+        self._pools = {}
+        self._identity = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _configure(conn):
+        # SUM()/AVG() over integers come back as numeric; the app expects plain numbers
+        conn.adapters.register_loader('numeric', FloatLoader)
+
+    def _pool(self, schema, readonly):
+        key = (schema, bool(readonly and self.read_url))
+        with self._lock:
+            if self._pid != os.getpid():
+                # Sockets must not be shared across a fork; the child builds its own pools
+                self._pools, self._pid = {}, os.getpid()
+            pool = self._pools.get(key)
+            if pool is None:
+                conninfo = make_conninfo(self.read_url if key[1] else self.url,
+                                         options=f'-c search_path={schema}')
+                pool = ConnectionPool(
+                    conninfo,
+                    min_size=int(os.getenv('PG_POOL_MIN', '1')),
+                    max_size=int(os.getenv('PG_POOL_MAX', '5')),
+                    kwargs={'autocommit': True, 'prepare_threshold': int(os.getenv('PG_PREPARE_THRESHOLD', '2'))},
+                    configure=self._configure,
+                    name=f'{schema}{"-ro" if key[1] else ""}',
+                    open=True,
+                )
+                self._pools[key] = pool
+            return pool
+
+    def ensure_schemas(self, names):
+        with psycopg.connect(self.url, autocommit=True) as conn:
+            for name in names:
+                conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema_for(name)}"')
+
+    def connect(self, db_name, readonly=False):
+        schema = schema_for(db_name)
+        pool = self._pool(schema, readonly)
+        raw = pool.getconn(timeout=float(os.getenv('PG_POOL_TIMEOUT', '10')))
+        return Connection(self, pool, raw, schema)
+
+    def has_identity_id(self, schema, table, raw):
+        """Whether INSERTs into table can report lastrowid via RETURNING id (asked once per table)."""
+        key = (schema, table)
+        found = self._identity.get(key)
+        if found is None:
+            row = raw.execute(
+                "SELECT 1 FROM information_schema.columns WHERE table_schema = %s AND table_name = %s "
+                "AND column_name = 'id' AND is_identity = 'YES'", (schema, table)).fetchone()
+            found = self._identity[key] = bool(row)
+        return found
+
+    def schema_changed(self, db_name):
+        """Forget the cached identity answers for one schema; migrations call this."""
+        schema = schema_for(db_name)
+        with self._lock:
+            self._identity = {key: v for key, v in self._identity.items() if key[0] != schema}
+
+    def metrics(self):
+        with self._lock:
+            return {pool.name: pool.get_stats() for pool in self._pools.values()}
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.close()
+
+
+def sqlalchemy_url(url, schema):
+    """SQLAlchemy URL for the same database, using psycopg 3 and the given schema."""
+    base = re.sub(r'^postgres(ql)?(\+\w+)?://', 'postgresql+psycopg://', url)
+    sep = '&' if '?' in base else '?'
+    return f"{base}{sep}options=-csearch_path%3D{schema}"
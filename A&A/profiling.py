@@ -0,0 +1,174 @@
+"""
+On-demand cProfile of single requests (listed at /admin/profiles).
+
+A request is profiled when an admin asks for it, by sending `X-Profile: 1`
+or adding `?profile=1`, or when it is picked by random sampling at
+PROFILE_SAMPLE_RATE (default 0, i.e. off). Only one request per process is
+profiled at a time; others that ask meanwhile just run normally. That keeps
+the overhead bounded, and cProfile can only have one active profiler per
+thread anyway.
+
+Each profile is written to instance/profiles/ as three files:
+
+    <id>.prof    pstats dump (python -m pstats, snakeviz, ...)
+    <id>.folded  collapsed stacks in microseconds, for flamegraph.pl or speedscope
+    <id>.json    what was profiled: path, endpoint, status, duration, trigger
+
+cProfile records caller -> callee edges, not full stacks. The folded
+stacks are rebuilt from those edges, giving each caller a share of a
+callee's time in proportion to the calls it made. That is exact for tree-shaped
+call graphs and an approximation where a function is called from several
+places. Only the request's own thread is profiled. Work the async views
+hand to the executor threads shows up as time waiting on the loop.
+Only the newest PROFILE_KEEP profiles are kept.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+from datetime import datetime
+
+_SAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name  # built-ins: "<built-in method time.sleep>"
+    return f"{os.path.basename(filename)}:{name}:{line}"
+
+
+def folded_stacks(stats, max_depth=64):
+    """Collapsed-stack lines ("a;b;c <microseconds>") rebuilt from pstats caller data."""
+    callees = {}
+    for func, (_cc, _nc, _tt, _ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))  # edge cumulative time
+    totals = {}
+
+    def walk(func, path, weight):
+        _cc, _nc, tt, ct, _callers = stats.stats[func]
+        if ct <= 0 or weight <= 0:
+            return
+        path = path + (_label(func),)
+        key = ';'.join(path)
+        totals[key] = totals.get(key, 0.0) + weight * (tt / ct)
+        if len(path) >= max_depth:
+            return
+        for callee, edge_ct in callees.get(func, ()):
+            if _label(callee) in path:
+                continue  # recursion: its time is already inside this frame
+            walk(callee, path, weight * edge_ct / ct)
+
+    roots = [f for f, v in stats.stats.items() if not v[4]]
+    for root in roots:
+        walk(root, (), stats.stats[root][3])
+    return [f"{stack} {int(round(seconds * 1e6))}" for stack, seconds in totals.items() if seconds >= 1e-6]
+
+
+class RequestProfiler:
+    def __init__(self, directory, sample_rate=0.0, keep=50):
+        self.directory = directory
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.keep = max(1, keep)
+        self._busy = threading.Lock()
+        self.profiled = 0
+        self.skipped_busy = 0
+
+    @classmethod
+    def from_env(cls, directory):
+        return cls(
+            directory,
+            sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+            keep=int(os.getenv('PROFILE_KEEP', '50')),
+        )
+
+    def trigger(self, requested):
+        """'admin' or 'sampled' when this request should be profiled, else None."""
+        if requested:
+            return 'admin'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def start(self):
+        """A running cProfile.Profile, or None when another request is already being profiled."""
+        if not self._busy.acquire(blocking=False):
+            self.skipped_busy += 1
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is active on this thread
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, meta):
+        """Stop profiling and write the files; returns the profile id."""
+        try:
+            profile.disable()
+        finally:
+            self._busy.release()
+        self.profiled += 1
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        profile_id = f"{stamp}-{_SAFE.sub('_', meta.get('endpoint') or 'unmatched')}"
+        base = os.path.join(self.directory, profile_id)
+        stats = pstats.Stats(profile)
+        stats.dump_stats(base + '.prof')
+        with open(base + '.folded', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(folded_stacks(stats)) + '\n')
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(dict(meta, id=profile_id, created_at=datetime.utcnow().isoformat(timespec='seconds')), f)
+        self._prune()
+        return profile_id
+
+    def _prune(self):
+        metas = sorted(n for n in os.listdir(self.directory) if n.endswith('.json'))
+        for name in metas[:-self.keep]:
+            for ext in ('.json', '.prof', '.folded'):
+                try:
+                    os.remove(os.path.join(self.directory, name[:-5] + ext))
+                except FileNotFoundError:
+                    pass
+
+    def recent(self, limit=50):
+        """Metadata of the newest profiles, newest first."""
+        try:
+            names = sorted((n for n in os.listdir(self.directory) if n.endswith('.json')), reverse=True)
+        except FileNotFoundError:
+            return []
+        out = []
+        for name in names[:limit]:
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return out
+
+    def path_for(self, profile_id, ext):
+        """The file of a stored profile, or None (ids are checked, never joined blindly)."""
+        if ext not in ('.prof', '.folded', '.json') or _SAFE.sub('', profile_id) != profile_id or profile_id.startswith('.'):
+            return None
+        path = os.path.join(self.directory, profile_id + ext)
+        return path if os.path.exists(path) else None
+
+    def report(self, profile_id, sort='cumulative', limit=60):
+        """pstats' text table for one profile."""
+        path = self.path_for(profile_id, '.prof')
+        if path is None:
+            return None
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def metrics(self):
+        return {'sample_rate': self.sample_rate, 'profiled': self.profiled,
+                'skipped_busy': self.skipped_busy, 'active': self._busy.locked()}
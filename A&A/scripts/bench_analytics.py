@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Synthetic benchmark and cross-check for analytics.py.
+
+Generates millions of purchase / booking / subscriber rows, times every metric,
+and verifies the vectorized results against a plain-Python reference on a
+smaller sample.
+
+    python "A&A/scripts/bench_analytics.py" --rows 2000000
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import analytics  # noqa: E402
+
+METHODS = np.array(['card', 'cod', 'demo', 'upi'])
+
+
+def synth(rows, users, seed=7):
+    rng = np.random.default_rng(seed)
+    purchases = np.empty(rows, dtype=analytics.PURCHASE_DTYPE)
+    purchases['user_id'] = rng.integers(1, users + 1, rows)
+    purchases['day'] = 19000 + rng.integers(0, 365, rows)
+    purchases['amount'] = np.round(rng.gamma(2.0, 20.0, rows), 2)
+    purchases['method'] = rng.integers(0, METHODS.size, rows)
+
+    n_book = rows // 4
+    bookings = np.empty(n_book, dtype=analytics.BOOKING_DTYPE)
+    bookings['user_id'] = rng.integers(1, users * 2, n_book)
+    bookings['day'] = 19000 + rng.integers(0, 365, n_book)
+    bookings['party_size'] = rng.integers(1, 6, n_book)
+
+    n_sub = users // 2
+    subscribers = np.empty(n_sub, dtype=analytics.SUBSCRIBER_DTYPE)
+    subscribers['user_id'] = np.where(rng.random(n_sub) < 0.7, rng.integers(1, users * 2, n_sub), 0)
+    subscribers['day'] = 19000 + rng.integers(0, 365, n_sub)
+    return purchases, bookings, subscribers
+
+
+def reference(purchases, bookings, max_weeks):
+    """Straightforward dict-based implementation used to validate the vectorized one."""
+    weeks_by_user = defaultdict(set)
+    for uid, day in zip(purchases['user_id'].tolist(), purchases['day'].tolist()):
+        if uid > 0:
+            weeks_by_user[uid].add((day + 3) // 7)
+    cohorts = defaultdict(lambda: [0] * max_weeks)
+    for weeks in weeks_by_user.values():
+        first = min(weeks)
+        for w in weeks:
+            if w - first < max_weeks:
+                cohorts[first][w - first] += 1
+    matrix = [cohorts[k] for k in sorted(cohorts)]
+
+    first_booking = {}
+    for uid, day in zip(bookings['user_id'].tolist(), bookings['day'].tolist()):
+        if uid > 0:
+            first_booking[uid] = min(day, first_booking.get(uid, day))
+    last_purchase = {}
+    for uid, day in zip(purchases['user_id'].tolist(), purchases['day'].tolist()):
+        last_purchase[uid] = max(day, last_purchase.get(uid, day))
+    converted = sum(1 for uid, d in first_booking.items() if last_purchase.get(uid, -1) >= d)
+    return matrix, converted
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=2_000_000)
+    ap.add_argument('--users', type=int, default=200_000)
+    ap.add_argument('--weeks', type=int, default=12)
+    ap.add_argument('--check-rows', type=int, default=50_000)
+    args = ap.parse_args()
+
+    purchases, bookings, subscribers = synth(args.rows, args.users)
+    print(f"purchases={purchases.size:,} bookings={bookings.size:,} subscribers={subscribers.size:,}")
+
+    for name, fn in [
+        ('cohort_retention', lambda: analytics.cohort_retention(purchases, args.weeks)),
+        ('repeat_purchase_rate', lambda: analytics.repeat_purchase_rate(purchases)),
+        ('aov_by_method', lambda: analytics.aov_by_method(purchases, METHODS.tolist())),
+        ('booking_conversion', lambda: analytics.booking_conversion(bookings, purchases)),
+        ('subscriber_conversion', lambda: analytics.subscriber_conversion(subscribers, purchases)),
+    ]:
+        t0 = time.perf_counter()
+        fn()
+        print(f"  {name:<22} {(time.perf_counter() - t0) * 1000:8.1f} ms")
+
+    small_p, small_b, _ = synth(args.check_rows, max(args.check_rows // 10, 1), seed=11)
+    matrix, converted = reference(small_p, small_b, args.weeks)
+    got = analytics.cohort_retention(small_p, args.weeks)
+    conv = analytics.booking_conversion(small_b, small_p)
+    assert got['matrix'] == matrix, 'cohort matrix mismatch'
+    assert conv['converted_after_booking'] == converted, 'conversion mismatch'
+    print(f"[ok] vectorized results match the reference on {args.check_rows:,} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Sync vs /api/async endpoints under an ASGI server at high concurrency.
+
+Starts `uvicorn asgi:app` on a seeded temporary instance (or adds the
+same rows to DATABASE_URL, if set), signs in as the admin, then drives each pair of
+routes with --concurrency keep-alive connections and reports throughput,
+p50/p99 latency and non-200 answers:
+
+    pip install uvicorn a2wsgi
+    python "A&A/scripts/bench_async.py" --purchases 3000 --concurrency 64 --requests 600
+
+The dashboard pair is where fan-out matters: the sync route reads games.db,
+cafe.db and runs the analytics one after the other, the async one awaits
+all three together.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parents[1]
+PAIRS = (
+    ('catalog search', '/api/books?search=the', '/api/async/books?search=the'),
+    ('games list', '/api/games', '/api/async/games'),
+    ('community feed', '/api/community/messages?limit=50', '/api/async/community/messages?limit=50'),
+    ('admin dashboard', '/admin/dashboard.json', '/api/async/admin/dashboard'),
+)
+
+
+def seed(instance, purchases, bookings):
+    sys.path.insert(0, str(APP_DIR))
+    import dbconn
+    import migrations
+    dbconn.configure(os.getenv('DATABASE_URL'))
+    migrations.run_all(instance)
+    conn = dbconn.connect(os.path.join(instance, 'games.db'))
+    conn.executemany(
+        "INSERT INTO purchase_history (user_id, purchase_date, total_amount, buyer_name, buyer_email, "
+        "payment_method, items_json) VALUES (?, ?, ?, 'Bench', 'bench@example.com', ?, '[]')",
+        [(i % 500 + 2, f"2026-{i % 12 + 1:02d}-{i % 28 + 1:02d}T12:00:00", 5 + i % 50,
+          ('Card', 'Paypal', 'Demo')[i % 3]) for i in range(purchases)])
+    conn.commit()
+    conn.close()
+    conn = dbconn.connect(os.path.join(instance, 'cafe.db'))
+    conn.executemany(
+        "INSERT INTO cafe_bookings (user_id, date, time, party_size, duration_minutes, status, created_at) "
+        "VALUES (?, ?, '12:00', 2, 60, 'confirmed', ?)",
+        [(i % 500 + 2, f"2026-{i % 12 + 1:02d}-{i % 28 + 1:02d}", '2026-01-01T00:00:00') for i in range(bookings)])
+    conn.commit()
+    conn.close()
+    conn = dbconn.connect(os.path.join(instance, 'community.db'))
+    conn.executemany("INSERT INTO community_messages (user_id, author, content, is_admin, created_at) "
+                     "VALUES (1, 'admin', ?, 1, '2026-01-01T00:00:00')", [(f'message {i} ' * 10,) for i in range(500)])
+    conn.commit()
+    conn.close()
+    dbconn.close_all()
+
+
+def login(base):
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    opener = urllib.request.build_opener(NoRedirect)
+    data = urllib.parse.urlencode({'ident': 'admin', 'password': os.getenv('ADMIN_DEFAULT_PASSWORD', 'admin123')})
+    try:
+        resp = opener.open(base + '/login', data=data.encode())
+    except urllib.error.HTTPError as e:
+        resp = e
+    cookie = resp.headers.get('Set-Cookie', '')
+    return cookie.split(';', 1)[0]
+
+
+async def fetch(reader, writer, path, cookie):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\nCookie: {cookie}\r\n\r\n".encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        k, v = line.decode('latin-1').split(':', 1)
+        headers[k.strip().lower()] = v.strip()
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status
+
+
+async def load(port, path, cookie, requests, concurrency):
+    latencies, errors = [], 0
+    remaining = [requests]
+
+    async def worker():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                t0 = time.perf_counter()
+                status = await fetch(reader, writer, path, cookie)
+                latencies.append(time.perf_counter() - t0)
+                errors += status != 200
+        finally:
+            writer.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    return len(latencies) / elapsed, p(.5), p(.99), errors
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--purchases', type=int, default=3000)
+    ap.add_argument('--bookings', type=int, default=1000)
+    ap.add_argument('--requests', type=int, default=600)
+    ap.add_argument('--concurrency', type=int, default=64)
+    ap.add_argument('--threads', type=int, default=32, help='ASGI_THREADS for the server')
+    args = ap.parse_args()
+
+    instance = tempfile.mkdtemp(prefix='async-bench-')
+    seed(instance, args.purchases, args.bookings)
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, INSTANCE_PATH=instance, ASGI_THREADS=str(args.threads),
+               PASSWORD_HASH_WORKERS='0', LOGIN_IP_BURST='1000')
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port), '--log-level', 'warning',
+                               '--no-access-log'], cwd=APP_DIR, env=env)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(base + '/', timeout=2)
+                break
+            except OSError:
+                time.sleep(0.2)
+        cookie = login(base)
+        print(f"{args.purchases} purchases, {args.bookings} bookings; {args.requests} requests per route, "
+              f"{args.concurrency} connections, {args.threads} server threads")
+        for label, sync_path, async_path in PAIRS:
+            for kind, path in (('sync', sync_path), ('async', async_path)):
+                asyncio.run(load(port, path, cookie, min(50, args.requests), 4))  # warm caches and pools
+                rps, p50, p99, errors = asyncio.run(load(port, path, cookie, args.requests, args.concurrency))
+                print(f"{label:<16} {kind:<6} {rps:8.0f} req/s   p50 {p50:8.2f} ms   p99 {p99:8.2f} ms"
+                      f"{f'   non-200: {errors}' if errors else ''}")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
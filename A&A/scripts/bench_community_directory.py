@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Members directory paging benchmark.
+
+Fills a throwaway community.db with --members subscribers (through the real
+migrations), then times the first page, a page near the end of the list
+reached by cursor, and name/email prefix searches. Keyset pages should cost
+the same wherever they are; an OFFSET page is timed for comparison.
+
+    python "A&A/scripts/bench_community_directory.py" --members 100000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def timed(fn, repeat=20):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000, out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--members', type=int, default=100_000)
+    ap.add_argument('--limit', type=int, default=50)
+    args = ap.parse_args()
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    import migrations
+    import community_directory as cd
+
+    inst = tempfile.mkdtemp(prefix='community-bench-')
+    migrations.migrate(os.path.join(inst, 'community.db'), migrations.COMMUNITY)
+    conn = sqlite3.connect(os.path.join(inst, 'community.db'))
+    conn.row_factory = sqlite3.Row
+    rnd = random.Random(7)
+    rows = []
+    for i in range(args.members):
+        name = ''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(4, 10))).title()
+        email = f"{name.lower()}{i}@example.com"
+        rows.append((email, '2026-01-01T00:00:00', name, cd.mask_email(email), cd.name_key(name),
+                     cd.photo_url(f'uploads/community/sub_{i}.png')))
+    conn.executemany(
+        "INSERT INTO community_subscribers(email, joined_at, display_name, email_masked, name_key, photo_url) "
+        "VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    cur = conn.cursor()
+    print(f"{args.members} members in {inst}")
+
+    ms, (page, cursor) = timed(lambda: cd.list_page(cur, args.limit))
+    print(f"first page:          {ms:7.3f} ms ({len(page)} rows)")
+    deep = str(rnd.randint(1, 2 * args.limit))  # cursor close to the oldest member
+    ms, (page, _) = timed(lambda: cd.list_page(cur, args.limit, deep))
+    print(f"last pages (cursor): {ms:7.3f} ms ({len(page)} rows)")
+    offset = max(0, args.members - 2 * args.limit)
+    ms, _ = timed(lambda: cur.execute(
+        "SELECT * FROM community_subscribers ORDER BY id DESC LIMIT ? OFFSET ?", (args.limit, offset)).fetchall())
+    print(f"same page by OFFSET: {ms:7.3f} ms")
+    ms, (page, cursor) = timed(lambda: cd.list_page(cur, args.limit, q='ab'))
+    print(f"name prefix 'ab':    {ms:7.3f} ms ({len(page)} rows)")
+    if cursor:
+        ms, (page, _) = timed(lambda: cd.list_page(cur, args.limit, cursor, q='ab'))
+        print(f"  next page:         {ms:7.3f} ms ({len(page)} rows)")
+    ms, (page, _) = timed(lambda: cd.list_page(cur, args.limit, q='ab', field='email', admin=True))
+    print(f"email prefix 'ab':   {ms:7.3f} ms ({len(page)} rows)")
+    plan = cur.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM community_subscribers WHERE name_key >= 'ab' AND name_key < 'ac' "
+        "ORDER BY name_key, id LIMIT 51").fetchall()
+    print('name search plan:', '; '.join(r[3] for r in plan))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+SQLite connection layer benchmark: a fresh sqlite3.connect() per request with
+default settings (rollback journal, synchronous=FULL) against dbconn's pooled,
+WAL-tuned connections.
+
+Each "request" is what the app does: a catalog read (filtered books query),
+or a purchase insert + commit. Both are run from --threads threads at once,
+on separate copies of the same database, since journal mode is stored in the
+file.
+
+    python "A&A/scripts/bench_dbconn.py" --books 5000 --requests 4000 --threads 8
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+READ_SQL = "SELECT * FROM books WHERE category = ? AND title LIKE ? ORDER BY id LIMIT 50"
+WRITE_SQL = ("INSERT INTO purchase_history (user_id, purchase_date, total_amount, buyer_name, buyer_email, "
+             "payment_method, items_json) VALUES (?, '2026-01-01T00:00:00', 9.99, '', '', 'Demo', '[]')")
+
+
+def run(label, open_conn, books_db, games_db, requests, threads, write_every):
+    done = [0]
+    lock = threading.Lock()
+    latencies = []
+
+    def worker(tid):
+        local = []
+        for i in range(requests // threads):
+            t0 = time.perf_counter()
+            if write_every and i % write_every == 0:
+                conn = open_conn(games_db, False)
+                conn.execute(WRITE_SQL, (tid,))
+                conn.commit()
+            else:
+                conn = open_conn(books_db, True)
+                conn.row_factory = sqlite3.Row
+                conn.execute(READ_SQL, ('fiction', f'%{i % 10}%')).fetchall()
+            conn.close()
+            local.append(time.perf_counter() - t0)
+        with lock:
+            done[0] += len(local)
+            latencies.extend(local)
+
+    t0 = time.perf_counter()
+    ts = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"{label:<28} {done[0] / elapsed:9.0f} req/s   p50 {p(.5):6.2f} ms   p99 {p(.99):7.2f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--books', type=int, default=5000)
+    ap.add_argument('--requests', type=int, default=4000)
+    ap.add_argument('--threads', type=int, default=8)
+    ap.add_argument('--write-every', type=int, default=10, help='one purchase insert per N requests (0 = reads only)')
+    args = ap.parse_args()
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    import dbconn
+    import migrations
+
+    tmp = tempfile.mkdtemp(prefix='dbconn-bench-')
+    seed = os.path.join(tmp, 'seed')
+    os.makedirs(seed)
+    migrations.migrate(os.path.join(seed, 'books.db'), migrations.BOOKS)
+    migrations.migrate(os.path.join(seed, 'games.db'), migrations.GAMES)
+    dbconn.close_all()  # migrate() left pooled handles on the seed files
+    conn = sqlite3.connect(os.path.join(seed, 'books.db'))
+    conn.executemany(
+        "INSERT INTO books (title, author, category, genre, description, buy_price, rent_price) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(f'Book {i}', f'Author {i % 300}', 'fiction' if i % 2 else 'nonfiction', 'Drama', 'x' * 200, 9.99, 2.99)
+         for i in range(args.books)])
+    conn.commit()
+    conn.close()
+    for path in ('books.db', 'games.db'):
+        # Migrations switched the files to WAL; start each run from the default rollback journal
+        c = sqlite3.connect(os.path.join(seed, path))
+        c.execute("PRAGMA journal_mode = DELETE")
+        c.close()
+
+    print(f"{args.books} books, {args.requests} requests over {args.threads} threads, "
+          f"{'1 write per ' + str(args.write_every) if args.write_every else 'reads only'}")
+    for label, opener in (
+        ('sqlite3.connect() defaults', lambda p, ro: sqlite3.connect(p, timeout=30)),
+        ('dbconn pooled + WAL', lambda p, ro: dbconn.connect(p, readonly=ro)),
+    ):
+        run_dir = os.path.join(tmp, label.split()[0].replace('.', '_'))
+        shutil.copytree(seed, run_dir)
+        run(label, opener, os.path.join(run_dir, 'books.db'), os.path.join(run_dir, 'games.db'),
+            args.requests, args.threads, args.write_every)
+    print('pool:', dbconn.metrics())
+    dbconn.close_all()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Move legacy avatars (static/uploads/community/sub_<id>.<ext>) into the
+content-addressed store under instance/avatars, one file per distinct image,
+and point community_subscribers (and users) at the new names. Safe to re-run.
+
+    python "A&A/scripts/dedupe_avatars.py" [instance_path] [--delete-legacy]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(APP_DIR))
+
+import avatars  # noqa: E402
+import community_directory  # noqa: E402
+import migrations  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('instance_path', nargs='?', default=str(APP_DIR.parent / 'instance'))
+    ap.add_argument('--delete-legacy', action='store_true', help='remove the old static files once imported')
+    args = ap.parse_args()
+
+    dbp = os.path.join(args.instance_path, 'community.db')
+    migrations.migrate(dbp, migrations.COMMUNITY)
+    conn = sqlite3.connect(dbp)
+    conn.isolation_level = None
+    rows = conn.execute(
+        "SELECT id, photo_path FROM community_subscribers WHERE photo_path IS NOT NULL AND photo_path NOT LIKE 'avatars/%'"
+    ).fetchall()
+    moved, legacy, names = 0, set(), set()
+    for sub_id, photo_path in rows:
+        src = APP_DIR / 'static' / photo_path.replace('\\', '/')
+        if not src.is_file():
+            print(f"subscriber {sub_id}: {photo_path} missing, left as is")
+            continue
+        try:
+            with open(src, 'rb') as fh:
+                name = avatars.store(args.instance_path, fh, max_bytes=src.stat().st_size)
+        except avatars.AvatarError as e:
+            print(f"subscriber {sub_id}: {photo_path} skipped ({e})")
+            continue
+        new_path = avatars.PREFIX + name
+        conn.execute("BEGIN IMMEDIATE")
+        avatars.incref(conn, name, src.stat().st_size)
+        conn.execute("UPDATE community_subscribers SET photo_path=?, photo_url=? WHERE id=?",
+                     (new_path, community_directory.photo_url(new_path), sub_id))
+        conn.execute("COMMIT")
+        moved += 1
+        legacy.add((photo_path, new_path, src))
+        names.add(name)
+    conn.close()
+
+    users_db = os.path.join(args.instance_path, 'users.db')
+    if os.path.exists(users_db):
+        uconn = sqlite3.connect(users_db)
+        for photo_path, new_path, _ in legacy:
+            uconn.execute("UPDATE users SET photo_path=? WHERE photo_path=?", (new_path, photo_path))
+        uconn.commit()
+        uconn.close()
+
+    if args.delete_legacy:
+        for _, _, src in legacy:
+            src.unlink(missing_ok=True)
+    print(f"{moved} avatars imported as {len(names)} distinct files")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Local SMTP stand-in for trying the notification outbox without a mail server.
+
+Accepts every message and prints one line per delivery (plus a running count).
+It can also inject failures, so you can watch the retries and dead letters:
+
+    python "A&A/scripts/smtp_sink.py" --port 1025 [--fail-rate 0.3] [--reject-domain bad.example]
+    SMTP_HOST=127.0.0.1 SMTP_PORT=1025 python "A&A/app.py"
+
+--fail-rate answers that share of messages with a temporary 451 (retried
+with backoff). --reject-domain answers recipients at that domain with a
+permanent 550 (marked dead). --mbox appends every accepted message to a file.
+"""
+import argparse
+import random
+import socketserver
+import threading
+
+_count = 0
+_count_lock = threading.Lock()
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        opts = self.server.opts
+        self.reply('220 smtp-sink ready')
+        rcpts, data_mode, lines = [], False, []
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            if data_mode:
+                if line != '.':
+                    lines.append(line[1:] if line.startswith('..') else line)
+                    continue
+                data_mode = False
+                if random.random() < opts.fail_rate:
+                    self.reply('451 4.3.0 Try again later')
+                else:
+                    self.deliver(rcpts, lines)
+                    self.reply('250 2.0.0 OK')
+                rcpts, lines = [], []
+                continue
+            cmd = line[:4].upper()
+            if cmd in ('EHLO', 'HELO'):
+                self.reply('250 smtp-sink')
+            elif cmd == 'MAIL':
+                rcpts = []
+                self.reply('250 OK')
+            elif cmd == 'RCPT':
+                addr = line.split(':', 1)[1].strip().strip('<>')
+                if opts.reject_domain and addr.lower().endswith('@' + opts.reject_domain.lower()):
+                    self.reply('550 5.1.1 No such user')
+                else:
+                    rcpts.append(addr)
+                    self.reply('250 OK')
+            elif cmd == 'DATA':
+                if not rcpts:
+                    self.reply('554 No valid recipients')
+                else:
+                    data_mode = True
+                    self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif cmd in ('RSET', 'NOOP'):
+                if cmd == 'RSET':
+                    rcpts = []
+                self.reply('250 OK')
+            elif cmd == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+    def deliver(self, rcpts, lines):
+        global _count
+        subject = next((ln[9:] for ln in lines if ln.lower().startswith('subject: ')), '')
+        with _count_lock:
+            _count += 1
+            n = _count
+            if self.server.opts.mbox:
+                with open(self.server.opts.mbox, 'a', encoding='utf-8') as fh:
+                    fh.write('\n'.join(lines) + '\n\n')
+        print(f"#{n} to={','.join(rcpts)} subject={subject!r}", flush=True)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=1025)
+    ap.add_argument('--fail-rate', type=float, default=0.0)
+    ap.add_argument('--reject-domain', default='')
+    ap.add_argument('--mbox', default='')
+    opts = ap.parse_args()
+    with Server((opts.host, opts.port), Handler) as srv:
+        srv.opts = opts
+        print(f"smtp-sink listening on {opts.host}:{opts.port}", flush=True)
+        try:
+            srv.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
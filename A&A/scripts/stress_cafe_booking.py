@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Oversell stress check for /api/cafe/book.
+
+Many threads, each with its own logged-in session, race to book the same slot
+against a throwaway instance directory. Afterwards the confirmed party sizes
+in every bucket must not exceed CAFE_SLOT_CAPACITY, and the cafe_occupancy
+counters must match the bookings exactly.
+
+    python "A&A/scripts/stress_cafe_booking.py" --threads 32 --attempts 20
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+from collections import Counter
+from pathlib import Path
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--threads', type=int, default=32)
+    ap.add_argument('--attempts', type=int, default=20, help='booking attempts per thread')
+    ap.add_argument('--date', default='2030-01-07')  # a Monday
+    args = ap.parse_args()
+
+    os.environ['INSTANCE_PATH'] = tempfile.mkdtemp(prefix='cafe-stress-')
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    from app import create_app
+    import cafe_occupancy
+
+    app = create_app()
+    app.config['TESTING'] = True
+    # First request runs the one-time DB setup; keep it out of the race
+    app.test_client().get('/')
+    cap = int(os.getenv('CAFE_SLOT_CAPACITY', '10'))
+    times = ['10:00', '10:30', '11:00']
+    outcomes = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads)
+
+    def worker(n):
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s['user'] = f'stress{n}'
+            s['user_id'] = 1000 + n
+        rnd = random.Random(n)
+        barrier.wait()
+        for _ in range(args.attempts):
+            r = client.post('/api/cafe/book', json={
+                'date': args.date, 'time': rnd.choice(times),
+                'partySize': rnd.randint(1, 3), 'duration': rnd.choice([30, 60, 90]),
+            })
+            with lock:
+                outcomes[r.status_code] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    conn = sqlite3.connect(os.path.join(app.instance_path, 'cafe.db'))
+    expected = Counter()
+    for t, d, p in conn.execute(
+            "SELECT time, duration_minutes, party_size FROM cafe_bookings WHERE date=? AND status='confirmed'",
+            (args.date,)):
+        h, m = t.split(':')
+        lo, hi = cafe_occupancy.quantize(int(h) * 60 + int(m), int(h) * 60 + int(m) + d)
+        for b in range(lo, hi, cafe_occupancy.BUCKET_MIN):
+            expected[b] += p
+    counters = {b: s for b, s in conn.execute(
+        "SELECT minute_bucket, seats FROM cafe_occupancy WHERE date=? AND seats > 0", (args.date,))}
+    conn.close()
+
+    print(f"responses: {dict(outcomes)}")
+    print(f"peak seats per bucket: {max(expected.values(), default=0)} (capacity {cap})")
+    assert outcomes[500] == 0, 'server errors during the run'
+    assert all(v <= cap for v in expected.values()), 'oversold a bucket'
+    assert counters == dict(expected), 'occupancy counters drifted from bookings'
+    print('[ok] no oversell; counters match bookings')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Request coalescing ("singleflight") for expensive read paths.
+
+Concurrent callers asking for the same key share one in-flight computation:
+the first caller (the leader) runs it, everyone else blocks until it finishes
+and receives the same result (or the same exception). Nothing is cached once
+the call completes, so results are never staler than a normal request.
+
+Shared results are handed to several requests at once and must be treated as
+read-only by callers.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Call:
+    __slots__ = ('event', 'value', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, max_tracked_keys=512):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # Per-key counters, bounded LRU so arbitrary search strings can't grow it forever
+        self._stats = OrderedDict()
+        self._max_tracked_keys = max_tracked_keys
+
+    def _stat(self, key):
+        st = self._stats.get(key)
+        if st is None:
+            st = {'calls': 0, 'executions': 0, 'coalesced': 0, 'errors': 0,
+                  'wait_seconds': 0.0, 'max_waiters': 0}
+            self._stats[key] = st
+            if len(self._stats) > self._max_tracked_keys:
+                self._stats.popitem(last=False)
+        else:
+            self._stats.move_to_end(key)
+        return st
+
+    def do(self, key, fn):
+        """Run fn() once for all concurrent callers of `key` and return its result."""
+        with self._lock:
+            st = self._stat(key)
+            st['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                st['executions'] += 1
+            else:
+                call.waiters += 1
+                st['coalesced'] += 1
+                st['max_waiters'] = max(st['max_waiters'], call.waiters)
+
+        if not leader:
+            started = time.perf_counter()
+            call.event.wait()
+            with self._lock:
+                self._stat(key)['wait_seconds'] += time.perf_counter() - started
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stat(key)['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.value
+
+    def metrics(self):
+        """Snapshot of per-key counters plus totals, JSON-serializable."""
+        with self._lock:
+            keys = [
+                dict(st, key=_format_key(k), in_flight=k in self._calls, wait_seconds=round(st['wait_seconds'], 6))
+                for k, st in self._stats.items()
+            ]
+            in_flight = len(self._calls)
+        totals = {name: sum(k[name] for k in keys) for name in ('calls', 'executions', 'coalesced', 'errors')}
+        totals['in_flight'] = in_flight
+        return {'totals': totals, 'keys': sorted(keys, key=lambda k: -k['coalesced'])}
+
+
+def _format_key(key):
+    if isinstance(key, tuple):
+        return ':'.join(str(p) for p in key)
+    return str(key)
+
+
+def normalize_term(value):
+    """Normalize an optional free-text filter so equivalent requests share a key."""
+    return (value or '').strip()
@@ -0,0 +1,95 @@
+"""
+Cold-start timing.
+
+After a free-tier instance spins down, the first visitor waits for the
+whole process start. StartupTimer records where that time goes:
+
+- import: loading app.py and everything it imports (Flask, SQLAlchemy, NumPy)
+- init: create_app(), split into named phases (migrations, users.db setup,
+  warm-up, ...)
+- first response: the first request this process serves, how long it took,
+  and how long after init it arrived
+
+The report is logged once the first response is sent and appended to
+instance/startup.jsonl, tagged with the release (RELEASE, or Render's
+RENDER_GIT_COMMIT), so cold starts can be compared across deploys. Under
+gunicorn the master does the import and init, and each worker writes its
+own line when it serves its first request.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class StartupTimer:
+    def __init__(self, import_seconds=None):
+        self.import_seconds = import_seconds
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.init_seconds = None
+        self.first_response = None
+        self._ready_at = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - t0, 4)
+
+    def ready(self):
+        self._ready_at = time.perf_counter()
+        self.init_seconds = round(self._ready_at - self.started, 4)
+
+    def waiting_for_first_response(self):
+        return self.first_response is None
+
+    def record_first_response(self, path, status, started):
+        """Record the first response served by this process; True only for that one."""
+        now = time.perf_counter()
+        with self._lock:
+            if not self.waiting_for_first_response():
+                return False
+            self.first_response = {
+                'path': path,
+                'status': status,
+                'seconds': round(now - started, 4),
+                'after_init_seconds': round(started - self._ready_at, 4) if self._ready_at else None,
+            }
+            return True
+
+    def report(self):
+        return {
+            'release': os.getenv('RELEASE') or os.getenv('RENDER_GIT_COMMIT') or None,
+            'pid': os.getpid(),
+            'recorded_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'import_seconds': round(self.import_seconds, 4) if self.import_seconds is not None else None,
+            'init_seconds': self.init_seconds,
+            'phases': dict(self.phases),
+            'first_response': self.first_response,
+        }
+
+    def save(self, path):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.report()) + '\n')
+
+
+def history(path, limit=20):
+    """The last `limit` saved reports, oldest first."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()[-limit:]
+    except FileNotFoundError:
+        return []
+    out = []
+    for line in lines:
+        try:
+            out.append(json.loads(line))
+        except ValueError:
+            continue
+    return out
@@ -0,0 +1,271 @@
+"""
+In-process request tracing: nested spans, exported as JSON lines and drawn
+as a waterfall at /admin/traces/<id>.
+
+A traced request gets a root span. Inside it, anything can open a child:
+
+    with tracing.span('price cart', items=len(items)):
+        ...
+
+The current span lives in a contextvar. Spans therefore nest across
+function calls, and the async views' executor threads (which run in a
+copy of the request's context) attach to the right parent. Outside a
+traced request span() costs one contextvar read and does nothing.
+
+Automatic spans (wired up in app.py):
+
+    db        every statement through dbconn (SQLite, PostgreSQL, users.db)
+    template  each render_template, with the lazy context values it pulls
+    context   the context processors and each lazy template value
+    json      JSON encoding of jsonify() responses
+    session   saving (serializing and signing) the session cookie
+
+Requests are traced when an admin asks for it (`?trace=1` or
+`X-Trace: 1`) or at TRACE_SAMPLE_RATE (default 0). Finished traces are
+appended to instance/traces.jsonl, one JSON object per line, shared by
+all workers. The file is rotated to traces.jsonl.1 past TRACE_MAX_BYTES.
+"""
+import functools
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+_current = ContextVar('trace_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace', 'id', 'parent', 'name', 'kind', 'start', 'end', 'attrs')
+
+    def __init__(self, trace, parent, name, kind, start, attrs):
+        self.trace, self.parent, self.name, self.kind = trace, parent, name, kind
+        self.start, self.end, self.attrs = start, None, attrs
+        self.id = trace.add(self)
+
+    def as_dict(self, origin):
+        return {
+            'id': self.id,
+            'parent': self.parent,
+            'name': self.name,
+            'kind': self.kind,
+            'start_ms': round((self.start - origin) * 1000, 3),
+            'duration_ms': round(((self.end or self.start) - self.start) * 1000, 3),
+            'attrs': self.attrs or None,
+        }
+
+
+class Trace:
+    def __init__(self, trigger):
+        self.id = secrets.token_hex(8)
+        self.trigger = trigger
+        self.started_at = datetime.utcnow()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+            return len(self.spans)
+
+    def as_dict(self, **extra):
+        root = self.spans[0]
+        return dict(extra, trace_id=self.id, trigger=self.trigger,
+                    started_at=self.started_at.isoformat(timespec='milliseconds'),
+                    duration_ms=round(((root.end or root.start) - root.start) * 1000, 3),
+                    spans=[s.as_dict(root.start) for s in list(self.spans)])
+
+
+def current_trace():
+    span = _current.get()
+    return span.trace if span is not None else None
+
+
+@contextmanager
+def span(name, kind='code', **attrs):
+    """Time the block as a child of the current span (a no-op outside a traced request)."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, parent.id, name, kind, time.perf_counter(), attrs)
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _current.reset(token)
+
+
+def record(name, kind, started, seconds, **attrs):
+    """Add an already finished span (e.g. a statement reported after it ran)."""
+    parent = _current.get()
+    if parent is None:
+        return
+    child = Span(parent.trace, parent.id, name, kind, started, attrs)
+    child.end = started + seconds
+
+
+def record_sql(database, sql, started, seconds):
+    """dbconn listener."""
+    if _current.get() is not None:
+        record(database, 'db', started, seconds, statement=' '.join(sql.split())[:300])
+
+
+def traced(name, kind='code'):
+    """Decorator form of span()."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name, kind):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def instrument_flask(app):
+    """Template, context processor, JSON and session-save spans for a Flask app.
+
+    Call after the context processors are registered and before any
+    template is compiled (templates keep the class they were loaded with).
+    """
+    from flask.json.provider import DefaultJSONProvider
+    from flask.sessions import SecureCookieSessionInterface
+    from jinja2 import Template
+
+    class TracedTemplate(Template):
+        def render(self, *args, **kwargs):
+            with span(self.name or 'template', 'template'):
+                return super().render(*args, **kwargs)
+
+    class TracedJSONProvider(type(app.json) if isinstance(app.json, DefaultJSONProvider) else DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            with span('json encode', 'json'):
+                return super().dumps(obj, **kwargs)
+
+    class TracedSessionInterface(type(app.session_interface)
+                                 if isinstance(app.session_interface, SecureCookieSessionInterface)
+                                 else SecureCookieSessionInterface):
+        def save_session(self, app, session, response):
+            with span('session save', 'session'):
+                return super().save_session(app, session, response)
+
+    app.jinja_env.template_class = TracedTemplate
+    app.json = TracedJSONProvider(app)
+    app.session_interface = TracedSessionInterface()
+    for bp, processors in app.template_context_processors.items():
+        app.template_context_processors[bp] = [
+            traced(f"context processor {getattr(fn, '__name__', 'anonymous')}", 'context')(fn) for fn in processors]
+
+
+class Tracer:
+    def __init__(self, path, sample_rate=0.0, max_bytes=5 * 1024 * 1024):
+        self.path = path
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.max_bytes = max_bytes
+        self._write_lock = threading.Lock()
+        self.exported = 0
+
+    @classmethod
+    def from_env(cls, path):
+        return cls(
+            path,
+            sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', '0')),
+            max_bytes=int(os.getenv('TRACE_MAX_BYTES', str(5 * 1024 * 1024))),
+        )
+
+    def trigger(self, requested):
+        if requested:
+            return 'admin'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def begin(self, name, trigger, **attrs):
+        """Start a trace with its root span; returns (trace, token) for finish()."""
+        trace = Trace(trigger)
+        root = Span(trace, None, name, 'request', time.perf_counter(), attrs)
+        return trace, _current.set(root)
+
+    def finish(self, handle, **extra):
+        trace, token = handle
+        trace.spans[0].end = time.perf_counter()
+        try:
+            _current.reset(token)
+        except ValueError:
+            _current.set(None)
+        self.export(trace.as_dict(**extra))
+        return trace.id
+
+    def export(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._write_lock:
+            try:
+                if os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+            except FileNotFoundError:
+                pass
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.exported += 1
+
+    def recent(self, limit=50, tail_bytes=2 * 1024 * 1024):
+        """The newest exported traces (from every worker), newest first."""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - tail_bytes))
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        lines = data.split(b'\n')
+        if size > tail_bytes:
+            lines = lines[1:]  # the first one is probably cut in half
+        out = []
+        for line in reversed(lines):
+            if not line.strip():
+                continue
+            try:
+                out.append(json.loads(line))
+            except ValueError:
+                continue
+            if len(out) >= limit:
+                break
+        return out
+
+    def find(self, trace_id):
+        for path in (self.path, self.path + '.1'):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    for line in f:
+                        if trace_id in line:
+                            try:
+                                rec = json.loads(line)
+                            except ValueError:
+                                continue
+                            if rec.get('trace_id') == trace_id:
+                                return rec
+            except FileNotFoundError:
+                continue
+        return None
+
+
+def waterfall(record):
+    """Spans in tree order with their depth, for the waterfall view."""
+    children = {}
+    for s in record['spans']:
+        children.setdefault(s['parent'], []).append(s)
+    out = []
+
+    def walk(parent, depth):
+        for s in sorted(children.get(parent, ()), key=lambda s: s['start_ms']):
+            out.append(dict(s, depth=depth))
+            walk(s['id'], depth + 1)
+
+    walk(None, 0)
+    return out
@@ -0,0 +1,15 @@
+"""
+WSGI entry point, for WSGI servers (production uses asgi.py, see
+gunicorn.conf.py):
+
+    gunicorn --worker-class gthread --threads 8 wsgi:app
+
+Each open Server-Sent Events stream holds a thread here, so keep
+SSE_MAX_STREAMS below the thread count.
+"""
+try:
+    from .app import create_app
+except ImportError:
+    from app import create_app
+
+app = create_app()